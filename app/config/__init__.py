@@ -1,4 +1,13 @@
 """
 Configuration module.
 """
-from .database import Base, SessionLocal, engine
+from .database import (AsyncSessionLocal, Base, SessionLocal, async_engine,
+                       engine, get_async_db, get_db, run_query)
+from .settings import (BULK_BATCH_SIZE, BULK_MAX_RECORD_BYTES, BULK_WORKERS,
+                       CACHE_MAX_BYTES, CANVAS_HEIGHT, CANVAS_MAX_HEIGHT,
+                       CANVAS_MAX_WIDTH, CANVAS_WIDTH, CONTAINS_CACHE_SIZE,
+                       FILL_BAND_HEIGHT, FILL_MEMMAP, FILL_PACKED,
+                       FILL_WORKERS, FLOOD_MAX_SPANS, JOB_MAX_PENDING,
+                       JOB_RESUME_SECONDS, JOB_WORKERS, METRICS_TRACEMALLOC,
+                       POLYS_MAX_LIMIT, POLYS_PAGE_LIMIT, PREVIEW_MAX_SIZE,
+                       SPATIAL_REFRESH_SECONDS, TILE_SIZE)
@@ -2,25 +2,137 @@
 Database configuration file.
 """
 import os
-from pathlib import Path
 
-import dotenv
 from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from starlette.concurrency import run_in_threadpool
 
-# Load environment variables from .env file
-BASE_DIR = Path(__file__).resolve().parents[2]
-dotenv_file = os.path.join(BASE_DIR, ".env")
+from .environment import env_flag
 
-if os.path.isfile(dotenv_file):
-    dotenv.load_dotenv(dotenv_file)
-
-# Engine connection string
-engine = create_engine(
+# Engine connection string, built from its parts unless given in full
+DATABASE_URL = os.environ.get(
+    "DATABASE_URL",
     f'postgresql://{os.environ.get("DATABASE_USER")}:{os.environ.get("DATABASE_PASSWORD")}@{os.environ.get("DATABASE_HOST")}/{os.environ.get("DATABASE_NAME")}',
-    echo=True,
 )
 
+# Optional async connection string, e.g. postgresql+asyncpg://... or sqlite+aiosqlite:///
+DATABASE_ASYNC_URL = os.environ.get("DATABASE_ASYNC_URL")
+
+# Engine tuning
+DATABASE_ECHO = env_flag("DATABASE_ECHO", False)
+DATABASE_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 5))
+DATABASE_MAX_OVERFLOW = int(os.environ.get("DATABASE_MAX_OVERFLOW", 10))
+DATABASE_POOL_PRE_PING = env_flag("DATABASE_POOL_PRE_PING", True)
+
+
+def engine_options(url):
+    """
+    Keyword arguments of an engine.
+
+    Parameters
+    ----------
+    url : str
+        Connection string of the engine.
+
+    Returns
+    -------
+    dict
+        Echo and pool options of the engine.
+    """
+    options = {"echo": DATABASE_ECHO, "pool_pre_ping": DATABASE_POOL_PRE_PING}
+
+    # sqlite engines do not use a sized connection pool
+    if not url.startswith("sqlite"):
+        options["pool_size"] = DATABASE_POOL_SIZE
+        options["max_overflow"] = DATABASE_MAX_OVERFLOW
+
+    return options
+
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+
 # Create a configured "Session" class
 Base = declarative_base()
 SessionLocal = sessionmaker(bind=engine)
+
+# Async engine, the asyncio extension and its driver are only needed when set
+async_engine = None
+AsyncSessionLocal = None
+
+if DATABASE_ASYNC_URL:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    async_engine = create_async_engine(
+        DATABASE_ASYNC_URL, **engine_options(DATABASE_ASYNC_URL)
+    )
+    AsyncSessionLocal = sessionmaker(
+        bind=async_engine, class_=AsyncSession, expire_on_commit=False
+    )
+
+
+def get_db():
+    """
+    Open a database session for a single request.
+
+    Yield
+    -------
+    Session
+        The session, closed once the request is done.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """
+    Open a database session for a single async request.
+
+    The session is async when an async engine is configured and a regular
+    session otherwise, run its queries with ``run_query``.
+
+    Yield
+    -------
+    AsyncSession or Session
+        The session, closed once the request is done.
+    """
+    if AsyncSessionLocal is None:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+        return
+
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def run_query(db, query, *args):
+    """
+    Run database work on a session from ``get_async_db``.
+
+    The work is written against a regular session: it runs on the async
+    engine without blocking the event loop when there is one, and on
+    the threadpool otherwise.
+
+    Parameters
+    ----------
+    db : AsyncSession or Session
+        The session of the request.
+    query : callable
+        Function taking the session and the arguments.
+    args : tuple
+        Arguments of the function.
+
+    Returns
+    -------
+    object
+        The result of the function.
+    """
+    if async_engine is not None:
+        return await db.run_sync(query, *args)
+
+    return await run_in_threadpool(query, db, *args)
@@ -0,0 +1,37 @@
+"""
+Environment variables of the configuration.
+"""
+import os
+from pathlib import Path
+
+import dotenv
+
+# Load environment variables from .env file
+BASE_DIR = Path(__file__).resolve().parents[2]
+dotenv_file = os.path.join(BASE_DIR, ".env")
+
+if os.path.isfile(dotenv_file):
+    dotenv.load_dotenv(dotenv_file)
+
+
+def env_flag(name, default):
+    """
+    Read a boolean environment variable.
+
+    Parameters
+    ----------
+    name : str
+        Name of the variable.
+    default : bool
+        Value when the variable is not set.
+
+    Returns
+    -------
+    bool
+        The value of the variable.
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+
+    return value.lower() in ["1", "true", "yes"]
@@ -0,0 +1,71 @@
+"""
+Application settings.
+"""
+import os
+
+from .environment import env_flag
+
+# Maximum number of spans a flood fill may keep on its stack per request
+FLOOD_MAX_SPANS = int(os.environ.get("FLOOD_MAX_SPANS", 1000000))
+
+# Default canvas of the fills, in rows and columns
+CANVAS_HEIGHT = int(os.environ.get("CANVAS_HEIGHT", 19200))
+CANVAS_WIDTH = int(os.environ.get("CANVAS_WIDTH", 10800))
+
+# Largest canvas a request may ask for
+CANVAS_MAX_HEIGHT = int(os.environ.get("CANVAS_MAX_HEIGHT", CANVAS_HEIGHT))
+CANVAS_MAX_WIDTH = int(os.environ.get("CANVAS_MAX_WIDTH", CANVAS_WIDTH))
+
+# Fill rourke, fast and outline masks in memory with 1 bit per pixel
+FILL_PACKED = env_flag("FILL_PACKED", True)
+
+# Number of processes rasterizing bands of rows of a single fill
+FILL_WORKERS = int(os.environ.get("FILL_WORKERS", 1))
+
+# Number of rows of every band rasterized by a fill worker
+FILL_BAND_HEIGHT = int(os.environ.get("FILL_BAND_HEIGHT", 1024))
+
+# Fill npy results directly into their memory-mapped file in the data folder
+FILL_MEMMAP = env_flag("FILL_MEMMAP", False)
+
+# Number of worker processes running asynchronous fill jobs
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+
+# Maximum number of asynchronous fill jobs waiting or running at once
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", 100))
+
+# Seconds during which a job requeued at startup is not requeued again, by the
+# other worker processes of the app starting at the same time
+JOB_RESUME_SECONDS = int(os.environ.get("JOB_RESUME_SECONDS", 60))
+
+# Number of threads filling the records of a bulk upload
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", 4))
+
+# Number of poly items of a bulk upload inserted in one transaction
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 500))
+
+# Maximum number of bytes of a record of a bulk upload
+BULK_MAX_RECORD_BYTES = int(os.environ.get("BULK_MAX_RECORD_BYTES", 16 * 1024 * 1024))
+
+# Maximum number of bytes of fill masks kept in memory by the result cache
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Number of edge indexes of polys kept in memory for point queries
+CONTAINS_CACHE_SIZE = int(os.environ.get("CONTAINS_CACHE_SIZE", 64))
+
+# Rows and columns of the tiles of tiled masks, a multiple of 8
+TILE_SIZE = int(os.environ.get("TILE_SIZE", 256))
+
+# Maximum number of rows and columns of the preview images
+PREVIEW_MAX_SIZE = int(os.environ.get("PREVIEW_MAX_SIZE", 512))
+
+# Number of poly items of a listing page by default and at most
+POLYS_PAGE_LIMIT = int(os.environ.get("POLYS_PAGE_LIMIT", 100))
+POLYS_MAX_LIMIT = int(os.environ.get("POLYS_MAX_LIMIT", 1000))
+
+# Seconds of changes to the polys read again by every spatial search, longer
+# than the transactions writing polys so no change committed late is missed
+SPATIAL_REFRESH_SECONDS = int(os.environ.get("SPATIAL_REFRESH_SECONDS", 60))
+
+# Trace the peak memory of every fill stage with tracemalloc, slows fills down
+METRICS_TRACEMALLOC = env_flag("METRICS_TRACEMALLOC", False)
@@ -1,4 +1,5 @@
 """
 Models module.
 """
+from .job import Job
 from .poly import Poly
@@ -0,0 +1,49 @@
+"""
+Fill job data model.
+"""
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
+
+from app.config import Base
+
+
+class Job(Base):
+    """
+    Fill job data model.
+    """
+
+    __tablename__ = "job"
+
+    id = Column(String(36), primary_key=True)
+    name = Column(String(255), nullable=False)
+    status = Column(String(32), nullable=False, index=True)
+    payload = Column(Text, nullable=False)
+    poly_id = Column(Integer, ForeignKey("poly.id", ondelete="SET NULL"), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    resumed_at = Column(DateTime, nullable=True)
+
+    @property
+    def queue_time(self):
+        """
+        Seconds the job waited before it started running.
+        """
+        if self.started_at is None:
+            return None
+        return (self.started_at - self.created_at).total_seconds()
+
+    @property
+    def run_time(self):
+        """
+        Seconds the job took to run.
+        """
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+
+    def __repr__(self):
+        """
+        Job representation string.
+        """
+        return f"Job id: {self.id}"
@@ -1,7 +1,10 @@
 """
 Poly data model.
 """
-from sqlalchemy import Column, Float, Integer, String, Text
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, Float, Index, Integer, LargeBinary,
+                        String, Text)
 
 from app.config import Base
 
@@ -12,16 +15,42 @@ class Poly(Base):
     """
 
     __tablename__ = "poly"
+    __table_args__ = (
+        # keyset pages filtered by algorithm
+        Index("ix_poly_algorithm_id", "algorithm", "id"),
+        # keyset pages sorted by area
+        Index("ix_poly_area_id", "area", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=False, unique=True)
     npinput = Column(Text, nullable=True)
+    vertices = Column(LargeBinary, nullable=True)
+    vertex_dtype = Column(String(16), nullable=True)
+    rings = Column(Text, nullable=True)
+    fill_rule = Column(String(16), nullable=True)
+    xmin = Column(Float, nullable=True)
+    ymin = Column(Float, nullable=True)
+    xmax = Column(Float, nullable=True)
+    ymax = Column(Float, nullable=True)
+    area = Column(Float, nullable=True)
+    pixels = Column(Integer, nullable=True)
     xsize = Column(Integer, nullable=True)
     ysize = Column(Integer, nullable=True)
+    xoffset = Column(Integer, nullable=True)
+    yoffset = Column(Integer, nullable=True)
+    xcanvas = Column(Integer, nullable=True)
+    ycanvas = Column(Integer, nullable=True)
     imagefile = Column(String(255), nullable=True)
     arrayfile = Column(String(255), nullable=True)
-    exectime = Column(Float, nullable=True)
+    exectime = Column(Float, nullable=True, index=True)
+    exectime_stages = Column(Text, nullable=True)
     algorithm = Column(String(255), nullable=False, unique=False)
+    content_hash = Column(String(64), nullable=True, index=True)
+    # read back by the spatial index of every process
+    updated_at = Column(
+        DateTime, nullable=True, index=True, default=datetime.now, onupdate=datetime.now
+    )
 
     def __repr__(self):
         """
@@ -1,5 +1,7 @@
 """
 Endpoints module.
 """
-from .poly_router import db
+from .cache_router import router as cache_router
+from .job_router import router as job_router
+from .metrics_router import router as metrics_router
 from .poly_router import router as poly_router
@@ -0,0 +1,18 @@
+"""
+Endpoints for the fill result cache.
+"""
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+
+from app.services.cache_service import cache_stats
+
+# Create a new router
+router = APIRouter()
+
+
+@router.get("/cache")
+def get_cache_stats():
+    """
+    Retrieve the hit and miss counters of the result cache.
+    """
+    return JSONResponse(cache_stats(), status_code=status.HTTP_200_OK)
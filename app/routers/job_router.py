@@ -0,0 +1,30 @@
+"""
+Endpoints for the fill jobs.
+"""
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from app.config import get_async_db, run_query
+from app.serializers import JobSerializer
+from app.services.job_service import query_job
+
+# Create a new router
+router = APIRouter()
+
+
+@router.get(
+    "/jobs/{job_id}", response_model=JobSerializer, status_code=status.HTTP_200_OK
+)
+async def get_job_details(job_id: str, db=Depends(get_async_db)):
+    """
+    Retrieve the status of a fill job.
+
+    param str job_id: The id of the job.
+    return Job job: The job with its status and timings.
+    """
+    job = await run_query(db, query_job, job_id)
+
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Job not found"
+        )
+    return job
@@ -0,0 +1,22 @@
+"""
+Endpoints for the fill metrics.
+"""
+from fastapi import APIRouter, status
+from fastapi.responses import PlainTextResponse
+
+from app.services.metrics_service import render_metrics
+
+# Create a new router
+router = APIRouter()
+
+
+@router.get("/metrics")
+def get_metrics():
+    """
+    Retrieve the stage histograms of this process, in the Prometheus text format.
+    """
+    return PlainTextResponse(
+        render_metrics(),
+        status_code=status.HTTP_200_OK,
+        media_type="text/plain; version=0.0.4",
+    )
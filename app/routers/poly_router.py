@@ -1,133 +1,910 @@
 """
 Endpoints for the poly API.
 """
-import json
-from typing import List
+from typing import Optional
 
-from fastapi import APIRouter, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi import (APIRouter, BackgroundTasks, Depends, HTTPException,
+                     Request, status)
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.config import SessionLocal
+from app.config import POLYS_PAGE_LIMIT, get_async_db, get_db, run_query
 from app.models import Poly
-from app.serializers import PolySerializer
-from app.services.file_management import (save_matplot_figure,
-                                          save_nparray_to_file)
-from app.services.filling_service import fill_polyline
+from app.serializers import (CombineSerializer, PolyEditSerializer,
+                             PolySerializer)
+from app.services.bulk_service import DuplexStreamingResponse, ingest_records
+from app.services.cache_service import release_artifacts, settle_artifact
+from app.services.combine_service import (combine_masks, combine_polys,
+                                          encode_combined, query_inputs)
+from app.services.contains_service import contains_points, encode_classes
+from app.services.download_service import (artifact_etag, artifact_size,
+                                           etag_matches, parse_range,
+                                           stream_file)
+from app.services.edit_service import edit_poly
+from app.services.filling_service import CANVAS_SHAPE
+from app.services.job_service import submit_job
+from app.services.metrics_service import StageTimer
+from app.services.poly_service import (check_canvas, encode_polys,
+                                       poly_columns, poly_details,
+                                       process_poly, query_poly, query_polys,
+                                       stored_stats, validate_poly)
+from app.services.preview_service import (encode_tile_png, poly_tile,
+                                          render_poly_preview)
+from app.services.spatial_service import query_box, search_polys, spatial_index
+from app.services.stats_service import polygon_stats
+from app.services.vertex_service import (parse_binary_vertices, parse_rings,
+                                         parse_ring_sizes, parse_vertices)
 
 # Create a new router
 router = APIRouter()
-db = SessionLocal()
 
 
-@router.get(
-    "/polys", response_model=List[PolySerializer], status_code=status.HTTP_200_OK
-)
-def get_all_polys():
+@router.get("/polys", status_code=status.HTTP_200_OK)
+async def get_all_polys(
+    request: Request,
+    after_id: Optional[int] = None,
+    limit: int = POLYS_PAGE_LIMIT,
+    fields: Optional[str] = None,
+    algorithm: Optional[str] = None,
+    min_exectime: Optional[float] = None,
+    max_exectime: Optional[float] = None,
+    min_area: Optional[float] = None,
+    max_area: Optional[float] = None,
+    sort: str = "id",
+    db=Depends(get_async_db),
+):
     """
-    Retrieve all poly items.
+    Retrieve a page of poly items, in id or area order.
+
+    param int after_id: The id of the last poly item of the previous page.
+    param int limit: Maximum number of poly items of the page.
+    param str fields: Comma separated fields to return, all but npinput by default.
+    param str algorithm: Only poly items filled with this algorithm.
+    param float min_exectime: Only poly items that took at least this long.
+    param float max_exectime: Only poly items that took at most this long.
+    param float min_area: Only poly items with at least this area.
+    param float max_area: Only poly items with at most this area.
+    param str sort: Order of the poly items: id, area or -area.
+    return list polys: The poly items, the Link header points to the next page.
     """
-    polys = db.query(Poly).all()
+    try:
+        names = poly_columns(fields)
+        rows = await run_query(
+            db,
+            query_polys,
+            names,
+            after_id,
+            limit,
+            algorithm,
+            min_exectime,
+            max_exectime,
+            min_area,
+            max_area,
+            sort,
+        )
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error),
+        )
 
-    return polys
+    headers = {}
+    if len(rows) == limit:
+        next_url = request.url.include_query_params(after_id=rows[-1][0])
+        headers["Link"] = f'<{next_url}>; rel="next"'
+
+    return StreamingResponse(
+        encode_polys(names, rows), media_type="application/json", headers=headers
+    )
+
+
+@router.get("/polys/search", status_code=status.HTTP_200_OK)
+async def search_poly_items(
+    request: Request,
+    row: Optional[float] = None,
+    column: Optional[float] = None,
+    bbox: Optional[str] = None,
+    exact: bool = False,
+    after_id: Optional[int] = None,
+    limit: int = POLYS_PAGE_LIMIT,
+    db=Depends(get_async_db),
+):
+    """
+    Retrieve a page of the poly items intersecting a point or a bounding box.
+
+    param float row: The row of the point.
+    param float column: The column of the point.
+    param str bbox: Comma separated min row, min column, max row and max column.
+    param bool exact: Check the polygons, not only their bounding boxes.
+    param int after_id: The id of the last poly item of the previous page.
+    param int limit: Maximum number of poly items of the page.
+    return list polys: The id, name and bbox of the poly items, in id order.
+    """
+    try:
+        box = query_box(row, column, bbox)
+        polys = await run_query(db, search_polys, box, exact, after_id, limit)
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error),
+        )
+
+    headers = {}
+    if len(polys) == limit:
+        next_url = request.url.include_query_params(after_id=polys[-1]["id"])
+        headers["Link"] = f'<{next_url}>; rel="next"'
+
+    return JSONResponse(polys, headers=headers)
 
 
 @router.get(
     "/polys/{poly_id}", response_model=PolySerializer, status_code=status.HTTP_200_OK
 )
-def get_poly_details(poly_id: int):
+async def get_poly_details(poly_id: int, db=Depends(get_async_db)):
     """
     Retrieve details related to poly item.
 
     param int poly_id: The id of the poly item.
     return Poly poly: The poly item.
     """
-    poly = db.query(Poly).filter(Poly.id == poly_id).first()
+    poly = await run_query(db, query_poly, poly_id)
+
+    if poly is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Poly not found"
+        )
+    return poly_details(poly)
+
+
+@router.post("/polys/{poly_id}/contains", status_code=status.HTTP_200_OK)
+async def contains_poly_points(
+    poly_id: int,
+    request: Request,
+    dtype: Optional[str] = None,
+    output: str = "json",
+    db=Depends(get_async_db),
+):
+    """
+    Classify points relative to a poly item.
+
+    The request body holds a JSON array of [row, column] pairs, or the
+    pairs packed as little-endian values when dtype is set. Every point
+    is classified as 0 outside, 1 inside, 2 vertex or 3 edge, points of
+    combined masks by their pixel, as 0 or 1.
+
+    param int poly_id: The id of the poly item.
+    param str dtype: Type of the packed coordinates: int32 or float64.
+    param str output: Format of the classes: json or binary, one byte per point.
+    return list classes: The class of every point, in order.
+    """
+    if output not in ["json", "binary"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid output. Pick one of: json, binary",
+        )
+
+    timer = StageTimer()
+    body = await request.body()
+    try:
+        with timer.stage("parse"):
+            if dtype is None:
+                points = parse_vertices(body.decode())
+            else:
+                points = parse_binary_vertices(body, dtype)
+    except (UnicodeDecodeError, ValueError) as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error),
+        )
+
+    with timer.stage("lookup"):
+        poly = await run_query(db, query_poly, poly_id)
+    if poly is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Poly not found"
+        )
+
+    with timer.stage("classify"):
+        classes = await run_in_threadpool(contains_points, poly, points)
+
+    headers = {"Server-Timing": timer.server_timing()}
+    if output == "binary":
+        return Response(
+            classes.tobytes(), media_type="application/octet-stream", headers=headers
+        )
+
+    return Response(
+        encode_classes(classes), media_type="application/json", headers=headers
+    )
+
+
+@router.get("/polys/{poly_id}/stats", status_code=status.HTTP_200_OK)
+def get_poly_stats(poly_id: int, extents: bool = False, db: Session = Depends(get_db)):
+    """
+    Compute the statistics of a poly item from its vertices.
+
+    param int poly_id: The id of the poly item.
+    param bool extents: Also return the [row, first column, stop column] of every row.
+    return JSONResponse: The area, centroid, bbox and filled pixels of the poly item.
+    """
+    poly = query_poly(db, poly_id)
 
     if poly is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Poly not found"
         )
-    return poly
+
+    timer = StageTimer()
+    with timer.stage("stats"):
+        stats = stored_stats(db, poly, extents)
+
+    return JSONResponse(stats, headers={"Server-Timing": timer.server_timing()})
+
+
+@router.get("/polys/{poly_id}/array", status_code=status.HTTP_200_OK)
+async def download_poly_array(
+    poly_id: int, request: Request, db=Depends(get_async_db)
+):
+    """
+    Download the stored mask of a poly item.
+
+    The file is streamed in its stored format, a single byte Range is
+    honoured and repeated requests with the ETag get 304 Not Modified.
+
+    param int poly_id: The id of the poly item.
+    return bytes file: The npy, packbits, rle or tiles file of the mask.
+    """
+    poly = await run_query(db, query_poly, poly_id)
+    if poly is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Poly not found"
+        )
+
+    return await send_artifact(
+        request, poly, "array", poly.arrayfile, "application/octet-stream"
+    )
+
+
+@router.get("/polys/{poly_id}/preview", status_code=status.HTTP_200_OK)
+async def download_poly_preview(
+    poly_id: int, request: Request, db=Depends(get_async_db)
+):
+    """
+    Download the PNG preview of a poly item.
+
+    A preview still waiting for its background rendering is rendered
+    first. Ranges and ETags work as for the array.
+
+    param int poly_id: The id of the poly item.
+    return bytes file: The PNG image.
+    """
+    poly = await run_query(db, query_poly, poly_id)
+    if poly is None or poly.imagefile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Preview not found"
+        )
+
+    # the ETag of hashed polys holds without the file
+    fresh = poly.content_hash is not None and etag_matches(
+        request.headers.get("if-none-match"), artifact_etag(poly, "preview")
+    )
+    if not fresh:
+        await run_in_threadpool(
+            render_poly_preview, poly.content_hash, poly.arrayfile, poly.imagefile
+        )
+
+    return await send_artifact(request, poly, "preview", poly.imagefile, "image/png")
+
+
+async def send_artifact(request, poly, kind, path, media_type):
+    """
+    Answer a download request for an artifact of a poly item.
+
+    The ETag is checked before the file is opened, so a matching
+    If-None-Match answers 304 without touching disk.
+
+    params Request request: The download request.
+    params Poly poly: The poly item.
+    params str kind: The artifact: array or preview.
+    params str path: Path of the artifact.
+    params str media_type: Media type of the artifact.
+    return Response: The whole file, a range of it, or no content.
+    """
+    etag = await run_in_threadpool(artifact_etag, poly, kind)
+    headers = {"Accept-Ranges": "bytes"}
+    if etag is not None:
+        headers["ETag"] = etag
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    size = await run_in_threadpool(artifact_size, path)
+    if size is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
+        )
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except ValueError as error:
+            # the name of the 416 constant differs across starlette versions
+            raise HTTPException(
+                status_code=416,
+                detail=str(error),
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+
+    status_code = status.HTTP_200_OK
+    start, stop = 0, size
+    if byte_range is not None:
+        start, stop = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    headers["Content-Length"] = str(stop - start)
+
+    return StreamingResponse(
+        stream_file(path, start, stop),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+@router.get("/polys/{poly_id}/tiles/{level}/{tx}/{ty}", status_code=status.HTTP_200_OK)
+async def get_poly_tile(
+    poly_id: int,
+    level: int,
+    tx: int,
+    ty: int,
+    output: str = "png",
+    db=Depends(get_async_db),
+):
+    """
+    Retrieve a tile of the mask pyramid of a poly item.
+
+    Tiles are aligned on the canvas origin, tile (tx, ty) of a level
+    covers TILE_SIZE * 2**level columns and rows from tx and ty times
+    that. Empty tiles have no content.
+
+    param int poly_id: The id of the poly item.
+    param int level: The level of the tile, 0 is the full resolution.
+    param int tx: The column of the tile.
+    param int ty: The row of the tile.
+    param str output: Format of the tile: png or binary, one byte per pixel.
+    return bytes tile: The pixels of the tile.
+    """
+    if output not in ["png", "binary"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid output. Pick one of: png, binary",
+        )
+
+    timer = StageTimer()
+    with timer.stage("lookup"):
+        poly = await run_query(db, query_poly, poly_id)
+    if poly is None or poly.arrayfile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Poly not found"
+        )
+
+    try:
+        with timer.stage("load"):
+            tile = await run_in_threadpool(poly_tile, poly, level, tx, ty)
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error),
+        )
+
+    headers = {"Server-Timing": timer.server_timing()}
+    if tile is None:
+        return Response(status_code=status.HTTP_204_NO_CONTENT, headers=headers)
+    if output == "binary":
+        return Response(
+            tile.tobytes(), media_type="application/octet-stream", headers=headers
+        )
+
+    return Response(encode_tile_png(tile), media_type="image/png", headers=headers)
+
+
+@router.patch("/polys/{poly_id}", status_code=status.HTTP_200_OK)
+def update_poly(
+    poly_id: int,
+    edit: PolyEditSerializer,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
+    """
+    Move vertices of a poly item, rasterizing only the changed windows again.
+
+    param int poly_id: The id of the poly item.
+    params PolyEditSerializer edit: index and new [row, column] of every moved vertex.
+    return JSONResponse: The updated poly item and the windows rasterized again.
+    """
+    poly = query_poly(db, poly_id)
+
+    if poly is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Poly not found"
+        )
+
+    timer = StageTimer()
+    content_hash = poly.content_hash
+    paths = [poly.arrayfile, poly.imagefile]
+    try:
+        result = edit_poly(db, poly, edit.edits, timer)
+    except ValueError as error:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error),
+        )
+
+    claimed = poly.content_hash
+    with timer.stage("insert"):
+        try:
+            db.commit()
+        finally:
+            settle_artifact(claimed)
+    release_artifacts(db, content_hash, paths)
+    spatial_index.add(poly)
+
+    background_tasks.add_task(
+        render_poly_preview, poly.content_hash, poly.arrayfile, poly.imagefile
+    )
+
+    return JSONResponse(
+        {
+            "message": "Poly item updated successfully.",
+            "file_url": poly.arrayfile,
+            "plot_url": poly.imagefile,
+            "execution_speed": f"{str(poly.exectime)} seconds",
+            "stages": timer.breakdown(),
+            "update": result["update"],
+            "windows": result["windows"],
+            "shape": [poly.xsize, poly.ysize],
+            "offset": [poly.xoffset, poly.yoffset],
+            "bbox": [poly.xmin, poly.ymin, poly.xmax, poly.ymax],
+            "content_hash": poly.content_hash,
+        },
+        status_code=status.HTTP_200_OK,
+        headers={"Server-Timing": timer.server_timing()},
+    )
 
 
 @router.delete("/polys/{poly_id}")
-def delete_poly(poly_id: int):
+def delete_poly(poly_id: int, db: Session = Depends(get_db)):
     """
     Delete a poly item.
     """
-    poly_to_delete = db.query(Poly).filter(Poly.id == poly_id).first()
+    poly_to_delete = query_poly(db, poly_id)
 
     if poly_to_delete is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Item not found."
         )
 
+    content_hash = poly_to_delete.content_hash
+    paths = [poly_to_delete.arrayfile, poly_to_delete.imagefile]
+
     db.delete(poly_to_delete)
     db.commit()
+    spatial_index.remove(poly_id)
+    release_artifacts(db, content_hash, paths)
 
     return JSONResponse({"message": "Item deleted."}, status_code=status.HTTP_200_OK)
 
 
 @router.post("/polys", status_code=status.HTTP_201_CREATED)
-def create_poly(poly: PolySerializer):
+def create_poly(
+    poly: PolySerializer,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
     """
     Create filled poly item.
 
     params PolySerializer poly: poly item to create.
     return PolySerializer: The created poly item.
     """
-    # check array is valid
-    if not isinstance(poly.npinput, str):
+    timer = StageTimer()
+    try:
+        with timer.stage("parse"):
+            points, rings = parse_rings(poly.npinput)
+    except ValueError as error:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Input array must be a string",
+            detail=str(error),
         )
 
-    # check db duplicates
-    poly_check = db.query(Poly).filter(Poly.name == poly.name).first()
-    if poly_check is not None:
+    return create_poly_item(poly, points, request, background_tasks, db, timer, rings)
+
+
+@router.post("/polys/stats", status_code=status.HTTP_200_OK)
+async def compute_poly_stats(
+    request: Request,
+    dtype: Optional[str] = None,
+    rings: Optional[str] = None,
+    canvas_width: Optional[int] = None,
+    canvas_height: Optional[int] = None,
+    fill_rule: str = "evenodd",
+    extents: bool = False,
+):
+    """
+    Compute the statistics of a polygon without filling it.
+
+    The request body holds the vertices as a JSON array, like the npinput
+    of a poly item, or the (row, column) pairs packed as little-endian
+    values when dtype is set. The filled pixels are the ones of the rourke
+    fill, counted without allocating the canvas; the fast fill only agrees
+    with them for integer vertices.
+
+    params str dtype: Type of the packed coordinates: int32 or float64.
+    params str rings: Comma separated vertex counts of the packed rings.
+    params int canvas_width: Columns of the canvas, the default canvas when unset.
+    params int canvas_height: Rows of the canvas, the default canvas when unset.
+    params str fill_rule: Inside of the rings: evenodd or nonzero.
+    params bool extents: Also return the [row, first column, stop column] of every row.
+    return JSONResponse: The area, centroid, bbox and filled pixels of the polygon.
+    """
+    timer = StageTimer()
+    body = await request.body()
+    try:
+        with timer.stage("parse"):
+            if dtype is None:
+                points, rings = parse_rings(body.decode())
+            else:
+                points = parse_binary_vertices(body, dtype)
+                if rings is not None:
+                    rings = parse_ring_sizes(rings, points.shape[0])
+            canvas = (
+                canvas_height if canvas_height is not None else CANVAS_SHAPE[0],
+                canvas_width if canvas_width is not None else CANVAS_SHAPE[1],
+            )
+            check_canvas(canvas)
+        with timer.stage("stats"):
+            stats = await run_in_threadpool(
+                polygon_stats, points, rings, canvas, fill_rule, extents
+            )
+    except (UnicodeDecodeError, ValueError) as error:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Poly with that name already exists",
+            detail=str(error),
         )
 
-    if poly.algorithm not in ["rourke", "flood", "fast"]:
+    return JSONResponse(stats, headers={"Server-Timing": timer.server_timing()})
+
+
+@router.post("/polys/bulk", status_code=status.HTTP_200_OK)
+async def create_poly_items(
+    request: Request,
+    algorithm: Optional[str] = None,
+    full_canvas: Optional[bool] = None,
+    canvas_width: Optional[int] = None,
+    canvas_height: Optional[int] = None,
+    fill_rule: Optional[str] = None,
+    array_format: Optional[str] = None,
+    preview: Optional[bool] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Create filled poly items from a stream of records.
+
+    The request body holds one JSON object per line, with the fields of
+    a poly item or a GeoJSON Polygon or MultiPolygon feature whose
+    properties hold them. The query parameters set the fields the
+    records leave out. Every record is filled and stored on its own, a
+    failed record does not stop the others.
+
+    params str algorithm: Algorithm to use for filling the polygons.
+    params int canvas_width: Columns of the canvas, the default canvas when unset.
+    params int canvas_height: Rows of the canvas, the default canvas when unset.
+    params str fill_rule: Inside of the rings: evenodd or nonzero.
+    params str array_format: Format of the stored masks.
+    params bool preview: Whether to keep a preview, rendered when downloaded.
+    return NDJSON results: Every record once filled or failed, then every batch stored.
+    """
+    defaults = {
+        name: value
+        for name, value in {
+            "algorithm": algorithm,
+            "full_canvas": full_canvas,
+            "canvas_width": canvas_width,
+            "canvas_height": canvas_height,
+            "fill_rule": fill_rule,
+            "array_format": array_format,
+            "preview": preview,
+        }.items()
+        if value is not None
+    }
+
+    return DuplexStreamingResponse(
+        ingest_records(request.stream(), db, defaults),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.post("/polys/combine", status_code=status.HTTP_200_OK)
+def combine_poly_items(
+    combine: CombineSerializer,
+    background_tasks: BackgroundTasks,
+    output: str = "json",
+    db: Session = Depends(get_db),
+):
+    """
+    Combine the masks of poly items with a boolean operation.
+
+    Only the window of the canvas the result can cover is read from the
+    stored masks. The result is returned, or stored as a new poly item
+    without vertices when a name is given.
+
+    params CombineSerializer combine: The operation, ids and name of the result.
+    params str output: Format of a returned mask: json spans or binary packed rows.
+    return JSONResponse: The combined mask, or the created poly item.
+    """
+    if output not in ["json", "binary"]:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid algorithm. Pick one of: rourke, flood, fast",
+            detail="Invalid output. Pick one of: json, binary",
         )
 
-    # process array
-    poly_arr = json.loads(poly.npinput)
-    results = fill_polyline(poly_arr, poly.algorithm)
-    save_file = save_nparray_to_file(results[0], poly.name)
-    save_plot = save_matplot_figure(results[0], poly.name)
+    timer = StageTimer()
+    with timer.stage("lookup"):
+        polys = query_inputs(db, combine.ids)
+    if polys is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Poly not found"
+        )
+
+    try:
+        if combine.name is not None:
+            new_poly = combine_polys(
+                db,
+                polys,
+                combine.operation,
+                combine.name,
+                combine.array_format,
+                combine.preview,
+                timer,
+            )
+        else:
+            with timer.stage("rasterize"):
+                mask, offset = combine_masks(polys, combine.operation)
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error),
+        )
+
+    if combine.name is None:
+        headers = {
+            "Server-Timing": timer.server_timing(),
+            "X-Mask-Offset": f"{offset[0]},{offset[1]}",
+            "X-Mask-Shape": f"{mask.shape[0]},{mask.shape[1]}",
+        }
+        if output == "binary":
+            return Response(
+                mask.bits.tobytes(),
+                media_type="application/octet-stream",
+                headers=headers,
+            )
 
-    if save_file:
-        new_poly = Poly(
-            name=poly.name,
-            npinput=poly.npinput,
-            xsize=results[0].shape[0],
-            ysize=results[0].shape[1],
-            imagefile=str(save_file),
-            arrayfile=str(save_plot),
-            exectime=results[1],
-            algorithm=poly.algorithm,
+        return Response(
+            encode_combined(mask, offset, combine.operation),
+            media_type="application/json",
+            headers=headers,
         )
-        db.add(new_poly)
-        db.commit()
+
+    claimed = new_poly.content_hash
+    with timer.stage("insert"):
+        try:
+            db.add(new_poly)
+            db.commit()
+        finally:
+            settle_artifact(claimed)
+    spatial_index.add(new_poly)
+
+    background_tasks.add_task(
+        render_poly_preview,
+        new_poly.content_hash,
+        new_poly.arrayfile,
+        new_poly.imagefile,
+    )
+
+    return JSONResponse(
+        {
+            "message": "Poly item created successfully.",
+            "id": new_poly.id,
+            "file_url": new_poly.arrayfile,
+            "plot_url": new_poly.imagefile,
+            "execution_speed": f"{str(new_poly.exectime)} seconds",
+            "stages": timer.breakdown(),
+            "algorithm": new_poly.algorithm,
+            "shape": [new_poly.xsize, new_poly.ysize],
+            "offset": [new_poly.xoffset, new_poly.yoffset],
+            "canvas": [new_poly.xcanvas, new_poly.ycanvas],
+            "bbox": [new_poly.xmin, new_poly.ymin, new_poly.xmax, new_poly.ymax],
+            "area": new_poly.area,
+            "pixels": new_poly.pixels,
+            "content_hash": new_poly.content_hash,
+        },
+        status_code=status.HTTP_201_CREATED,
+        headers={"Server-Timing": timer.server_timing()},
+    )
+
+
+@router.post("/polys/upload", status_code=status.HTTP_201_CREATED)
+async def upload_poly(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    name: str,
+    algorithm: str,
+    dtype: str = "int32",
+    full_canvas: bool = False,
+    canvas_width: Optional[int] = None,
+    canvas_height: Optional[int] = None,
+    flood_x: Optional[int] = None,
+    flood_y: Optional[int] = None,
+    connectivity: int = 4,
+    rings: Optional[str] = None,
+    fill_rule: str = "evenodd",
+    array_format: str = "npy",
+    preview: bool = True,
+    asynchronous: bool = False,
+    db: Session = Depends(get_db),
+):
+    """
+    Create filled poly item from binary vertices.
+
+    The request body holds the (row, column) pairs packed as
+    little-endian int32 or float64 values.
+
+    params str name: The name of the poly item.
+    params str algorithm: Algorithm to use for filling the polygon.
+    params str dtype: Type of the coordinates: int32 or float64.
+    params int canvas_width: Columns of the canvas, the default canvas when unset.
+    params int canvas_height: Rows of the canvas, the default canvas when unset.
+    params str rings: Comma separated vertex counts of the rings, one ring when unset.
+    params str fill_rule: Inside of the rings: evenodd or nonzero.
+    return PolySerializer: The created poly item.
+    """
+    timer = StageTimer()
+    body = await request.body()
+    try:
+        with timer.stage("parse"):
+            points = parse_binary_vertices(body, dtype)
+            if rings is not None:
+                rings = parse_ring_sizes(rings, points.shape[0])
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error),
+        )
+
+    poly = PolySerializer(
+        name=name,
+        npinput=None,
+        imagefile=None,
+        arrayfile=None,
+        exectime=None,
+        algorithm=algorithm,
+        full_canvas=full_canvas,
+        canvas_width=canvas_width,
+        canvas_height=canvas_height,
+        flood_x=flood_x,
+        flood_y=flood_y,
+        connectivity=connectivity,
+        fill_rule=fill_rule,
+        array_format=array_format,
+        preview=preview,
+        asynchronous=asynchronous,
+    )
+
+    return await run_in_threadpool(
+        create_poly_item, poly, points, request, background_tasks, db, timer, rings
+    )
+
+
+def create_poly_item(
+    poly, points, request, background_tasks, db, timer=None, rings=None
+):
+    """
+    Fill and store a poly item, or queue its fill.
+
+    The time of every stage is returned in the Server-Timing header.
+
+    params PolySerializer poly: poly item to create.
+    params numpy.ndarray points: The vertices of the poly item.
+    params StageTimer timer: Timer of the request.
+    params list rings: Number of vertices of every ring, one ring when None.
+    return JSONResponse: The created or queued poly item.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    try:
+        validate_poly(poly, rings)
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error),
+        )
+
+    # check db duplicates
+    with timer.stage("duplicate"):
+        poly_check = db.query(Poly).filter(Poly.name == poly.name).first()
+    if poly_check is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Poly with that name already exists",
+        )
+
+    if poly.asynchronous:
+        try:
+            job = submit_job(db, poly, points, rings)
+        except OverflowError as error:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=str(error),
+            )
 
         return JSONResponse(
             {
-                "message": "Poly item created successfully.",
-                "file_url": str(save_file),
-                "plot_url": str(save_file),
-                "execution_speed": f"{str(results[1])} seconds",
-                "algorithm": poly.algorithm,
+                "message": "Poly item queued.",
+                "job_id": job.id,
+                "status": job.status,
+                "status_url": str(request.url_for("get_job_details", job_id=job.id)),
             },
-            status_code=status.HTTP_201_CREATED,
+            status_code=status.HTTP_202_ACCEPTED,
+            headers={"Server-Timing": timer.server_timing()},
         )
-    return HTTPException(
-        {"message": "Something went wrong creating the poly item. Please try again."},
-        status_code=status.HTTP_400_BAD_REQUEST,
+
+    try:
+        new_poly = process_poly(poly, db, points, timer, rings)
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error),
+        )
+
+    claimed = new_poly.content_hash
+    with timer.stage("insert"):
+        try:
+            db.add(new_poly)
+            db.commit()
+        finally:
+            settle_artifact(claimed)
+    spatial_index.add(new_poly)
+
+    # render the preview once the response is sent
+    background_tasks.add_task(
+        render_poly_preview,
+        new_poly.content_hash,
+        new_poly.arrayfile,
+        new_poly.imagefile,
+    )
+
+    return JSONResponse(
+        {
+            "message": "Poly item created successfully.",
+            "file_url": new_poly.arrayfile,
+            "plot_url": new_poly.imagefile,
+            "execution_speed": f"{str(new_poly.exectime)} seconds",
+            "stages": timer.breakdown(),
+            "algorithm": new_poly.algorithm,
+            "shape": [new_poly.xsize, new_poly.ysize],
+            "offset": [new_poly.xoffset, new_poly.yoffset],
+            "canvas": [new_poly.xcanvas, new_poly.ycanvas],
+            "bbox": [new_poly.xmin, new_poly.ymin, new_poly.xmax, new_poly.ymax],
+            "area": new_poly.area,
+            "pixels": new_poly.pixels,
+            "content_hash": new_poly.content_hash,
+        },
+        status_code=status.HTTP_201_CREATED,
+        headers={"Server-Timing": timer.server_timing()},
     )
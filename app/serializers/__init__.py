@@ -1,4 +1,7 @@
 """
 Serializer module.
 """
+from .combine_serializer import CombineSerializer
+from .edit_serializer import PolyEditSerializer, VertexEditSerializer
+from .job_serializer import JobSerializer
 from .poly_serializer import PolySerializer
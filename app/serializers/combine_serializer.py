@@ -0,0 +1,18 @@
+"""
+Mask algebra serializer.
+"""
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class CombineSerializer(BaseModel):
+    """
+    Boolean operation on the masks of poly items.
+    """
+
+    operation: str
+    ids: List[int]
+    name: Optional[str] = None
+    array_format: Optional[str] = "npy"
+    preview: Optional[bool] = False
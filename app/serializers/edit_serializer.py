@@ -0,0 +1,23 @@
+"""
+Vertex edit serializers.
+"""
+from typing import List
+
+from pydantic import BaseModel
+
+
+class VertexEditSerializer(BaseModel):
+    """
+    Move of a vertex.
+    """
+
+    index: int
+    vertex: List[float]
+
+
+class PolyEditSerializer(BaseModel):
+    """
+    Vertex edits of a poly item.
+    """
+
+    edits: List[VertexEditSerializer]
@@ -0,0 +1,31 @@
+"""
+Job serializer.
+"""
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class JobSerializer(BaseModel):
+    """
+    Job serializer.
+    """
+
+    id: str
+    name: str
+    status: str
+    poly_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    queue_time: Optional[float] = None
+    run_time: Optional[float] = None
+
+    class Config:
+        """
+        ORM mode.
+        """
+
+        orm_mode = True
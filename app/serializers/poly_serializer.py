@@ -16,7 +16,27 @@ class PolySerializer(BaseModel):
     imagefile: Optional[str]
     arrayfile: Optional[str]
     exectime: Optional[float]
+    exectime_stages: Optional[str] = None
     algorithm: Optional[str]
+    xsize: Optional[int] = None
+    ysize: Optional[int] = None
+    xoffset: Optional[int] = None
+    yoffset: Optional[int] = None
+    xcanvas: Optional[int] = None
+    ycanvas: Optional[int] = None
+    content_hash: Optional[str] = None
+    area: Optional[float] = None
+    pixels: Optional[int] = None
+    full_canvas: Optional[bool] = False
+    canvas_width: Optional[int] = None
+    canvas_height: Optional[int] = None
+    flood_x: Optional[int] = None
+    flood_y: Optional[int] = None
+    connectivity: Optional[int] = 4
+    fill_rule: Optional[str] = "evenodd"
+    array_format: Optional[str] = "npy"
+    asynchronous: Optional[bool] = False
+    preview: Optional[bool] = True
 
     class Config:
         """
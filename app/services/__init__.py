@@ -1,5 +1,7 @@
 """
 Services module.
 """
-from .file_management import save_matplot_figure, save_nparray_to_file
-from .filling_service import fill_polyline
+from .bitmask_service import BitMask
+from .file_management import (load_nparray_from_file, save_matplot_figure,
+                              save_nparray_to_file)
+from .filling_service import expand_to_canvas, fill_polyline
@@ -0,0 +1,198 @@
+"""
+Bit-packed mask service.
+"""
+import numpy as np
+
+# Bits of the first and last byte of a span, by position in the byte
+HEAD_BITS = np.array([0xFF >> bit for bit in range(8)], dtype=np.uint8)
+TAIL_BITS = np.array([(0xFF << (7 - bit)) & 0xFF for bit in range(8)], dtype=np.uint8)
+PIXEL_BITS = np.array([0x80 >> bit for bit in range(8)], dtype=np.uint8)
+
+
+class BitMask:
+    """
+    Mask of 1 bit per pixel.
+
+    The rows are packed into bytes like ``numpy.packbits`` along the
+    columns, the first column is the most significant bit. Fills write
+    into the packed bytes and uint8 rows are only built on demand.
+    """
+
+    def __init__(self, shape, bits=None):
+        """
+        Create an empty mask.
+
+        Parameters
+        ----------
+        shape : tuple
+            Number of rows and columns of the mask.
+        bits : numpy.ndarray, optional
+            The packed rows, zeros by default.
+        """
+        self.shape = (int(shape[0]), int(shape[1]))
+        if bits is None:
+            bits = np.zeros((self.shape[0], (self.shape[1] + 7) // 8), dtype=np.uint8)
+        self.bits = bits
+
+    @classmethod
+    def from_array(cls, nparr):
+        """
+        Pack a mask.
+
+        Parameters
+        ----------
+        nparr : numpy.ndarray
+            Array of points that define the filled polygon.
+
+        Returns
+        -------
+        BitMask
+            The packed mask.
+        """
+        return cls(nparr.shape, np.packbits(nparr != 0, axis=1))
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes of the packed rows.
+        """
+        return self.bits.nbytes
+
+    def fill_spans(self, span_rows, span_starts, span_stops):
+        """
+        Fill spans of the mask in the packed bytes.
+
+        The partial bytes at both ends of the spans are set at once, the
+        whole bytes between them with slice assignment.
+
+        Parameters
+        ----------
+        span_rows : numpy.ndarray
+            Row of every span.
+        span_starts : numpy.ndarray
+            First column of every span.
+        span_stops : numpy.ndarray
+            Column after the last column of every span.
+
+        Returns
+        -------
+        BitMask
+            The filled mask.
+        """
+        keep = span_starts < span_stops
+        span_rows = span_rows[keep]
+        span_starts = span_starts[keep]
+        span_lasts = span_stops[keep] - 1
+
+        first_bytes = span_starts >> 3
+        last_bytes = span_lasts >> 3
+        head = HEAD_BITS[span_starts & 7]
+        tail = TAIL_BITS[span_lasts & 7]
+
+        # spans within a single byte set the bits both ends have in common
+        single = first_bytes == last_bytes
+        head = np.where(single, head & tail, head)
+        np.bitwise_or.at(self.bits, (span_rows, first_bytes), head)
+        np.bitwise_or.at(
+            self.bits, (span_rows[~single], last_bytes[~single]), tail[~single]
+        )
+
+        whole = last_bytes - first_bytes > 1
+        for row, start, stop in zip(
+            span_rows[whole].tolist(),
+            (first_bytes[whole] + 1).tolist(),
+            last_bytes[whole].tolist(),
+        ):
+            self.bits[row, start:stop] = 0xFF
+
+        return self
+
+    def set_pixels(self, rows, columns):
+        """
+        Fill single pixels of the mask.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Row of every pixel.
+        columns : numpy.ndarray
+            Column of every pixel.
+
+        Returns
+        -------
+        BitMask
+            The filled mask.
+        """
+        columns = np.asarray(columns, dtype=np.int64)
+        np.bitwise_or.at(self.bits, (rows, columns >> 3), PIXEL_BITS[columns & 7])
+
+        return self
+
+    def to_array(self, first=0, stop=None):
+        """
+        Unpack rows of the mask.
+
+        Parameters
+        ----------
+        first : int
+            First row to unpack.
+        stop : int, optional
+            Row after the last row to unpack, the last row of the mask
+            by default.
+
+        Returns
+        -------
+        numpy.ndarray
+            The rows, as uint8.
+        """
+        return np.unpackbits(self.bits[first:stop], axis=1, count=self.shape[1])
+
+    def __getitem__(self, index):
+        """
+        Unpack a window or single pixels of the mask.
+
+        Only the packed bytes covering the columns of the window, or the
+        bytes of the pixels, are read.
+
+        Parameters
+        ----------
+        index : slice or tuple
+            The rows, or the rows and the columns, as slices without a step
+            or as the arrays of the rows and columns of single pixels.
+
+        Returns
+        -------
+        numpy.ndarray
+            The pixels, as uint8.
+        """
+        rows, columns = index if isinstance(index, tuple) else (index, slice(None))
+        if not isinstance(rows, slice) and not isinstance(columns, slice):
+            columns = np.asarray(columns, dtype=np.int64)
+            pixels = self.bits[rows, columns >> 3] & PIXEL_BITS[columns & 7]
+            return (pixels != 0).astype(np.uint8)
+        if not isinstance(rows, slice) or not isinstance(columns, slice):
+            raise TypeError("Bit masks only unpack slices of rows and columns.")
+        if rows.step not in [None, 1] or columns.step not in [None, 1]:
+            raise TypeError("Bit masks only unpack slices without a step.")
+
+        first, stop, _ = rows.indices(self.shape[0])
+        left, right, _ = columns.indices(self.shape[1])
+        right = max(right, left)
+        lead = left & 7
+        bits = self.bits[first:stop, left >> 3 : (right + 7) >> 3]
+
+        return np.unpackbits(bits, axis=1, count=lead + right - left)[:, lead:]
+
+    def read_only(self):
+        """
+        Get a view of the mask that cannot be changed in place.
+
+        Returns
+        -------
+        BitMask
+            The read-only view.
+        """
+        bits = self.bits.view()
+        bits.flags.writeable = False
+
+        return BitMask(self.shape, bits)
@@ -0,0 +1,528 @@
+"""
+Bulk poly ingest service.
+"""
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+from app.config import BULK_BATCH_SIZE, BULK_MAX_RECORD_BYTES, BULK_WORKERS
+from app.models import Poly
+from app.serializers import PolySerializer
+from app.services.cache_service import (fill_key, release_artifacts,
+                                        settle_artifact)
+from app.services.metrics_service import StageTimer
+from app.services.poly_service import poly_canvas, process_poly, validate_poly
+from app.services.vertex_service import parse_rings
+
+# Thread pool filling the records, created on first use
+bulk_executor = None
+bulk_executor_lock = threading.Lock()
+
+# Record separator leading the records of GeoJSON text sequences
+RECORD_SEPARATOR = b"\x1e"
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    Streaming response sent while the request body is still read.
+
+    StreamingResponse listens for the disconnect of the client while it
+    streams, taking the messages of the request body from the reader.
+    """
+
+    async def __call__(self, scope, receive, send):
+        """
+        Send the response, the request body is left to the stream.
+        """
+        await self.stream_response(send)
+
+        if self.background is not None:
+            await self.background()
+
+
+def get_bulk_executor():
+    """
+    Get the thread pool filling the records of bulk uploads.
+
+    Returns
+    -------
+    ThreadPoolExecutor
+        The bounded thread pool.
+    """
+    global bulk_executor
+
+    with bulk_executor_lock:
+        if bulk_executor is None:
+            bulk_executor = ThreadPoolExecutor(
+                max_workers=BULK_WORKERS, thread_name_prefix="bulk"
+            )
+        return bulk_executor
+
+
+async def split_records(chunks, max_bytes=BULK_MAX_RECORD_BYTES):
+    """
+    Split a streamed body into its lines.
+
+    At most one record is buffered, longer records are skipped up to
+    their end of line.
+
+    Parameters
+    ----------
+    chunks : async iterator
+        The chunks of the body.
+    max_bytes : int
+        Maximum number of bytes of a record.
+
+    Yield
+    -------
+    tuple
+        Line number and bytes of every record that is not blank, the
+        bytes are None for records longer than max_bytes.
+    """
+    buffer = bytearray()
+    number = 0
+    skipping = False
+
+    async for chunk in chunks:
+        lines = chunk.split(b"\n")
+        for line in lines[:-1]:
+            number += 1
+            if not skipping:
+                buffer += line
+            record = bytes(buffer).strip().lstrip(RECORD_SEPARATOR)
+            if skipping or len(buffer) > max_bytes:
+                yield number, None
+            elif record:
+                yield number, record
+            buffer.clear()
+            skipping = False
+
+        if not skipping:
+            buffer += lines[-1]
+        if len(buffer) > max_bytes:
+            buffer.clear()
+            skipping = True
+
+    record = bytes(buffer).strip().lstrip(RECORD_SEPARATOR)
+    if skipping or record:
+        yield number + 1, None if skipping else record
+
+
+def feature_fields(feature):
+    """
+    Get the fields of a poly item from a GeoJSON feature.
+
+    GeoJSON positions are (x, y) pairs, the x being the column and the
+    y the row. The closing position of every ring is dropped.
+
+    Parameters
+    ----------
+    feature : dict
+        Feature with a Polygon or MultiPolygon geometry, the other
+        fields of the poly item are its properties.
+
+    Returns
+    -------
+    dict
+        The fields of the poly item, the rings as npinput.
+    """
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") == "Polygon":
+        polygons = [geometry.get("coordinates")]
+    elif geometry.get("type") == "MultiPolygon":
+        polygons = geometry.get("coordinates")
+    else:
+        raise ValueError("Feature geometry must be a Polygon or a MultiPolygon")
+
+    rings = []
+    for ring in (ring for polygon in polygons for ring in polygon):
+        if len(ring) > 1 and ring[0] == ring[-1]:
+            ring = ring[:-1]
+        rings.append([position[1::-1] for position in ring])
+
+    return {
+        **(feature.get("properties") or {}),
+        "npinput": json.dumps(rings if len(rings) > 1 else rings[0]),
+    }
+
+
+def parse_record(line, defaults=None):
+    """
+    Parse a record of a bulk upload.
+
+    Parameters
+    ----------
+    line : bytes
+        JSON object with the fields of a poly item, npinput may be a
+        JSON array instead of its text, or a GeoJSON feature.
+    defaults : dict, optional
+        Fields of the poly items the records do not set.
+
+    Returns
+    -------
+    poly : PolySerializer
+        The poly item.
+    points : numpy.ndarray
+        The vertices of all rings.
+    rings : list or None
+        Number of vertices of every ring, None for a single ring.
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("Records must be JSON objects")
+    if record.get("type") == "Feature":
+        record = feature_fields(record)
+    if not isinstance(record.get("npinput", ""), str):
+        record["npinput"] = json.dumps(record["npinput"])
+
+    fields = {"imagefile": None, "arrayfile": None, "exectime": None}
+    fields.update(defaults or {})
+    fields.update(record)
+    fields["asynchronous"] = False
+    poly = PolySerializer(**fields)
+
+    points, rings = parse_rings(poly.npinput)
+    validate_poly(poly, rings)
+
+    return poly, points, rings
+
+
+def prepare_record(db, line, defaults, names):
+    """
+    Parse a record and check it against the stored poly items.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    line : bytes
+        The record.
+    defaults : dict
+        Fields of the poly items the records do not set.
+    names : set
+        Names of the records of the upload not inserted yet.
+
+    Returns
+    -------
+    poly : PolySerializer
+        The poly item.
+    points : numpy.ndarray
+        The vertices of all rings.
+    rings : list or None
+        Number of vertices of every ring, None for a single ring.
+    stored : bool
+        Whether a stored poly item holds the same fill.
+    """
+    poly, points, rings = parse_record(line, defaults)
+
+    if poly.name in names or (
+        db.query(Poly.id).filter(Poly.name == poly.name).first() is not None
+    ):
+        raise ValueError("Poly with that name already exists")
+
+    key = fill_key(points, poly, poly_canvas(poly), rings)
+    stored = db.query(Poly.id).filter(Poly.content_hash == key).first() is not None
+
+    return poly, points, rings, stored
+
+
+def fill_record(poly, points, rings, db=None):
+    """
+    Fill a record and save its artifacts.
+
+    The preview is not rendered, it is rendered when first downloaded.
+
+    Parameters
+    ----------
+    poly : PolySerializer
+        The poly item.
+    points : numpy.ndarray
+        The vertices of all rings.
+    rings : list or None
+        Number of vertices of every ring, None for a single ring.
+    db : Session, optional
+        Database session linking the artifacts of a stored fill.
+
+    Returns
+    -------
+    Poly
+        The new poly item, not yet added to the database.
+    """
+    return process_poly(poly, db, points, StageTimer(), rings)
+
+
+def insert_batch(db, batch):
+    """
+    Insert a batch of poly items in one transaction.
+
+    When the batch clashes with poly items stored meanwhile, its poly
+    items are inserted one at a time. The claims of their artifacts are
+    settled once they are committed or given up, and the artifacts of
+    the poly items given up are removed unless another poly uses them.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    batch : list
+        Line number and poly item of every record.
+
+    Returns
+    -------
+    list
+        The result of every record.
+    """
+    claimed = [poly.content_hash for _, poly in batch]
+    try:
+        results = insert_polys(db, batch)
+    finally:
+        for key in claimed:
+            settle_artifact(key)
+
+    for (_, poly), result in zip(batch, results):
+        if result["status"] == "error":
+            paths = [poly.arrayfile, poly.imagefile]
+            release_artifacts(db, poly.content_hash, paths)
+
+    return results
+
+
+def insert_polys(db, batch):
+    """
+    Insert a batch of poly items, one at a time after a clash.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    batch : list
+        Line number and poly item of every record.
+
+    Returns
+    -------
+    list
+        The result of every record.
+    """
+    try:
+        db.add_all([poly for _, poly in batch])
+        # ids are assigned on flush, read them before commit expires them
+        db.flush()
+        results = [record_result(number, poly) for number, poly in batch]
+        db.commit()
+
+        return results
+    except IntegrityError:
+        db.rollback()
+
+    results = []
+    for number, poly in batch:
+        try:
+            db.add(poly)
+            db.flush()
+            result = record_result(number, poly)
+            db.commit()
+            results.append(result)
+        except IntegrityError:
+            db.rollback()
+            results.append(error_result(number, "Poly with that name already exists"))
+
+    return results
+
+
+def record_result(number, poly):
+    """
+    Result of a stored record.
+    """
+    return {
+        "line": number,
+        "status": "created",
+        "id": poly.id,
+        "name": poly.name,
+        "content_hash": poly.content_hash,
+    }
+
+
+def filled_result(number, poly):
+    """
+    Result of a filled record, before it is stored.
+    """
+    return {
+        "line": number,
+        "status": "filled",
+        "name": poly.name,
+        "content_hash": poly.content_hash,
+    }
+
+
+def stored_result(results):
+    """
+    Result of the records of a batch stored in one transaction.
+    """
+    return {
+        "status": "stored",
+        "lines": [result["line"] for result in results],
+        "ids": [result["id"] for result in results],
+    }
+
+
+def error_result(number, detail):
+    """
+    Result of a failed record.
+    """
+    return {"line": number, "status": "error", "detail": detail}
+
+
+def encode_result(result):
+    """
+    Encode a result as a line of NDJSON.
+    """
+    return json.dumps(result).encode("utf-8") + b"\n"
+
+
+async def ingest_records(
+    chunks,
+    db,
+    defaults=None,
+    workers=BULK_WORKERS,
+    batch_size=BULK_BATCH_SIZE,
+    max_bytes=BULK_MAX_RECORD_BYTES,
+):
+    """
+    Fill and store the records of a streamed bulk upload.
+
+    The body is read one record at a time. New fills run in the bounded
+    thread pool, fills already stored are linked. At most two records
+    per worker are in flight: once they are, the body is not read any
+    further until a fill completes, so memory does not grow with the
+    upload. The result of every record is sent as soon as it is filled
+    or fails. Filled poly items are inserted batch_size at a time, one
+    transaction per batch: after every batch, the lines and ids of its
+    stored records are sent, then its records that failed to insert.
+    A fill failing for any reason only fails its record, and the fills
+    already made are still stored when the upload stops early.
+
+    Parameters
+    ----------
+    chunks : async iterator
+        The chunks of the NDJSON body.
+    db : Session
+        Database session.
+    defaults : dict, optional
+        Fields of the poly items the records do not set.
+    workers : int
+        Number of threads filling the records.
+    batch_size : int
+        Number of poly items inserted in one transaction.
+    max_bytes : int
+        Maximum number of bytes of a record.
+
+    Yield
+    -------
+    bytes
+        The results as lines of NDJSON, as they complete, then the number
+        of created and failed records.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_bulk_executor()
+    pending = {}
+    batch = []
+    names = set()
+    counts = {"created": 0, "failed": 0}
+
+    def collect(done):
+        # move completed fills to the batch, failed ones to the results
+        results = []
+        for future in done:
+            number, name = pending.pop(future)
+            try:
+                poly = future.result()
+            except Exception as error:
+                names.discard(name)
+                results.append(error_result(number, str(error)))
+            else:
+                batch.append((number, poly))
+                results.append(filled_result(number, poly))
+        return results
+
+    async def flush():
+        records = batch[:]
+        batch.clear()
+        results = await run_in_threadpool(insert_batch, db, records)
+        names.clear()
+        names.update(future_name for _, future_name in pending.values())
+        stored = [result for result in results if result["status"] == "created"]
+        failed = [result for result in results if result["status"] == "error"]
+        return ([stored_result(stored)] if stored else []) + failed
+
+    def count(result):
+        if result["status"] == "stored":
+            counts["created"] += len(result["ids"])
+        elif result["status"] == "error":
+            counts["failed"] += 1
+        return encode_result(result)
+
+    try:
+        async for number, line in split_records(chunks, max_bytes):
+            try:
+                if line is None:
+                    raise ValueError(f"Records must be at most {max_bytes} bytes")
+                poly, points, rings, stored = await run_in_threadpool(
+                    prepare_record, db, line, defaults, names
+                )
+            except ValueError as error:
+                yield count(error_result(number, str(error)))
+            else:
+                names.add(poly.name)
+                if stored:
+                    # linking a stored fill only takes a lookup
+                    try:
+                        linked = await run_in_threadpool(
+                            fill_record, poly, points, rings, db
+                        )
+                    except Exception as error:
+                        names.discard(poly.name)
+                        yield count(error_result(number, str(error)))
+                    else:
+                        batch.append((number, linked))
+                        yield count(filled_result(number, linked))
+                else:
+                    future = loop.run_in_executor(
+                        executor, fill_record, poly, points, rings
+                    )
+                    pending[future] = (number, poly.name)
+
+            # backpressure, stop reading until a fill completes
+            while len(pending) >= 2 * workers:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for result in collect(done):
+                    yield count(result)
+            for result in collect([future for future in pending if future.done()]):
+                yield count(result)
+
+            if len(batch) >= batch_size:
+                for result in await flush():
+                    yield count(result)
+
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            for result in collect(done):
+                yield count(result)
+        if batch:
+            for result in await flush():
+                yield count(result)
+
+        yield encode_result({"status": "done", **counts})
+    finally:
+        # store the fills already made when the upload stops early
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            collect(done)
+        if batch:
+            await flush()
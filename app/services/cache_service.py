@@ -0,0 +1,416 @@
+"""
+Fill result cache service.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+
+import numpy as np
+
+from app.config import CACHE_MAX_BYTES
+from app.models import Poly
+from app.services.bitmask_service import BitMask
+from app.services.file_management import open_nparray_file
+
+
+class MaskCache:
+    """
+    In-process LRU cache of fill masks with a byte budget.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Create an empty cache.
+
+        Parameters
+        ----------
+        max_bytes : int
+            Maximum number of bytes of masks kept in memory.
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Get a mask and mark it as recently used.
+
+        Parameters
+        ----------
+        key : str
+            Content hash of the fill.
+
+        Returns
+        -------
+        numpy.ndarray or BitMask or None
+            The cached mask, None on a miss.
+        """
+        with self.lock:
+            mask = self.entries.get(key)
+            if mask is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return mask
+
+    def put(self, key, mask):
+        """
+        Add a mask, evicting the least recently used ones over budget.
+
+        Parameters
+        ----------
+        key : str
+            Content hash of the fill.
+        mask : numpy.ndarray or BitMask
+            The mask to cache, packed masks take 8 times less memory.
+        """
+        if mask.nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key).nbytes
+
+            # the cached mask must not change under its key
+            if isinstance(mask, BitMask):
+                mask = mask.read_only()
+            else:
+                mask = mask.view()
+                mask.flags.writeable = False
+            self.entries[key] = mask
+            self.bytes += mask.nbytes
+
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def discard(self, key):
+        """
+        Remove a mask from the cache.
+
+        Parameters
+        ----------
+        key : str
+            Content hash of the fill.
+        """
+        with self.lock:
+            mask = self.entries.pop(key, None)
+            if mask is not None:
+                self.bytes -= mask.nbytes
+
+    def stats(self):
+        """
+        Counters of the cache.
+
+        Returns
+        -------
+        dict
+            Hits, misses, evictions, entries and bytes of the cache.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Hot masks of this process
+mask_cache = MaskCache(CACHE_MAX_BYTES)
+
+# Stored artifacts reused instead of recomputed
+artifact_stats = {"hits": 0, "misses": 0, "removed": 0}
+artifact_lock = threading.Lock()
+
+# Locks the content hashes are spread over, so identical fills are computed once
+KEY_LOCK_STRIPES = 1024
+key_locks = [threading.Lock() for _ in range(KEY_LOCK_STRIPES)]
+
+# Number of poly items linking every content hash, not committed yet
+pending_artifacts = {}
+
+
+def canonical_points(polygon_points):
+    """
+    Normalize the vertices of a polygon.
+
+    The closing vertex repeating the first one is dropped and the ring is
+    rotated to start at its smallest vertex, so the same polygon always
+    gets the same vertex list.
+
+    Parameters
+    ----------
+    polygon_points : list
+        Array of points that define the polygon.
+
+    Returns
+    -------
+    list
+        The normalized points.
+    """
+    return canonical_array(polygon_points).tolist()
+
+
+def canonical_array(polygon_points):
+    """
+    Normalize the vertices of a polygon into a float64 array.
+
+    Parameters
+    ----------
+    polygon_points : list or numpy.ndarray
+        Array of points that define the polygon.
+
+    Returns
+    -------
+    numpy.ndarray
+        The normalized points, see ``canonical_points``.
+    """
+    points = np.asarray(polygon_points, dtype=np.float64).reshape(-1, 2)
+
+    if points.shape[0] > 1 and (points[0] == points[-1]).all():
+        points = points[:-1]
+
+    if points.shape[0]:
+        first = np.lexsort((points[:, 1], points[:, 0]))[0]
+        points = np.roll(points, -first, axis=0)
+
+    return np.ascontiguousarray(points, dtype="<f8")
+
+
+def fill_key(polygon_points, poly, canvas, rings=None):
+    """
+    Compute the content hash of a fill request.
+
+    The vertices are hashed as raw float64 bytes, without turning them
+    into Python objects. Every ring is normalized on its own. The seed
+    and connectivity only change flood fills.
+
+    Parameters
+    ----------
+    polygon_points : list or numpy.ndarray
+        Array of points that define the polygon.
+    poly : PolySerializer
+        The poly item holding the fill parameters.
+    canvas : tuple
+        Shape of the canvas.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+
+    Returns
+    -------
+    str
+        Hex digest identifying the fill result.
+    """
+    request = {
+        "algorithm": poly.algorithm,
+        "canvas": list(canvas),
+        "full_canvas": bool(poly.full_canvas),
+        "array_format": poly.array_format,
+    }
+    if poly.algorithm == "flood":
+        request["flood"] = [poly.flood_x, poly.flood_y, poly.connectivity]
+    if rings is None:
+        parts = [canonical_array(polygon_points)]
+    else:
+        points = np.asarray(polygon_points, dtype=np.float64).reshape(-1, 2)
+        rings_points = np.split(points, np.cumsum(rings)[:-1])
+        parts = [canonical_array(ring) for ring in rings_points]
+        request["rings"] = [part.shape[0] for part in parts]
+
+    # the default rule is left out, so evenodd fills keep their stored hashes
+    if poly.fill_rule not in [None, "evenodd"]:
+        request["fill_rule"] = poly.fill_rule
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"))
+
+    digest = hashlib.sha256(encoded.encode("utf-8"))
+    for part in parts:
+        digest.update(part.tobytes())
+
+    return digest.hexdigest()
+
+
+def key_lock(key):
+    """
+    Get the lock of a content hash.
+
+    The hashes share a fixed number of locks, so the locks do not grow
+    with the number of fills. Distinct hashes may share a lock.
+
+    Parameters
+    ----------
+    key : str
+        Content hash of the fill.
+
+    Returns
+    -------
+    threading.Lock
+        Lock held while the fill is computed.
+    """
+    return key_locks[hash(key) % KEY_LOCK_STRIPES]
+
+
+@contextmanager
+def hold_keys(keys):
+    """
+    Hold the locks of several content hashes at once.
+
+    Every lock is taken once, in a fixed order, so two hashes sharing a
+    lock do not block each other and no two holders deadlock.
+
+    Parameters
+    ----------
+    keys : iterable
+        Content hashes of the fills.
+
+    Yield
+    -------
+    None
+        Nothing, the locks are held until the block exits.
+    """
+    stripes = sorted({hash(key) % KEY_LOCK_STRIPES for key in keys})
+
+    with ExitStack() as locks:
+        for stripe in stripes:
+            locks.enter_context(key_locks[stripe])
+        yield
+
+
+def claim_artifact(key):
+    """
+    Keep the artifacts of a content hash until a new poly item is committed.
+
+    Must be called while the lock of the hash is held.
+
+    Parameters
+    ----------
+    key : str
+        Content hash of the new poly item.
+    """
+    with artifact_lock:
+        pending_artifacts[key] = pending_artifacts.get(key, 0) + 1
+
+
+def settle_artifact(key):
+    """
+    Drop the claim of a new poly item, once committed or given up.
+
+    Parameters
+    ----------
+    key : str or None
+        Content hash of the new poly item.
+    """
+    with artifact_lock:
+        count = pending_artifacts.pop(key, 0) - 1
+        if count > 0:
+            pending_artifacts[key] = count
+
+
+def record_artifact(hit):
+    """
+    Count a lookup of the stored artifacts.
+
+    Parameters
+    ----------
+    hit : bool
+        Whether a stored artifact was reused.
+    """
+    with artifact_lock:
+        artifact_stats["hits" if hit else "misses"] += 1
+
+
+def get_poly_mask(poly):
+    """
+    Get the mask of a stored poly, from memory when it is hot.
+
+    Packed masks are kept packed, their pixels are unpacked by the
+    caller when indexed.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+
+    Returns
+    -------
+    numpy.ndarray or BitMask
+        The stored mask.
+    """
+    if poly.content_hash is not None:
+        mask = mask_cache.get(poly.content_hash)
+        if mask is not None:
+            return mask
+
+    mask = open_nparray_file(poly.arrayfile)
+    if isinstance(mask, BitMask):
+        mask = BitMask(mask.shape, np.array(mask.bits))
+    elif isinstance(mask, np.memmap):
+        mask = np.array(mask)
+
+    if poly.content_hash is not None:
+        mask_cache.put(poly.content_hash, mask)
+
+    return mask
+
+
+def release_artifacts(db, content_hash, paths):
+    """
+    Remove the artifacts of a deleted poly once no other poly uses them.
+
+    The artifacts are kept while a new poly item linking them is not
+    committed yet, see ``claim_artifact``.
+
+    Parameters
+    ----------
+    db : Session
+        Database session the poly was deleted in.
+    content_hash : str
+        Content hash of the deleted poly.
+    paths : list
+        Artifact files of the deleted poly.
+    """
+    if content_hash is None:
+        return
+
+    with key_lock(content_hash):
+        with artifact_lock:
+            pending = content_hash in pending_artifacts
+        shared = db.query(Poly).filter(Poly.content_hash == content_hash).first()
+        if pending or shared is not None:
+            return
+
+        mask_cache.discard(content_hash)
+
+        for path in paths:
+            if path and os.path.isfile(path):
+                os.remove(path)
+
+        with artifact_lock:
+            artifact_stats["removed"] += 1
+
+
+def cache_stats():
+    """
+    Counters of both cache tiers.
+
+    Returns
+    -------
+    dict
+        Counters of the memory and disk tiers.
+    """
+    with artifact_lock:
+        disk = dict(artifact_stats)
+
+    return {"memory": mask_cache.stats(), "disk": disk}
@@ -0,0 +1,474 @@
+"""
+Mask algebra service.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+from app.models import Poly
+from app.services.bitmask_service import BitMask
+from app.services.cache_service import (claim_artifact, key_lock, mask_cache,
+                                        record_artifact)
+from app.services.file_management import (FILE_FORMATS, open_nparray_file,
+                                          save_nparray_to_file)
+from app.services.filling_service import CANVAS_SHAPE
+from app.services.metrics_service import StageTimer
+from app.services.preview_service import preview_path
+from app.services.scanline_service import mask_spans
+from app.services.stats_service import mask_pixels
+
+# Boolean operations combining masks
+OPERATIONS = ["union", "intersection", "difference"]
+
+# Fields copied from a stored combination when it is linked
+ARTIFACT_FIELDS = [
+    "xsize",
+    "ysize",
+    "xoffset",
+    "yoffset",
+    "arrayfile",
+    "area",
+    "pixels",
+]
+
+# Number of rows of the combined window processed at once
+COMBINE_BAND_ROWS = 1024
+
+
+def query_inputs(db, ids):
+    """
+    Query the poly items of a combination, in the given order.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    ids : list
+        The ids of the poly items.
+
+    Returns
+    -------
+    list or None
+        The poly items, None when one of them does not exist.
+    """
+    polys = {poly.id: poly for poly in db.query(Poly).filter(Poly.id.in_(ids))}
+    if any(poly_id not in polys for poly_id in ids):
+        return None
+
+    return [polys[poly_id] for poly_id in ids]
+
+
+def stored_canvas(poly):
+    """
+    Get the canvas of a stored poly item.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+
+    Returns
+    -------
+    tuple
+        Rows and columns of the canvas, the default canvas for polys
+        stored before per request canvases.
+    """
+    return (
+        poly.xcanvas if poly.xcanvas is not None else CANVAS_SHAPE[0],
+        poly.ycanvas if poly.ycanvas is not None else CANVAS_SHAPE[1],
+    )
+
+
+def stored_frame(poly):
+    """
+    Get the window of the canvas the stored mask of a poly item covers.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+
+    Returns
+    -------
+    numpy.ndarray
+        First and stop row and column of the mask, as
+        (first row, first column, stop row, stop column).
+    """
+    if poly.xsize is None:
+        return np.array([0, 0, *stored_canvas(poly)], dtype=np.int64)
+
+    first = (poly.xoffset or 0, poly.yoffset or 0)
+
+    return np.array(
+        [first[0], first[1], first[0] + poly.xsize, first[1] + poly.ysize],
+        dtype=np.int64,
+    )
+
+
+def combined_window(frames, operation):
+    """
+    Get the window of the canvas a combination of masks can cover.
+
+    Parameters
+    ----------
+    frames : numpy.ndarray
+        Window of every mask, as (first row, first column, stop row,
+        stop column).
+    operation : str
+        The operation: union, intersection or difference.
+
+    Returns
+    -------
+    numpy.ndarray
+        The window, empty when no pixel can be filled.
+    """
+    if operation == "union":
+        window = np.concatenate([frames[:, :2].min(axis=0), frames[:, 2:].max(axis=0)])
+    elif operation == "intersection":
+        window = np.concatenate([frames[:, :2].max(axis=0), frames[:, 2:].min(axis=0)])
+    else:
+        window = frames[0].copy()
+
+    window[2:] = np.maximum(window[2:], window[:2])
+
+    return window
+
+
+def open_mask(poly):
+    """
+    Open the stored mask of a poly item, from memory when it is hot.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+
+    Returns
+    -------
+    numpy.ndarray or BitMask
+        The mask, memory-mapped when its format allows.
+    """
+    if poly.content_hash is not None:
+        mask = mask_cache.get(poly.content_hash)
+        if mask is not None:
+            return mask
+
+    return open_nparray_file(poly.arrayfile)
+
+
+def window_rows(mask, frame, rows, columns):
+    """
+    Cut the rows of a window of the canvas out of a mask.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray or BitMask
+        The mask.
+    frame : numpy.ndarray
+        Window of the mask in the canvas.
+    rows : tuple
+        First and stop row of the canvas.
+    columns : tuple
+        First and stop column of the canvas.
+
+    Returns
+    -------
+    numpy.ndarray
+        The pixels of the window, as booleans, False out of the mask.
+    """
+    block = np.zeros((rows[1] - rows[0], columns[1] - columns[0]), dtype=bool)
+    top, bottom = max(rows[0], frame[0]), min(rows[1], frame[2])
+    left, right = max(columns[0], frame[1]), min(columns[1], frame[3])
+    if top >= bottom or left >= right:
+        return block
+
+    part = mask[top - frame[0] : bottom - frame[0]]
+    block[top - rows[0] : bottom - rows[0], left - columns[0] : right - columns[0]] = (
+        part[:, left - frame[1] : right - frame[1]] != 0
+    )
+
+    return block
+
+
+def combine_masks(polys, operation, band_rows=COMBINE_BAND_ROWS):
+    """
+    Combine the stored masks of poly items.
+
+    Only the window of the canvas the result can cover is processed,
+    one band of rows at a time, reading the overlapping rows of every
+    mask. The result is cropped to its filled pixels and packed.
+
+    Parameters
+    ----------
+    polys : list
+        The poly items, the first one is the minuend of a difference.
+    operation : str
+        The operation: union, intersection or difference.
+    band_rows : int
+        Number of rows processed at once.
+
+    Returns
+    -------
+    mask : BitMask
+        The combined mask.
+    offset : tuple
+        Row and column of the mask within the canvas.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(
+            "Invalid operation. Pick one of: union, intersection, difference"
+        )
+    if len(polys) < 2:
+        raise ValueError("Combine at least two polys")
+    if len({stored_canvas(poly) for poly in polys}) > 1:
+        raise ValueError("Polys must share their canvas")
+    if any(poly.arrayfile is None for poly in polys):
+        raise ValueError("Polys must have a stored mask")
+
+    frames = np.array([stored_frame(poly) for poly in polys])
+    window = combined_window(frames, operation)
+    shape = tuple((window[2:] - window[:2]).tolist())
+    columns = (int(window[1]), int(window[3]))
+    if not shape[0] or not shape[1]:
+        return BitMask((0, 0)), (int(window[0]), int(window[1]))
+
+    # masks out of the window take no part
+    masks = [
+        (open_mask(poly), frame)
+        for poly, frame in zip(polys, frames)
+        if (frame[:2] < window[2:]).all() and (frame[2:] > window[:2]).all()
+    ]
+
+    combined = BitMask(shape)
+    filled_rows = np.zeros(shape[0], dtype=bool)
+    filled_columns = np.zeros(shape[1], dtype=bool)
+
+    for first in range(0, shape[0], band_rows):
+        stop = min(first + band_rows, shape[0])
+        rows = (int(window[0]) + first, int(window[0]) + stop)
+        band = window_rows(masks[0][0], masks[0][1], rows, columns)
+        for mask, frame in masks[1:]:
+            block = window_rows(mask, frame, rows, columns)
+            if operation == "union":
+                band |= block
+            elif operation == "intersection":
+                band &= block
+            else:
+                band &= ~block
+
+        combined.bits[first : first + band.shape[0]] = np.packbits(band, axis=1)
+        filled_rows[first : first + band.shape[0]] = band.any(axis=1)
+        filled_columns |= band.any(axis=0)
+
+    return crop_mask(combined, filled_rows, filled_columns, window[:2])
+
+
+def crop_mask(mask, filled_rows, filled_columns, offset):
+    """
+    Crop a packed mask to its filled pixels.
+
+    Parameters
+    ----------
+    mask : BitMask
+        The mask.
+    filled_rows : numpy.ndarray
+        Whether every row holds a filled pixel.
+    filled_columns : numpy.ndarray
+        Whether every column holds a filled pixel.
+    offset : numpy.ndarray
+        Row and column of the mask within the canvas.
+
+    Returns
+    -------
+    mask : BitMask
+        The cropped mask, empty when no pixel is filled.
+    offset : tuple
+        Row and column of the cropped mask within the canvas.
+    """
+    if not filled_rows.any():
+        return BitMask((0, 0)), (int(offset[0]), int(offset[1]))
+
+    rows = np.flatnonzero(filled_rows)[[0, -1]]
+    columns = np.flatnonzero(filled_columns)[[0, -1]]
+    offset = (int(offset[0] + rows[0]), int(offset[1] + columns[0]))
+    shape = (int(rows[1] - rows[0] + 1), int(columns[1] - columns[0] + 1))
+
+    if columns[0] == 0 and columns[1] == mask.shape[1] - 1:
+        return BitMask(shape, mask.bits[rows[0] : rows[1] + 1].copy()), offset
+
+    cropped = BitMask(shape)
+    for first in range(0, shape[0], COMBINE_BAND_ROWS):
+        stop = min(first + COMBINE_BAND_ROWS, shape[0])
+        band = mask.to_array(rows[0] + first, rows[0] + stop)
+        cropped.bits[first : first + band.shape[0]] = np.packbits(
+            band[:, columns[0] : columns[1] + 1], axis=1
+        )
+
+    return cropped, offset
+
+
+def combine_key(polys, operation, array_format):
+    """
+    Compute the content hash of a combination of stored masks.
+
+    Parameters
+    ----------
+    polys : list
+        The poly items.
+    operation : str
+        The operation: union, intersection or difference.
+    array_format : str
+        Format of the stored mask.
+
+    Returns
+    -------
+    str
+        Hex digest identifying the combined mask.
+    """
+    hashes = [poly.content_hash or f"{poly.id}:{poly.arrayfile}" for poly in polys]
+    if operation != "difference":
+        hashes = sorted(set(hashes))
+    else:
+        hashes = hashes[:1] + sorted(set(hashes[1:]))
+
+    request = {"operation": operation, "masks": hashes, "array_format": array_format}
+
+    return hashlib.sha256(json.dumps(request).encode("utf-8")).hexdigest()
+
+
+def combine_polys(
+    db, polys, operation, name, array_format="npy", preview=False, timer=None
+):
+    """
+    Combine the masks of poly items into a new poly item.
+
+    The new poly item has no vertices, its bounding box is the one of
+    its filled pixels, and empty combinations are not stored. A
+    combination already stored is linked instead of computed again. The
+    artifacts are claimed until the caller calls ``settle_artifact``.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    polys : list
+        The poly items, the first one is the minuend of a difference.
+    operation : str
+        The operation: union, intersection or difference.
+    name : str
+        The name of the new poly item.
+    array_format : str
+        Format of the stored mask.
+    preview : bool
+        Whether to keep a preview, rendered once the response is sent.
+    timer : StageTimer, optional
+        Timer of the request, a new one by default.
+
+    Returns
+    -------
+    Poly
+        The new poly item, not yet added to the database.
+    """
+    start_time = datetime.now()
+    if timer is None:
+        timer = StageTimer()
+    if array_format not in FILE_FORMATS:
+        raise ValueError("Invalid array format. Pick one of: npy, packbits, rle, tiles")
+    if db.query(Poly.id).filter(Poly.name == name).first() is not None:
+        raise ValueError("Poly with that name already exists")
+
+    key = combine_key(polys, operation, array_format)
+    fields = {}
+
+    with key_lock(key):
+        with timer.stage("lookup"):
+            stored = db.query(Poly).filter(Poly.content_hash == key).first()
+
+        if stored is not None and os.path.isfile(stored.arrayfile):
+            record_artifact(True)
+            for field in ARTIFACT_FIELDS:
+                fields[field] = getattr(stored, field)
+            fields["bbox"] = [stored.xmin, stored.ymin, stored.xmax, stored.ymax]
+        else:
+            record_artifact(False)
+            with timer.stage("rasterize"):
+                mask, offset = combine_masks(polys, operation)
+            if not mask.shape[0]:
+                raise ValueError("The combined mask is empty")
+            with timer.stage("save"):
+                path = save_nparray_to_file(mask, key, array_format, offset, operation)
+            mask_cache.put(key, mask)
+            fields.update(
+                xsize=mask.shape[0],
+                ysize=mask.shape[1],
+                xoffset=offset[0],
+                yoffset=offset[1],
+                arrayfile=str(path),
+                pixels=mask_pixels(mask),
+            )
+            # the area of a mask is the one of its pixels
+            fields["area"] = float(fields["pixels"])
+            last = (offset[0] + mask.shape[0] - 1, offset[1] + mask.shape[1] - 1)
+            fields["bbox"] = [offset[0], offset[1], *last]
+
+        # the artifacts are kept until the poly item is committed
+        claim_artifact(key)
+
+    canvas = stored_canvas(polys[0])
+    bbox = fields.pop("bbox")
+
+    return Poly(
+        name=name,
+        xcanvas=canvas[0],
+        ycanvas=canvas[1],
+        xmin=bbox[0],
+        ymin=bbox[1],
+        xmax=bbox[2],
+        ymax=bbox[3],
+        imagefile=str(preview_path(key)) if preview else None,
+        exectime=(datetime.now() - start_time).total_seconds(),
+        exectime_stages=timer.dumps(),
+        algorithm=operation,
+        content_hash=key,
+        **fields,
+    )
+
+
+def encode_combined(mask, offset, operation):
+    """
+    Encode a combined mask as JSON, its spans in canvas coordinates.
+
+    Parameters
+    ----------
+    mask : BitMask
+        The mask.
+    offset : tuple
+        Row and column of the mask within the canvas.
+    operation : str
+        The operation that combined the mask.
+
+    Returns
+    -------
+    bytes
+        JSON object with the window and number of filled pixels of the
+        mask and its [row, first column, stop column] spans.
+    """
+    parts = [np.zeros((0, 3), dtype=np.int64)]
+    shift = np.array([offset[0], offset[1], offset[1]])
+    for first in range(0, mask.shape[0], COMBINE_BAND_ROWS):
+        band = mask.to_array(first, first + COMBINE_BAND_ROWS)
+        rows, starts, stops = mask_spans(band)
+        parts.append(np.stack([rows + first, starts, stops], axis=1) + shift)
+
+    summary = {
+        "operation": operation,
+        "offset": [int(offset[0]), int(offset[1])],
+        "shape": list(mask.shape),
+        "pixels": mask_pixels(mask),
+    }
+    spans = json.dumps(np.concatenate(parts).tolist())
+
+    return f'{json.dumps(summary)[:-1]}, "spans": {spans}}}'.encode("utf-8")
@@ -0,0 +1,468 @@
+"""
+Point in polygon query service.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.config import CONTAINS_CACHE_SIZE
+from app.services.cache_service import get_poly_mask
+from app.services.poly_service import poly_rings, poly_vertices
+from app.services.scanline_service import EPS, polygon_edges
+
+# Number of (point, edge) tests run at once
+CHUNK_PAIRS = 1 << 22
+
+# Classes of the points, as returned by ``point_in_polygons``
+OUTSIDE, INSIDE, VERTEX, EDGE = 0, 1, 2, 3
+
+
+class EdgeIndex:
+    """
+    Edges of a polygon bucketed into horizontal slabs of rows.
+
+    A point is only tested against the edges overlapping the slab of its
+    row. The slabs are as thin as the edges allow while every edge is
+    registered in a bounded number of slabs, so the index takes O(edges)
+    memory.
+    """
+
+    def __init__(self, points, rings=None):
+        """
+        Build the index of a polygon.
+
+        Parameters
+        ----------
+        points : numpy.ndarray
+            The vertices, as (row, column) pairs.
+        rings : list, optional
+            Number of vertices of every ring, a single ring by default.
+        """
+        row_points = np.ascontiguousarray(points[:, 0], dtype=np.float64)
+        column_points = np.ascontiguousarray(points[:, 1], dtype=np.float64)
+        self.edges = polygon_edges(row_points, column_points, rings)
+
+        low = np.minimum(self.edges[0], self.edges[2])
+        high = np.maximum(self.edges[0], self.edges[2])
+        self.min_row = float(low.min())
+        self.max_row = float(high.max())
+
+        # about as many slabs as edges, fewer when the edges are tall
+        height = self.max_row - self.min_row
+        covered = float((high - low).sum())
+        count = low.shape[0]
+        slabs = count if not covered else int(count * height / covered)
+        self.slabs = max(1, min(count, slabs))
+        self.slab_height = height / self.slabs if height else 1.0
+
+        first = self.slab_of(low)
+        counts = self.slab_of(high) - first + 1
+        edges = np.repeat(np.arange(count), counts)
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        edge_slabs = first[edges] + np.arange(edges.shape[0]) - starts
+
+        # edges of every slab, contiguous and addressed by offsets
+        order = np.argsort(edge_slabs, kind="stable")
+        self.slab_edges = edges[order]
+        self.slab_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(edge_slabs, minlength=self.slabs))]
+        )
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes of the index.
+        """
+        return (
+            sum(edge.nbytes for edge in self.edges)
+            + self.slab_edges.nbytes
+            + self.slab_offsets.nbytes
+        )
+
+    def slab_of(self, rows):
+        """
+        Slab of rows within the rows of the polygon.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            The rows.
+
+        Returns
+        -------
+        numpy.ndarray
+            The slab of every row.
+        """
+        slabs = np.floor((rows - self.min_row) / self.slab_height).astype(np.int64)
+
+        return np.clip(slabs, 0, self.slabs - 1)
+
+    def classify(self, points, fill_rule="evenodd"):
+        """
+        Classify points relative to the polygon.
+
+        Every point gets the same class as with ``point_in_polygons``,
+        testing only the edges of its slab.
+
+        Parameters
+        ----------
+        points : numpy.ndarray
+            The points, as (row, column) pairs.
+        fill_rule : str
+            Inside of the rings: evenodd or nonzero.
+
+        Returns
+        -------
+        numpy.ndarray
+            The class of every point, as uint8: 0 outside, 1 inside,
+            2 vertex and 3 edge.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        classes = np.zeros(points.shape[0], dtype=np.uint8)
+
+        # points outside the rows of the polygon are outside
+        candidates = np.flatnonzero(
+            (points[:, 0] >= self.min_row) & (points[:, 0] <= self.max_row)
+        )
+        slabs = self.slab_of(points[candidates, 0])
+        counts = self.slab_offsets[slabs + 1] - self.slab_offsets[slabs]
+
+        # split the points so every chunk runs about CHUNK_PAIRS tests
+        totals = np.cumsum(counts)
+        total = int(totals[-1]) if totals.shape[0] else 0
+        bounds = np.searchsorted(totals, np.arange(CHUNK_PAIRS, total, CHUNK_PAIRS))
+        for chunk in np.split(np.arange(candidates.shape[0]), bounds):
+            if chunk.shape[0]:
+                selected = candidates[chunk]
+                classes[selected] = self.classify_slabs(
+                    points[selected], slabs[chunk], counts[chunk], fill_rule
+                )
+
+        return classes
+
+    def classify_slabs(self, points, slabs, counts, fill_rule):
+        """
+        Classify points against the edges of their slabs.
+
+        Parameters
+        ----------
+        points : numpy.ndarray
+            The points, as (row, column) pairs.
+        slabs : numpy.ndarray
+            Slab of every point.
+        counts : numpy.ndarray
+            Number of edges of the slab of every point.
+        fill_rule : str
+            Inside of the rings: evenodd or nonzero.
+
+        Returns
+        -------
+        numpy.ndarray
+            The class of every point.
+        """
+        # one entry per (point, edge of its slab) pair
+        pairs = np.repeat(np.arange(points.shape[0]), counts)
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        steps = np.arange(pairs.shape[0]) - starts
+        edges = self.slab_edges[self.slab_offsets[slabs][pairs] + steps]
+
+        row_start, column_start, row_end, column_end = self.edges
+        x0 = column_end[edges] - points[pairs, 1]
+        y0 = row_end[edges] - points[pairs, 0]
+        x1 = column_start[edges] - points[pairs, 1]
+        y1 = row_start[edges] - points[pairs, 0]
+
+        on_vertex = (np.abs(x0) < EPS) & (np.abs(y0) < EPS)
+
+        # the same ray crossings as point_in_polygons
+        right = (y0 > 0) != (y1 > 0)
+        left = (y0 < 0) != (y1 < 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cross = (x0 * y1 - x1 * y0) / (y1 - y0)
+        right &= cross > 0
+        left &= cross < 0
+
+        size = points.shape[0]
+        if fill_rule == "nonzero":
+            right = right * np.where(y0 > 0, 1, -1)
+            left = left * np.where(y1 < 0, 1, -1)
+            r_inside = count_pairs(pairs, right, size) != 0
+            l_inside = count_pairs(pairs, left, size) != 0
+        else:
+            r_inside = count_pairs(pairs, right, size) % 2 == 1
+            l_inside = count_pairs(pairs, left, size) % 2 == 1
+
+        classes = np.where(r_inside, INSIDE, OUTSIDE).astype(np.uint8)
+        classes[r_inside != l_inside] = EDGE
+        classes[count_pairs(pairs, on_vertex, size) > 0] = VERTEX
+
+        return classes
+
+    def intersects_box(self, box, fill_rule="evenodd"):
+        """
+        Check the polygon intersects a box, borders included.
+
+        The box overlaps the polygon when an edge clips the box, or when
+        the box lies inside the polygon, then its first corner does.
+
+        Parameters
+        ----------
+        box : tuple
+            Min row, min column, max row and max column.
+        fill_rule : str
+            Inside of the rings: evenodd or nonzero.
+
+        Returns
+        -------
+        bool
+            Whether the box and the polygon have a point in common.
+        """
+        row_start, column_start, row_end, column_end = self.edges
+        enter = np.zeros(row_start.shape[0])
+        leave = np.ones(row_start.shape[0])
+
+        # clip the edges to the rows, then the columns of the box
+        for start, end, low, high in [
+            (row_start, row_end, box[0], box[2]),
+            (column_start, column_end, box[1], box[3]),
+        ]:
+            delta = end - start
+            flat = delta == 0
+            within = (start >= low) & (start <= high)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                to_low = (low - start) / delta
+                to_high = (high - start) / delta
+            # flat edges are kept whole when within the box and dropped otherwise
+            entering = np.where(within, 0, np.inf)
+            leaving = np.where(within, 1, -np.inf)
+            enter = np.maximum(
+                enter, np.where(flat, entering, np.minimum(to_low, to_high))
+            )
+            leave = np.minimum(
+                leave, np.where(flat, leaving, np.maximum(to_low, to_high))
+            )
+
+        if (enter <= leave).any():
+            return True
+
+        return bool(self.classify(np.array([box[:2]], dtype=np.float64), fill_rule)[0])
+
+
+def count_pairs(pairs, values, size):
+    """
+    Sum values by point.
+
+    Parameters
+    ----------
+    pairs : numpy.ndarray
+        Point of every value.
+    values : numpy.ndarray
+        The values.
+    size : int
+        Number of points.
+
+    Returns
+    -------
+    numpy.ndarray
+        The sum of the values of every point, as integers.
+    """
+    return np.bincount(pairs, weights=values, minlength=size).astype(np.int64)
+
+
+class EdgeIndexCache:
+    """
+    In-process LRU cache of the edge indexes of stored polys.
+    """
+
+    def __init__(self, max_entries):
+        """
+        Create an empty cache.
+
+        Parameters
+        ----------
+        max_entries : int
+            Maximum number of indexes kept in memory.
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        """
+        Get an index, building it on a miss.
+
+        Parameters
+        ----------
+        key : tuple
+            Identity of the polygon.
+        build : callable
+            Builds the index of the polygon.
+
+        Returns
+        -------
+        EdgeIndex
+            The index.
+        """
+        with self.lock:
+            index = self.entries.get(key)
+            if index is not None:
+                self.entries.move_to_end(key)
+                return index
+
+        index = build()
+
+        with self.lock:
+            self.entries[key] = index
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return index
+
+
+# Edge indexes of the stored polys of this process
+edge_index_cache = EdgeIndexCache(CONTAINS_CACHE_SIZE)
+
+
+def poly_edge_index(poly):
+    """
+    Get the cached edge index of a stored poly item.
+
+    The index is keyed by the id and content hash of the poly, so edited
+    vertices get a new index.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+
+    Returns
+    -------
+    EdgeIndex
+        The index.
+    """
+    return edge_index_cache.get(
+        (poly.id, poly.content_hash),
+        lambda: EdgeIndex(poly_vertices(poly), poly_rings(poly)),
+    )
+
+
+def contains_points(poly, points):
+    """
+    Classify points relative to a stored poly item.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+    points : numpy.ndarray
+        The points, as (row, column) pairs.
+
+    Returns
+    -------
+    numpy.ndarray
+        The class of every point: 0 outside, 1 inside, 2 vertex and 3 edge.
+    """
+    if not has_vertices(poly):
+        return mask_classes(poly, points)
+
+    return poly_edge_index(poly).classify(points, poly.fill_rule or "evenodd")
+
+
+def has_vertices(poly):
+    """
+    Check a stored poly item has vertices, combined masks have none.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+
+    Returns
+    -------
+    bool
+        Whether the vertices are stored.
+    """
+    return poly.vertices is not None or poly.npinput is not None
+
+
+def mask_classes(poly, points):
+    """
+    Classify points against the stored mask of a poly item.
+
+    Every point takes the pixel it rounds to, inside when it is filled.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+    points : numpy.ndarray
+        The points, as (row, column) pairs.
+
+    Returns
+    -------
+    numpy.ndarray
+        The class of every point: 0 outside and 1 inside.
+    """
+    mask = get_poly_mask(poly)
+    pixels = np.floor(points + 0.5).astype(np.int64)
+    pixels -= np.array([poly.xoffset or 0, poly.yoffset or 0])
+    within = (pixels >= 0).all(axis=1) & (pixels < np.array(mask.shape)).all(axis=1)
+
+    classes = np.full(points.shape[0], OUTSIDE, dtype=np.uint8)
+    filled = mask[pixels[within, 0], pixels[within, 1]] != 0
+    classes[np.flatnonzero(within)[filled]] = INSIDE
+
+    return classes
+
+
+def mask_intersects(poly, box):
+    """
+    Check the stored mask of a poly item fills a pixel of a box.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+    box : tuple
+        Min row, min column, max row and max column of the query.
+
+    Returns
+    -------
+    bool
+        Whether a pixel within the box, or the one of a point, is filled.
+    """
+    if box[0] == box[2] and box[1] == box[3]:
+        return bool(mask_classes(poly, np.array([box[:2]], dtype=np.float64))[0])
+
+    mask = get_poly_mask(poly)
+    offset = np.array([poly.xoffset or 0, poly.yoffset or 0])
+    first = np.maximum(np.ceil(np.array(box[:2])).astype(np.int64) - offset, 0)
+    stop = np.floor(np.array(box[2:])).astype(np.int64) - offset + 1
+
+    return bool(mask[first[0] : max(stop[0], 0), first[1] : max(stop[1], 0)].any())
+
+
+def encode_classes(classes):
+    """
+    Encode the classes of points as a JSON array, without Python objects.
+
+    Parameters
+    ----------
+    classes : numpy.ndarray
+        The class of every point, from 0 to 3.
+
+    Returns
+    -------
+    bytes
+        The JSON array.
+    """
+    if not classes.shape[0]:
+        return b"[]"
+
+    encoded = np.full(2 * classes.shape[0] + 1, ord(","), dtype=np.uint8)
+    encoded[0] = ord("[")
+    encoded[1::2] = classes + ord("0")
+    encoded[-1] = ord("]")
+
+    return encoded.tobytes()
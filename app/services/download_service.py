@@ -0,0 +1,166 @@
+"""
+Artifact download service.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+
+# Number of bytes of an artifact sent at once
+DOWNLOAD_CHUNK_BYTES = 1 << 20
+
+
+def artifact_etag(poly, kind):
+    """
+    Get the strong ETag of an artifact of a poly item.
+
+    Artifacts are named after the content hash of their fill, so the
+    hash identifies their bytes without reading them. Polys stored
+    before content hashing fall back to the size and modification time
+    of the file.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+    kind : str
+        The artifact: array or preview.
+
+    Returns
+    -------
+    str or None
+        The quoted ETag, None when the file of a poly without content
+        hash is missing.
+    """
+    if poly.content_hash is not None:
+        return f'"{poly.content_hash}-{kind}"'
+
+    path = poly.arrayfile if kind == "array" else poly.imagefile
+    if path is None or not os.path.isfile(path):
+        return None
+
+    stat = os.stat(path)
+
+    return f'"{poly.id}-{kind}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def etag_matches(header, etag):
+    """
+    Check a conditional header against an ETag.
+
+    Parameters
+    ----------
+    header : str or None
+        If-None-Match or If-Range header of the request.
+    etag : str
+        The quoted ETag of the artifact.
+
+    Returns
+    -------
+    bool
+        Whether any listed ETag matches, weak ones included.
+    """
+    if header is None or etag is None:
+        return False
+
+    tags = [tag.strip() for tag in header.split(",")]
+
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def parse_range(header, size):
+    """
+    Parse the Range header of a request.
+
+    Only a single range of bytes is served, any other range is ignored
+    and the whole file sent.
+
+    Parameters
+    ----------
+    header : str or None
+        Range header of the request.
+    size : int
+        Number of bytes of the file.
+
+    Returns
+    -------
+    tuple or None
+        First and stop byte of the range, None for the whole file.
+    """
+    if header is None or not header.startswith("bytes="):
+        return None
+
+    spec = header[len("bytes=") :].strip()
+    if "," in spec or "-" not in spec:
+        return None
+
+    first, last = (value.strip() for value in spec.split("-", 1))
+    if not (first or last) or not (first or "0").isdigit():
+        return None
+    if last and not last.isdigit():
+        return None
+
+    if not first:
+        # suffix range, the last bytes of the file
+        start, stop = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        stop = min(int(last) + 1, size) if last else size
+        if last and int(last) < start:
+            return None
+
+    if start >= size or start >= stop:
+        raise ValueError(f"Range not satisfiable, the file holds {size} bytes")
+
+    return start, stop
+
+
+def stream_file(path, start, stop, chunk_bytes=DOWNLOAD_CHUNK_BYTES):
+    """
+    Stream a range of bytes of a file through a memory map.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file.
+    start : int
+        First byte to send.
+    stop : int
+        Byte after the last one to send.
+    chunk_bytes : int
+        Number of bytes yielded at once.
+
+    Yield
+    -------
+    bytes
+        The next chunk of the range.
+    """
+    if start >= stop:
+        return
+
+    mapped = np.memmap(Path(path), dtype=np.uint8, mode="r")
+    try:
+        for first in range(start, stop, chunk_bytes):
+            yield mapped[first : min(first + chunk_bytes, stop)].tobytes()
+    finally:
+        del mapped
+
+
+def artifact_size(path):
+    """
+    Get the number of bytes of an artifact.
+
+    Parameters
+    ----------
+    path : str or None
+        Path of the artifact.
+
+    Returns
+    -------
+    int or None
+        Number of bytes of the file, None when it is missing.
+    """
+    if path is None or not os.path.isfile(path):
+        return None
+
+    return os.path.getsize(path)
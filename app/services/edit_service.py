@@ -0,0 +1,367 @@
+"""
+Poly vertex edit service.
+"""
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from app.models import Poly
+from app.serializers import PolySerializer
+from app.services.cache_service import (claim_artifact, fill_key, hold_keys,
+                                        record_artifact)
+from app.services.contains_service import has_vertices
+from app.services.file_management import (FILE_FORMATS, nparray_path,
+                                          open_nparray_file,
+                                          patch_nparray_file)
+from app.services.filling_service import (CANVAS_SHAPE, fill_polyline,
+                                          polygon_window)
+from app.services.metrics_service import StageTimer
+from app.services.poly_service import (fill_poly, poly_canvas, poly_rings,
+                                       poly_vertices, stored_preview,
+                                       vertex_fields)
+from app.services.preview_service import preview_path
+from app.services.scanline_service import ring_neighbours
+from app.services.stats_service import mask_pixels, polygon_area
+from app.services.vertex_service import check_vertices
+
+# Fields of a poly item pointing at its artifacts
+ARTIFACT_FIELDS = [
+    "xsize",
+    "ysize",
+    "xoffset",
+    "yoffset",
+    "xcanvas",
+    "ycanvas",
+    "imagefile",
+    "arrayfile",
+]
+
+
+def poly_request(poly):
+    """
+    Rebuild the fill parameters of a stored poly item.
+
+    The stored poly keeps its canvas, window and files, the full_canvas
+    flag and the array format are read back from them.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+
+    Returns
+    -------
+    PolySerializer
+        The fill parameters of the poly item.
+    """
+    canvas = (
+        poly.xcanvas if poly.xcanvas is not None else CANVAS_SHAPE[0],
+        poly.ycanvas if poly.ycanvas is not None else CANVAS_SHAPE[1],
+    )
+    formats = {suffix: name for name, suffix in FILE_FORMATS.items()}
+
+    return PolySerializer(
+        name=poly.name,
+        npinput=None,
+        imagefile=poly.imagefile,
+        arrayfile=poly.arrayfile,
+        exectime=poly.exectime,
+        algorithm=poly.algorithm,
+        full_canvas=poly_frame(poly, canvas) == ((0, 0), canvas),
+        canvas_height=canvas[0],
+        canvas_width=canvas[1],
+        fill_rule=poly.fill_rule or "evenodd",
+        array_format=formats.get(Path(poly.arrayfile or "").suffix, "npy"),
+        preview=poly.imagefile is not None,
+    )
+
+
+def poly_frame(poly, canvas):
+    """
+    Get the window of the canvas the stored mask of a poly item covers.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+    canvas : tuple
+        Rows and columns of the canvas.
+
+    Returns
+    -------
+    offset : tuple
+        Row and column of the top left corner of the mask.
+    shape : tuple
+        Rows and columns of the mask, the canvas for polys stored before
+        cropping.
+    """
+    if poly.xsize is None:
+        return (0, 0), tuple(canvas)
+
+    return (poly.xoffset or 0, poly.yoffset or 0), (poly.xsize, poly.ysize)
+
+
+def apply_edits(points, edits):
+    """
+    Move vertices.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The vertices, as (row, column) pairs.
+    edits : list
+        The moves, with the index of the vertex and its new position.
+
+    Returns
+    -------
+    edited : numpy.ndarray
+        The moved vertices.
+    indices : numpy.ndarray
+        The indices of the moved vertices, sorted.
+    """
+    if not edits:
+        raise ValueError("Edits must move at least one vertex")
+
+    indices = np.array([edit.index for edit in edits], dtype=np.int64)
+    if (indices < 0).any() or (indices >= points.shape[0]).any():
+        raise ValueError(f"Vertex index must be between 0 and {points.shape[0] - 1}")
+    if any(len(edit.vertex) != 2 for edit in edits):
+        raise ValueError("Vertices must be [row, column] pairs")
+
+    edited = points.copy()
+    edited[indices] = check_vertices(
+        np.array([edit.vertex for edit in edits], dtype=np.float64)
+    )
+
+    return edited, np.unique(indices)
+
+
+def dirty_windows(points, edited, indices, rings, frame):
+    """
+    Compute the windows of the canvas moved vertices can change.
+
+    Moving a vertex only changes its two edges. The pixels whose class
+    changes are enclosed by the old and the new edges, so they lie in
+    the bounding box of both, clipped to the stored mask.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The vertices before the edits.
+    edited : numpy.ndarray
+        The vertices after the edits.
+    indices : numpy.ndarray
+        The indices of the moved vertices.
+    rings : list or None
+        Number of vertices of every ring, a single ring when None.
+    frame : tuple
+        Offset and shape of the stored mask within the canvas.
+
+    Returns
+    -------
+    firsts : numpy.ndarray
+        First row and column of every window.
+    lasts : numpy.ndarray
+        Last row and column of every window.
+    """
+    count = points.shape[0]
+    corners = np.stack(
+        [
+            ring_neighbours(rings, count, -1)[indices],
+            indices,
+            ring_neighbours(rings, count, 1)[indices],
+        ],
+        axis=1,
+    )
+    corners = np.concatenate([points[corners], edited[corners]], axis=1)
+
+    offset, shape = (np.array(value, dtype=np.int64) for value in frame)
+    firsts = np.floor(corners.min(axis=1)).astype(np.int64)
+    lasts = np.ceil(corners.max(axis=1)).astype(np.int64)
+    firsts = np.maximum(firsts, offset)
+    lasts = np.minimum(lasts, offset + shape - 1)
+    keep = (firsts <= lasts).all(axis=1)
+
+    return firsts[keep], lasts[keep]
+
+
+def patch_mask(path, request, edited, rings, windows, frame, timer):
+    """
+    Rasterize the windows of the edited polygon into its stored mask.
+
+    Every window is filled on its own canvas with the algorithm of the
+    poly item, then written over the window of the file. Outlines round
+    their vertices toward zero, so the vertices are rounded in canvas
+    coordinates before they are moved into the window. The pixels of
+    every window are counted before and after it is written, so the
+    change of the filled pixels needs no pass over the whole mask.
+
+    Parameters
+    ----------
+    path : str
+        Path of the stored mask.
+    request : PolySerializer
+        The fill parameters of the poly item.
+    edited : numpy.ndarray
+        The vertices after the edits.
+    rings : list or None
+        Number of vertices of every ring, a single ring when None.
+    windows : tuple
+        First and last rows and columns of every window.
+    frame : tuple
+        Offset and shape of the stored mask within the canvas.
+    timer : StageTimer
+        Timer of the request.
+
+    Returns
+    -------
+    int
+        Number of pixels filled minus the number of pixels cleared.
+    """
+    if request.algorithm == "outline":
+        edited = np.trunc(edited)
+
+    gained = 0
+    for first, last in zip(*windows):
+        with timer.stage("rasterize"):
+            block = fill_polyline(
+                edited - first,
+                request.algorithm,
+                canvas=tuple((last - first + 1).tolist()),
+                rings=rings,
+                fill_rule=request.fill_rule,
+            ).mask
+        top, left = (first - frame[0]).tolist()
+        with timer.stage("stats"):
+            # windows may overlap, the mask is read as patched so far
+            rows = open_nparray_file(path)[top : top + block.shape[0]]
+            cleared = np.count_nonzero(rows[:, left : left + block.shape[1]])
+            gained += int(np.count_nonzero(block)) - int(cleared)
+            del rows
+        with timer.stage("save"):
+            patch_nparray_file(path, (top, left), block)
+
+    return gained
+
+
+def edit_poly(db, poly, edits, timer=None):
+    """
+    Move vertices of a stored poly item and update its artifacts.
+
+    The stored mask is patched in place when the edit keeps its window
+    of the canvas: only the dirty windows around the moved vertices are
+    rasterized again, in a copy of the mask: the stored one is released
+    by the caller once the edit is committed.
+    When another poly already holds the edited fill its artifacts are
+    linked, and when the window of a cropped mask changes the poly is
+    filled again. The timings of the poly item are the ones of the edit.
+    The new artifacts are claimed until the caller calls ``settle_artifact``.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    poly : Poly
+        The poly item, updated but not committed.
+    edits : list
+        The moves, with the index of the vertex and its new position.
+    timer : StageTimer, optional
+        Timer of the request, a new one by default.
+
+    Returns
+    -------
+    dict
+        How the mask was updated (patched, linked or filled) and the
+        windows of the canvas rasterized again.
+    """
+    start_time = datetime.now()
+    if timer is None:
+        timer = StageTimer()
+    if poly.algorithm == "flood":
+        raise ValueError("Flood fills cannot be edited, their seed is not stored")
+    if not has_vertices(poly):
+        raise ValueError("Combined masks cannot be edited, they have no vertices")
+
+    request = poly_request(poly)
+    canvas = poly_canvas(request)
+    frame = poly_frame(poly, canvas)
+    with timer.stage("parse"):
+        points = poly_vertices(poly)
+        rings = poly_rings(poly)
+        edited, indices = apply_edits(points, edits)
+    key = fill_key(edited, request, canvas, rings)
+    windows = []
+
+    with hold_keys({key, poly.content_hash} - {None}):
+        with timer.stage("lookup"):
+            stored = (
+                db.query(Poly)
+                .filter(Poly.content_hash == key, Poly.id != poly.id)
+                .first()
+            )
+
+        in_frame = request.full_canvas or (
+            polygon_window(edited[:, 0], edited[:, 1], canvas) == frame
+        )
+
+        if stored is not None and os.path.isfile(stored.arrayfile):
+            record_artifact(True)
+            update = "linked"
+            fields = {name: getattr(stored, name) for name in ARTIFACT_FIELDS}
+            fields["imagefile"] = stored_preview(stored, request, key)
+            fields["pixels"] = stored.pixels
+        elif in_frame and poly.arrayfile and os.path.isfile(poly.arrayfile):
+            record_artifact(False)
+            update = "patched"
+            path = nparray_path(key, request.array_format)
+            # the stored mask is kept until the edit is committed
+            copied = str(path) != poly.arrayfile
+            if copied:
+                shutil.copyfile(poly.arrayfile, path)
+
+            windows = dirty_windows(points, edited, indices, rings, frame)
+            try:
+                gained = patch_mask(path, request, edited, rings, windows, frame, timer)
+            except Exception:
+                if copied:
+                    os.remove(path)
+                raise
+            fields = {
+                "arrayfile": str(path),
+                "imagefile": str(preview_path(key)) if request.preview else None,
+                "pixels": None if poly.pixels is None else poly.pixels + gained,
+            }
+        else:
+            record_artifact(False)
+            update = "filled"
+            filled = fill_poly(request, edited, key, timer, rings)
+            fields = {
+                name: getattr(filled, name)
+                for name in ARTIFACT_FIELDS + ["area", "pixels"]
+            }
+
+        # the artifacts are kept until the edit is committed
+        claim_artifact(key)
+
+    fields.update(vertex_fields(edited, rings))
+    if "area" not in fields:
+        with timer.stage("stats"):
+            fields["area"], _ = polygon_area(edited, rings, request.fill_rule)
+            if fields["pixels"] is None:
+                fields["pixels"] = mask_pixels(open_nparray_file(fields["arrayfile"]))
+    fields.update(
+        npinput=None,
+        content_hash=key,
+        exectime=(datetime.now() - start_time).total_seconds(),
+        exectime_stages=timer.dumps(),
+    )
+    for name, value in fields.items():
+        setattr(poly, name, value)
+
+    return {
+        "update": update,
+        "windows": [first.tolist() + last.tolist() for first, last in zip(*windows)],
+    }
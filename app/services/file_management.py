@@ -1,40 +1,430 @@
 """
 File management service.
 """
+import json
+import struct
 from pathlib import Path
 
 import numpy as np
-from matplotlib import pyplot as plt
-from numpy import save
+from numpy import load, save
 
+from app.config import TILE_SIZE
+from app.services.bitmask_service import BitMask
+from app.services.scanline_service import fill_spans, mask_spans
+from app.services.tile_service import (decode_tile, encode_tile, tile_levels,
+                                       tile_pyramid)
 
-def save_nparray_to_file(nparray: "nparray", filename: str):
+# Result formats and the suffix of their files
+FILE_FORMATS = {"npy": ".npy", "packbits": ".npb", "rle": ".rle", "tiles": ".tls"}
+
+# Leading bytes of the packbits, rle and tiles files
+MASK_MAGIC = b"POLYMASK"
+
+# Number of rows of a packed mask unpacked at once while saving it
+UNPACK_BAND_ROWS = 1024
+
+
+def nparray_path(filename: str, file_format: str = "npy"):
+    """
+    Path of the file an array is saved to.
+
+    Parameters
+    ----------
+    filename : str
+        The filename to save the numpy array to.
+    file_format : str
+        Format of the file: npy, packbits, rle or tiles.
+
+    Returns
+    -------
+    Path
+        Path of the file in the data folder.
+    """
+    return Path(__file__).parents[1] / f"data/{filename}{FILE_FORMATS[file_format]}"
+
+
+def save_nparray_to_file(
+    nparray: "nparray",
+    filename: str,
+    file_format: str = "npy",
+    offset: tuple = (0, 0),
+    algorithm: str = None,
+):
     """
     Save numpy array to file.
 
+    Packed masks are saved as they are in the packbits format and
+    unpacked one band of rows at a time in the other formats. The tiles
+    format holds the compressed tiles of every level of the pyramid of
+    the mask, indexed in the header; empty tiles are left out.
+
     Parameters
     ----------
-    nparray : nparray
+    nparray : nparray or BitMask
         Numpy array to save.
     filename : str
         The filename to save the numpy array to.
+    file_format : str
+        Format of the file: npy, packbits, rle or tiles.
+    offset : tuple
+        Offset of the array within the canvas, stored in the file header.
+    algorithm : str, optional
+        Algorithm used to fill the array, stored in the file header.
     """
+    if file_format not in FILE_FORMATS:
+        raise ValueError("Invalid file format. Pick one of: npy, packbits, rle, tiles")
+
     try:
-        loc_path = Path(__file__).parents[1] / f"data/{filename}"
+        loc_path = nparray_path(filename, file_format)
+
+        if file_format == "npy" and isinstance(nparray, BitMask):
+            saved = np.lib.format.open_memmap(
+                loc_path, "w+", np.uint8, nparray.shape
+            )
+            for first, band in mask_bands(nparray):
+                saved[first : first + band.shape[0]] = band
+            saved.flush()
+            del saved
+
+            return loc_path
+
+        if file_format == "npy":
+            # save the numpy array to the npy file
+            save(loc_path, nparray)
+
+            return loc_path
+
+        header = {
+            "format": file_format,
+            "shape": list(nparray.shape),
+            "offset": [int(offset[0]), int(offset[1])],
+            "algorithm": algorithm,
+        }
+
+        if file_format == "tiles":
+            header["tile_size"] = TILE_SIZE
+            header["levels"] = tile_levels(
+                (offset[0] + nparray.shape[0], offset[1] + nparray.shape[1]), TILE_SIZE
+            )
+            header["tiles"], chunks, start = {}, [], 0
+            for level, tx, ty, tile in tile_pyramid(nparray, offset, TILE_SIZE):
+                chunks.append(encode_tile(tile))
+                header["tiles"][f"{level}/{tx}/{ty}"] = [start, len(chunks[-1])]
+                start += len(chunks[-1])
+            payload = b"".join(chunks)
+        elif file_format == "packbits" and isinstance(nparray, BitMask):
+            payload = nparray.bits.tobytes()
+        elif file_format == "packbits":
+            payload = np.packbits(nparray != 0, axis=1).tobytes()
+        else:
+            payload = b"".join(
+                (
+                    np.stack(mask_spans(band), axis=1) + np.array([first, 0, 0])
+                ).astype("<i4").tobytes()
+                for first, band in mask_bands(nparray)
+            )
 
-        # save the numpy array to the npy file
-        save(loc_path, nparray)
-        loc_path = loc_path.with_suffix(".npy")
+        with open(loc_path, "wb") as mask_file:
+            write_mask_header(mask_file, header)
+            mask_file.write(payload)
 
         return loc_path
     except:
         raise ValueError("Something went wrong saving the file. Please try again.")
 
 
+def mask_bands(nparray):
+    """
+    Split a mask into bands of rows.
+
+    Parameters
+    ----------
+    nparray : nparray or BitMask
+        The mask, bands of packed masks are unpacked.
+
+    Yield
+    -------
+    tuple
+        First row of the band and its rows, as uint8.
+    """
+    if not isinstance(nparray, BitMask):
+        yield 0, nparray
+        return
+
+    for first in range(0, nparray.shape[0], UNPACK_BAND_ROWS):
+        yield first, nparray.to_array(first, first + UNPACK_BAND_ROWS)
+
+
+def load_nparray_from_file(path):
+    """
+    Load numpy array from a file of any result format.
+
+    Parameters
+    ----------
+    path : str
+        Path of the npy, packbits, rle or tiles file.
+
+    Returns
+    -------
+    nparray : numpy.ndarray
+        The loaded array.
+    header : dict
+        Format, shape, offset and algorithm of the array. The offset and
+        algorithm of npy files are not stored in the file and are None.
+    """
+    path = Path(path)
+
+    if path.suffix == FILE_FORMATS["npy"]:
+        nparray = load(path)
+        header = {
+            "format": "npy",
+            "shape": list(nparray.shape),
+            "offset": None,
+            "algorithm": None,
+        }
+        return nparray, header
+
+    with open(path, "rb") as mask_file:
+        header = read_mask_header(mask_file)
+        payload = mask_file.read()
+
+    shape = tuple(header["shape"])
+
+    if header["format"] == "packbits":
+        packed = np.frombuffer(payload, dtype=np.uint8).reshape(shape[0], -1)
+        nparray = np.unpackbits(packed, axis=1, count=shape[1])
+    elif header["format"] == "rle":
+        spans = np.frombuffer(payload, dtype="<i4").reshape(-1, 3)
+        nparray = fill_spans(
+            np.zeros(shape, dtype=np.uint8), spans[:, 0], spans[:, 1], spans[:, 2]
+        )
+    elif header["format"] == "tiles":
+        nparray = untile_mask(payload, header)
+    else:
+        raise ValueError("Invalid file format.")
+
+    return nparray, header
+
+
+def open_nparray_file(path):
+    """
+    Open the array of a file without reading it when its format allows.
+
+    Npy files are memory-mapped as they are and packbits files as the
+    packed rows of a bit mask, the other formats are loaded.
+
+    Parameters
+    ----------
+    path : str
+        Path of the npy, packbits, rle or tiles file.
+
+    Returns
+    -------
+    numpy.ndarray or BitMask
+        The read-only array.
+    """
+    path = Path(path)
+
+    if path.suffix == FILE_FORMATS["npy"]:
+        return load(path, mmap_mode="r")
+
+    with open(path, "rb") as mask_file:
+        header = read_mask_header(mask_file)
+        start = mask_file.tell()
+
+    if header["format"] != "packbits":
+        return load_nparray_from_file(path)[0]
+
+    shape = tuple(header["shape"])
+    if not shape[0] or not shape[1]:
+        return BitMask(shape)
+
+    bits = np.memmap(
+        path, np.uint8, "r", offset=start, shape=(shape[0], (shape[1] + 7) // 8)
+    )
+
+    return BitMask(shape, bits)
+
+
+def untile_mask(payload, header):
+    """
+    Assemble a mask from the full resolution tiles of a tiles file.
+
+    Parameters
+    ----------
+    payload : bytes
+        The compressed tiles.
+    header : dict
+        Shape, offset, tile size and index of the tiles.
+
+    Returns
+    -------
+    numpy.ndarray
+        The mask.
+    """
+    size = header["tile_size"]
+    offset = header["offset"]
+    nparray = np.zeros(header["shape"], dtype=np.uint8)
+
+    for name, (start, length) in header["tiles"].items():
+        level, tx, ty = (int(value) for value in name.split("/"))
+        if level:
+            continue
+
+        tile = decode_tile(payload[start : start + length], size)
+        top, left = ty * size - offset[0], tx * size - offset[1]
+        rows = slice(max(top, 0), top + size)
+        columns = slice(max(left, 0), left + size)
+        window = nparray[rows, columns]
+        window |= tile[
+            rows.start - top : rows.start - top + window.shape[0],
+            columns.start - left : columns.start - left + window.shape[1],
+        ]
+
+    return nparray
+
+
+def load_tile_from_file(path, level, tx, ty):
+    """
+    Load a single tile of a tiles file.
+
+    Only the header and the bytes of the tile are read.
+
+    Parameters
+    ----------
+    path : str
+        Path of the tiles file.
+    level : int
+        Level of the tile, 0 is the full resolution.
+    tx : int
+        Column of the tile.
+    ty : int
+        Row of the tile.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        The pixels of the tile, None when the tile is empty.
+    """
+    with open(path, "rb") as mask_file:
+        header = read_mask_header(mask_file)
+        if header["format"] != "tiles":
+            raise ValueError("Invalid file format.")
+        if not 0 <= level < header["levels"]:
+            raise ValueError(f"Level must be between 0 and {header['levels'] - 1}")
+
+        entry = header["tiles"].get(f"{level}/{tx}/{ty}")
+        if entry is None:
+            return None
+
+        mask_file.seek(entry[0], 1)
+        payload = mask_file.read(entry[1])
+
+    return decode_tile(payload, header["tile_size"])
+
+
+def patch_nparray_file(path, first, block):
+    """
+    Overwrite a window of a saved array.
+
+    Npy and packbits files are patched in place through a memory map,
+    only the bytes of the window are written. Rle and tiles files hold
+    no fixed layout and are saved again.
+
+    Parameters
+    ----------
+    path : str
+        Path of the npy, packbits, rle or tiles file.
+    first : tuple
+        Row and column of the top left corner of the window in the array.
+    block : numpy.ndarray
+        The new values of the window, as uint8.
+    """
+    path = Path(path)
+    rows = slice(first[0], first[0] + block.shape[0])
+
+    if path.suffix == FILE_FORMATS["npy"]:
+        saved = load(path, mmap_mode="r+")
+        saved[rows, first[1] : first[1] + block.shape[1]] = block
+        saved.flush()
+        del saved
+        return
+
+    with open(path, "rb") as mask_file:
+        header = read_mask_header(mask_file)
+        start = mask_file.tell()
+
+    if header["format"] in ["rle", "tiles"]:
+        nparray, _ = load_nparray_from_file(path)
+        nparray[rows, first[1] : first[1] + block.shape[1]] = block
+        save_nparray_to_file(
+            nparray, path.stem, header["format"], header["offset"], header["algorithm"]
+        )
+        return
+
+    shape = tuple(header["shape"])
+    bits = np.memmap(
+        path, np.uint8, "r+", offset=start, shape=(shape[0], (shape[1] + 7) // 8)
+    )
+
+    # rewrite the whole bytes covering the columns of the window
+    first_byte = first[1] // 8
+    last_byte = (first[1] + block.shape[1] + 7) // 8
+    lead = first[1] - 8 * first_byte
+    unpacked = np.unpackbits(bits[rows, first_byte:last_byte], axis=1)
+    unpacked[:, lead : lead + block.shape[1]] = block != 0
+    bits[rows, first_byte:last_byte] = np.packbits(unpacked, axis=1)
+    bits.flush()
+    del bits
+
+
+def write_mask_header(mask_file, header):
+    """
+    Write the header of a packbits, rle or tiles file.
+
+    Parameters
+    ----------
+    mask_file : file
+        File opened for binary writing.
+    header : dict
+        Format, shape, offset and algorithm of the array.
+    """
+    encoded = json.dumps(header).encode("utf-8")
+    mask_file.write(MASK_MAGIC)
+    mask_file.write(struct.pack("<I", len(encoded)))
+    mask_file.write(encoded)
+
+
+def read_mask_header(mask_file):
+    """
+    Read the header of a packbits, rle or tiles file.
+
+    Parameters
+    ----------
+    mask_file : file
+        File opened for binary reading.
+
+    Returns
+    -------
+    dict
+        Format, shape, offset and algorithm of the array.
+    """
+    if mask_file.read(len(MASK_MAGIC)) != MASK_MAGIC:
+        raise ValueError("Invalid mask file.")
+
+    (length,) = struct.unpack("<I", mask_file.read(4))
+
+    return json.loads(mask_file.read(length).decode("utf-8"))
+
+
 def save_matplot_figure(nparr: "nparray", filename: str):
     """
     Save matplotlib figure to file.
 
+    Superseded by the PNG previews of ``preview_service``. Matplotlib is
+    only imported when this is called, and every call draws on its own
+    figure instead of the global pyplot one.
+
     Parameters
     ----------
     nparr : nparray
@@ -43,12 +433,15 @@ def save_matplot_figure(nparr: "nparray", filename: str):
         The filename to save the plot to.
     """
     try:
+        from matplotlib.figure import Figure
+
         loc_path = Path(__file__).parents[1] / f"data/{filename}-plot.png"
 
         # check all the ones in the nparray and add them to the plot
         poly_check = np.where(nparr == 1)
-        plt.plot(poly_check[0], poly_check[1])
-        plt.savefig(loc_path)
+        figure = Figure()
+        figure.subplots().plot(poly_check[0], poly_check[1])
+        figure.savefig(loc_path)
 
         return loc_path
     except:
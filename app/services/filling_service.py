@@ -3,95 +3,370 @@ Polygon filling service.
 """
 import math
 from datetime import datetime
+from typing import NamedTuple, Tuple
 
 import numpy as np
 from skimage.draw import polygon
 
+from app.config import CANVAS_HEIGHT, CANVAS_WIDTH
+from app.services.band_service import fill_polyline_bands
+from app.services.bitmask_service import BitMask
+from app.services.scanline_service import (FILL_RULES, fill_spans,
+                                           polygon_edges, polygon_spans,
+                                           ring_neighbours, window_spans)
 
-def fill_polyline(polygon_points, algorithm, flood_x=None, flood_y=None):
+
+# Default logical canvas the polygons are drawn on (rows, columns)
+CANVAS_SHAPE = (CANVAS_HEIGHT, CANVAS_WIDTH)
+
+# Algorithms that can fill a bit-packed mask
+PACKED_ALGORITHMS = ["rourke", "fast", "outline"]
+
+# Algorithms that can fill several rings and pick a fill rule
+RING_ALGORITHMS = ["rourke", "outline"]
+
+
+class FillResult(NamedTuple):
+    """
+    Result of a polygon fill.
+
+    The mask is either the full canvas or the window of the canvas
+    covered by the polygon's clipped bounding box.
+    """
+
+    mask: np.ndarray
+    exectime: float
+    offset: Tuple[int, int] = (0, 0)
+    canvas: Tuple[int, int] = CANVAS_SHAPE
+
+
+def fill_polyline(
+    polygon_points,
+    algorithm,
+    flood_x=None,
+    flood_y=None,
+    crop=False,
+    connectivity=4,
+    max_spans=None,
+    workers=1,
+    band_height=1024,
+    out_path=None,
+    canvas=CANVAS_SHAPE,
+    packed=False,
+    rings=None,
+    fill_rule="evenodd",
+):
     """
     Method for handling algorithm selection.
 
     Parameters
     ----------
-    arr : list
-        Array of points that define the polygon.
+    polygon_points : list or numpy.ndarray
+        Array of (row, column) points that define the polygon.
     algorithm : str
         Algorithm to use for filling the polygon.
+    flood_x : int, optional
+        Column of the flood fill start position.
+    flood_y : int, optional
+        Row of the flood fill start position.
+    crop : bool
+        Rasterize only into the polygon's clipped bounding box
+        instead of the full canvas.
+    connectivity : int
+        Flood fill 4-connected or 8-connected pixels.
+    max_spans : int, optional
+        Memory bound of the flood fill, in spans waiting on its stack.
+    workers : int
+        Number of processes rasterizing bands of rows for the
+        rourke algorithm and for the fast algorithm with integer
+        vertices, the fill is serial for 1.
+    band_height : int
+        Number of rows of every band.
+    out_path : str, optional
+        Path of an npy file to fill directly through a memory map
+        instead of building the mask in memory.
+    canvas : tuple
+        Rows and columns of the canvas.
+    packed : bool
+        Fill a ``BitMask`` of 1 bit per pixel instead of a uint8 array.
+        Only serial rourke, fast and outline fills in memory are packed.
+    rings : list, optional
+        Number of vertices of every ring of the polygon, holes and
+        disjoint parts included, a single ring by default. Only the
+        rourke and outline algorithms draw several rings.
+    fill_rule : str
+        Inside of the rings for the rourke algorithm: evenodd or nonzero.
+
+    Returns
+    -------
+    FillResult
+        The filled mask, the time taken to fill and process the polygon,
+        the offset of the mask within the canvas and the canvas shape.
+    """
+    if algorithm not in ["rourke", "fast", "flood", "outline"]:
+        raise ValueError("Invalid algorithm.")
+    if canvas[0] < 1 or canvas[1] < 1:
+        raise ValueError("Canvas must have at least one row and one column.")
+    if fill_rule not in FILL_RULES:
+        raise ValueError("Invalid fill rule. Pick one of: evenodd, nonzero")
+    if algorithm not in RING_ALGORITHMS and (
+        rings is not None or fill_rule != "evenodd"
+    ):
+        raise ValueError(
+            "Only the rourke and outline algorithms fill rings with a fill rule."
+        )
+
+    canvas = (int(canvas[0]), int(canvas[1]))
+
+    start_time = datetime.now()
+
+    # prepare the x y points, without copying an array of pairs
+    points = np.asarray(polygon_points, dtype=np.float64).reshape(-1, 2)
+    rows, columns = points[:, 0], points[:, 1]
+    if rings is not None and sum(rings) != points.shape[0]:
+        raise ValueError("Rings must hold all the vertices.")
+
+    # the bands follow the scanline rules, the ones of skimage only
+    # agree with them for integer vertices
+    banded = workers > 1 and (
+        algorithm == "rourke"
+        or (algorithm == "fast" and bool((points == np.round(points)).all()))
+    )
+    packed = (
+        packed and out_path is None and not banded and algorithm in PACKED_ALGORITHMS
+    )
+
+    if crop:
+        offset, shape = polygon_window(rows, columns, canvas)
+
+        # move the polygon into the window coordinates
+        rows = rows - offset[0]
+        columns = columns - offset[1]
+        if flood_x is not None and flood_y is not None:
+            flood_x -= offset[1]
+            flood_y -= offset[0]
+    else:
+        offset, shape = (0, 0), canvas
+
+    if out_path is not None:
+        # the pages are written back to the file as they are filled
+        nparr = np.lib.format.open_memmap(out_path, "w+", np.uint8, shape)
+    elif packed:
+        nparr = BitMask(shape)
+    else:
+        nparr = np.zeros(shape, dtype=np.uint8)
+
+    if banded:
+        result = fill_polyline_bands(
+            rows,
+            columns,
+            nparr,
+            algorithm,
+            workers,
+            band_height,
+            out_path,
+            rings,
+            fill_rule,
+        )
+    elif algorithm == "rourke":
+        result = fill_polyline_rourke(rows, columns, nparr, rings, fill_rule)
+    elif algorithm == "fast":
+        result = fill_polygon_fast(nparr, rows, columns)
+    if algorithm == "flood":
+        result = fill_polyline_flood(
+            rows, columns, nparr, flood_x, flood_y, connectivity, max_spans
+        )
+    if algorithm == "outline":
+        result = fill_polyline_outline(rows, columns, nparr, rings)
+
+    if out_path is not None:
+        result.flush()
+
+    end_time = datetime.now()
+    execution_time = (end_time - start_time).total_seconds()
+
+    return FillResult(result, execution_time, offset, canvas)
+
+
+def polygon_window(rows, columns, canvas):
+    """
+    Compute the bounding box of a polygon clipped to the canvas.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray
+        Row coordinates of the polygon.
+    columns : numpy.ndarray
+        Column coordinates of the polygon.
+    canvas : tuple
+        Shape of the canvas.
+
+    Returns
+    -------
+    offset : tuple
+        Row and column of the top left corner of the window.
+    shape : tuple
+        Shape of the window, empty if the polygon is off the canvas.
+    """
+    min_row = max(0, int(math.floor(np.min(rows))))
+    max_row = min(canvas[0] - 1, int(math.ceil(np.max(rows))))
+    min_column = max(0, int(math.floor(np.min(columns))))
+    max_column = min(canvas[1] - 1, int(math.ceil(np.max(columns))))
+
+    if min_row > max_row or min_column > max_column:
+        return (0, 0), (0, 0)
+
+    return (min_row, min_column), (max_row - min_row + 1, max_column - min_column + 1)
+
+
+def expand_to_canvas(result):
+    """
+    Build the full canvas for a (possibly cropped) fill result.
+
+    Parameters
+    ----------
+    result : FillResult
+        The fill result to expand.
 
     Returns
     -------
     numpy.ndarray
+        Mask with the shape of the logical canvas.
+    """
+    if result.mask.shape == tuple(result.canvas):
+        return result.mask
+
+    mask = result.mask
+    if isinstance(mask, BitMask):
+        mask = mask.to_array()
+
+    nparr = np.zeros(result.canvas, dtype=mask.dtype)
+    row, column = result.offset
+    nparr[row : row + mask.shape[0], column : column + mask.shape[1]] = mask
+
+    return nparr
+
+
+def fill_polyline_flood(
+    rows, columns, nparr, flood_x=None, flood_y=None, connectivity=4, max_spans=None
+):
+    """
+    Draw the polygon outline and flood fill its inside.
+
+    Without a start position, the outside of the outline is flooded from
+    the border of a window padded on every side, and what the flood does
+    not reach is the inside. Where the polygon is clipped by the array,
+    the border is closed first, see ``close_border``.
+
+    Parameters
+    ----------
+    rows : list
+        Row coordinates of vertices of polygon.
+    columns : list
+        Column coordinates of vertices of polygon.
+    nparr : ndarray
+        Array of points that define the filled polygon.
+    flood_x : int, optional
+        Column of the flood fill start position.
+    flood_y : int, optional
+        Row of the flood fill start position.
+    connectivity : int
+        Fill 4-connected or 8-connected pixels from the start position.
+    max_spans : int, optional
+        Maximum number of spans waiting on the flood fill stack.
+
+    Returns
+    -------
+    nparr : numpy.ndarray
         Array of points that define the filled polygon.
-    execution_time : float
-        Time taken to fill and process the polygon.
-    """
-    nparr = np.zeros((19200, 10800), dtype=np.uint8)
-
-    if algorithm in ["rourke", "fast"]:
-        start_time = datetime.now()
-        rows, columns = [], []
-
-        # prepare the x y points
-        for i in range(len(polygon_points)):
-            rows.append(polygon_points[i][0])
-            columns.append(polygon_points[i][1])
-
-        if algorithm == "rourke":
-            result = fill_polyline_rourke(rows, columns, nparr)
-        if algorithm == "fast":
-            result = fill_polygon_fast(nparr, rows, columns)
-
-        end_time = datetime.now()
-        execution_time = (end_time - start_time).total_seconds()
-
-        return (result, execution_time)
-    elif algorithm == "flood":
-        start_time = datetime.now()
-        fill_points = []
-        polygon_points.append(polygon_points[0])
-
-        # apply bresemham's line algorithm to each pair of points
-        for i in range(len(polygon_points) - 1):
-            fill_points.extend(
-                list(
-                    bresenham(
-                        polygon_points[i][0],
-                        polygon_points[i][1],
-                        polygon_points[i + 1][0],
-                        polygon_points[i + 1][1],
-                    )
-                )
-            )
-
-        # Fill the points
-        xarr, yarr = [], []
-        for i in fill_points:
-            nparr[i[0]][i[1]] = 1
-            xarr.append(i[0])
-            yarr.append(i[1])
-
-        if flood_x and flood_y:
-            flood_fill_4(flood_x, flood_y, 0, 1, nparr)
-        else:
-            # find the latter points of the polygon
-            min_x = min(xarr)
-            max_x = max(xarr)
-            min_y = min(yarr)
-            max_y = max(yarr)
-
-            # compute the center of the polygon
-            x_start = max_x - (max_x - min_x)
-            y_start = max_y - (max_y - min_y)
-
-            # Fill the polygon recursively
-            flood_fill_4(x_start, y_start, 0, 1, nparr)
-
-        end_time = datetime.now()
-        execution_time = (end_time - start_time).total_seconds()
-        return (nparr, execution_time)
+    """
+    # draw the outline with a single fancy-index assignment
+    xarr, yarr = outline_pixels(rows, columns, nparr.shape)
+    nparr[xarr, yarr] = 1
+
+    if flood_x is not None and flood_y is not None:
+        if xarr.shape[0]:
+            flood_fill(flood_x, flood_y, 0, 1, nparr, connectivity, max_spans)
     else:
-        raise ValueError("Invalid algorithm.")
+        # find the latter points of the polygon within the array, its inside
+        # may reach the edges of the array without any outline pixel there
+        min_x = max(int(np.floor(np.min(rows))), 0)
+        max_x = min(int(np.ceil(np.max(rows))), nparr.shape[0] - 1)
+        min_y = max(int(np.floor(np.min(columns))), 0)
+        max_y = min(int(np.ceil(np.max(columns))), nparr.shape[1] - 1)
+        if min_x > max_x or min_y > max_y:
+            return nparr
+
+        # flood the outside of the outline from the border of a padded window,
+        # whatever the flood does not reach is the inside of the polygon
+        window = nparr[min_x : max_x + 1, min_y : max_y + 1]
+        outside = np.zeros((window.shape[0] + 2, window.shape[1] + 2), np.uint8)
+        outside[1:-1, 1:-1] = window
+        close_border(rows, columns, outside, (min_x - 1, min_y - 1))
+
+        border = np.ones(outside.shape, dtype=bool)
+        border[1:-1, 1:-1] = False
+        for row, column in zip(*np.nonzero(border & (outside == 0))):
+            if outside[row, column] == 0:
+                flood_fill(int(column), int(row), 0, 2, outside, 4, max_spans)
+        window[outside[1:-1, 1:-1] == 0] = 1
+
+    return nparr
+
+
+def close_border(rows, columns, outside, origin):
+    """
+    Close the border of a padded window where the polygon crosses it.
+
+    The border of the window lies beyond the array on the sides the
+    outline is clipped by the array. There the outline pixels and the
+    pixels inside the polygon stop the flood of the outside, so it does
+    not leak into the polygon through the clipped outline.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray
+        Row coordinates of vertices of polygon.
+    columns : numpy.ndarray
+        Column coordinates of vertices of polygon.
+    outside : numpy.ndarray
+        The padded window, its border is set to 1 inside the polygon.
+    origin : tuple
+        Row and column of the padded window within the array.
+    """
+    rows = np.asarray(rows, dtype=np.float64)
+    columns = np.asarray(columns, dtype=np.float64)
+    last = (origin[0] + outside.shape[0] - 1, origin[1] + outside.shape[1] - 1)
+
+    row_values, column_values = bresenham_polygon(rows, columns)
+    within = (
+        (row_values >= origin[0])
+        & (row_values <= last[0])
+        & (column_values >= origin[1])
+        & (column_values <= last[1])
+    )
+    on_border = within & (
+        np.isin(row_values, origin[0:1] + last[0:1])
+        | np.isin(column_values, origin[1:] + last[1:])
+    )
+    outside[row_values[on_border] - origin[0], column_values[on_border] - origin[1]] = 1
+
+    edges = polygon_edges(rows, columns)
+    for side in [
+        (origin[0], origin[0], origin[1], last[1]),
+        (last[0], last[0], origin[1], last[1]),
+        (origin[0], last[0], origin[1], origin[1]),
+        (origin[0], last[0], last[1], last[1]),
+    ]:
+        span_rows, span_starts, span_stops = window_spans(
+            edges, (rows, columns), side, "nonzero"
+        )
+        fill_spans(
+            outside,
+            span_rows - origin[0],
+            span_starts - origin[1],
+            span_stops - origin[1],
+        )
 
 
 def fill_polygon_fast(nparr, rows, columns):
@@ -110,7 +385,9 @@ def fill_polygon_fast(nparr, rows, columns):
 
     """
     try:
-        row_values, column_values = polygon(rows, columns)
+        row_values, column_values = polygon(rows, columns, nparr.shape)
+        if isinstance(nparr, BitMask):
+            return nparr.set_pixels(row_values, column_values)
         nparr[row_values, column_values] = 1
 
         return nparr
@@ -135,23 +412,104 @@ def flood_fill_4(x, y, old, new, arr):
     arr : numpy.ndarray
         Array of points that define the filled polygon.
     """
-    # the flood fill has 4 parts
-    # firstly, make sure the x and y are inbounds
-    if x < 0 or x >= len(arr[0]) or y < 0 or y >= len(arr):
-        return
+    flood_fill(x, y, old, new, arr, connectivity=4)
+
+
+def flood_fill(x, y, old, new, arr, connectivity=4, max_spans=None):
+    """
+    Iterative span flood fill algorithm.
+
+    Instead of recursing once per pixel, whole runs of the old value are
+    filled with slice assignment and the runs they touch on the rows
+    above and below are kept on an explicit stack of spans.
+
+    Parameters
+    ----------
+    x : int
+        X coordinate of the start position.
+    y : int
+        Y coordinate of the start position.
+    old : int
+        Old value.
+    new : int
+        New value.
+    arr : numpy.ndarray
+        Array of points that define the filled polygon.
+    connectivity : int
+        Fill 4-connected or 8-connected pixels.
+    max_spans : int, optional
+        Maximum number of spans waiting on the stack.
+
+    Returns
+    -------
+    arr : numpy.ndarray
+        Array of points that define the filled polygon.
+    """
+    if connectivity not in [4, 8]:
+        raise ValueError("Invalid connectivity. Pick one of: 4, 8")
+
+    height, width = arr.shape
+
+    # make sure the x and y are inbounds and there is something to fill
+    if x < 0 or x >= width or y < 0 or y >= height:
+        return arr
+    if arr[y, x] != old or old == new:
+        return arr
+
+    reach = 1 if connectivity == 8 else 0
+    stack = [(y, x)]
 
-    # secondly, check if the current position equals the old value
-    if arr[y][x] != old:
-        return
+    while stack:
+        row, column = stack.pop()
+        line = arr[row]
 
-    # thirdly, set the current position to the new value
-    arr[y][x] = new
+        if line[column] != old:
+            continue
 
-    # fourthly, attempt to fill the neighboring positions
-    flood_fill_4(x + 1, y, old, new, arr)
-    flood_fill_4(x - 1, y, old, new, arr)
-    flood_fill_4(x, y + 1, old, new, arr)
-    flood_fill_4(x, y - 1, old, new, arr)
+        # extend the run to the left and to the right
+        left = column - run_length(line[column::-1], old)
+        right = column + run_length(line[column:], old)
+        line[left + 1 : right] = new
+
+        # queue one span for every run of old values touching the filled run
+        start = max(0, left + 1 - reach)
+        stop = min(width, right + reach)
+        for next_row in (row - 1, row + 1):
+            if next_row < 0 or next_row >= height:
+                continue
+
+            run = arr[next_row, start:stop] == old
+            run_starts = np.flatnonzero(run[1:] & ~run[:-1]) + 1
+            if run.shape[0] and run[0]:
+                stack.append((next_row, start))
+            stack.extend((next_row, start + i) for i in run_starts.tolist())
+
+        if max_spans is not None and len(stack) > max_spans:
+            raise ValueError("Flood fill exceeded the memory bound.")
+
+    return arr
+
+
+def run_length(values, old):
+    """
+    Length of the leading run of old values.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Values to check.
+    old : int
+        Old value.
+
+    Returns
+    -------
+    int
+        Number of leading values equal to the old value.
+    """
+    different = values != old
+    if different.any():
+        return int(different.argmax())
+    return values.shape[0]
 
 
 def bresenham(x0, y0, x1, y1):
@@ -211,10 +569,143 @@ def bresenham(x0, y0, x1, y1):
         D += 2 * dy
 
 
-def point_in_polygons(column_points, row_points, column_i, row_i):
+def bresenham_polygon(rows, columns, rings=None):
+    """
+    Bresenham's line algorithm for all edges of a polygon at once.
+
+    Produces the same pixels, in the same order, as running ``bresenham``
+    on every edge of the closed polygon, but computes them as NumPy index
+    arrays in a single pass.
+
+    Parameters
+    ----------
+    rows : list
+        Row coordinates of vertices of polygon.
+    columns : list
+        Column coordinates of vertices of polygon.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+
+    Returns
+    -------
+    row_values : numpy.ndarray
+        Row coordinates of the outline pixels.
+    column_values : numpy.ndarray
+        Column coordinates of the outline pixels.
+    """
+    x0 = np.asarray(rows).astype(np.int64)
+    y0 = np.asarray(columns).astype(np.int64)
+
+    # every ring closes on its first vertex
+    following = ring_neighbours(rings, x0.shape[0], 1)
+    x1 = x0[following]
+    y1 = y0[following]
+
+    # calculate delta x and delta y
+    dx = x1 - x0
+    dy = y1 - y0
+
+    xsign = np.where(dx > 0, 1, -1)
+    ysign = np.where(dy > 0, 1, -1)
+
+    # the major axis is the one with the largest delta
+    dx = np.abs(dx)
+    dy = np.abs(dy)
+    x_major = dx > dy
+    major = np.where(x_major, dx, dy)
+    minor = np.where(x_major, dy, dx)
+
+    # one entry per pixel of every edge
+    counts = major + 1
+    edges = np.repeat(np.arange(counts.shape[0]), counts)
+    steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    # closed form of the decision variable: the minor axis moves one step
+    # every time 2 * step * minor + major reaches a multiple of 2 * major
+    major_e = major[edges]
+    minor_steps = (2 * steps * minor[edges] + major_e) // np.maximum(2 * major_e, 1)
+
+    x_major_e = x_major[edges]
+    row_values = x0[edges] + xsign[edges] * np.where(x_major_e, steps, minor_steps)
+    column_values = y0[edges] + ysign[edges] * np.where(
+        x_major_e, minor_steps, steps
+    )
+
+    return row_values, column_values
+
+
+def fill_polyline_outline(rows, columns, nparr, rings=None):
+    """
+    Draw the outline of a polygon.
+
+    Parameters
+    ----------
+    rows : list
+        Row coordinates of vertices of polygon.
+    columns : list
+        Column coordinates of vertices of polygon.
+    nparr : ndarray
+        Array of points that define the polygon outline.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+
+    Returns
+    -------
+    nparr : numpy.ndarray
+        Array of points that define the polygon outline.
+    """
+    row_values, column_values = outline_pixels(rows, columns, nparr.shape, rings)
+    if isinstance(nparr, BitMask):
+        return nparr.set_pixels(row_values, column_values)
+    nparr[row_values, column_values] = 1
+
+    return nparr
+
+
+def outline_pixels(rows, columns, shape, rings=None):
+    """
+    Compute the outline pixels of a polygon that fall on an array.
+
+    Parameters
+    ----------
+    rows : list
+        Row coordinates of vertices of polygon.
+    columns : list
+        Column coordinates of vertices of polygon.
+    shape : tuple
+        Shape of the array.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+
+    Returns
+    -------
+    row_values : numpy.ndarray
+        Row coordinates of the outline pixels.
+    column_values : numpy.ndarray
+        Column coordinates of the outline pixels.
+    """
+    row_values, column_values = bresenham_polygon(rows, columns, rings)
+
+    # keep the points that fall on the array
+    inside = (
+        (row_values >= 0)
+        & (row_values < shape[0])
+        & (column_values >= 0)
+        & (column_values < shape[1])
+    )
+
+    return row_values[inside], column_values[inside]
+
+
+def point_in_polygons(
+    column_points, row_points, column_i, row_i, rings=None, fill_rule="evenodd"
+):
     """
     Test relative point position to a polygon.
 
+    The crossings of every ring are counted together, with their
+    direction for the nonzero rule.
+
     Parameters
     ----------
     column_points : nparray
@@ -225,6 +716,10 @@ def point_in_polygons(column_points, row_points, column_i, row_i):
         X coordinate of the point.
     row_i : int
         Y coordinate of the point.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+    fill_rule : str
+        Inside of the rings: evenodd or nonzero.
 
     Returns
     -------
@@ -244,52 +739,107 @@ def point_in_polygons(column_points, row_points, column_i, row_i):
     l_cross = 0
     r_cross = 0
 
+    # crossings counted upwards minus downwards, for the nonzero rule
+    l_wind = 0
+    r_wind = 0
+
     # Tolerance for vertices labelling
     eps = 1e-12
 
-    # Initialization the loop
-    x1 = column_points[nr_vertices - 1] - column_i
-    y1 = row_points[nr_vertices - 1] - row_i
-
-    # For each edge e = (i-1, i), see if it crosses ray
-    for vertice in range(nr_vertices):
-        x0 = column_points[vertice] - column_i
-        y0 = row_points[vertice] - row_i
-
-        if (-eps < x0 < eps) and (-eps < y0 < eps):
-            # it is a vertex with an eps tolerance
-            return 2
-
-        # if e straddles the x-axis
-        if (y0 > 0) != (y1 > 0):
-            # check if it crosses the ray
-            if ((x0 * y1 - x1 * y0) / (y1 - y0)) > 0:
-                r_cross += 1
-        # if reversed e straddles the x-axis
-        if (y0 < 0) != (y1 < 0):
-            # check if it crosses the ray
-            if ((x0 * y1 - x1 * y0) / (y1 - y0)) < 0:
-                l_cross += 1
-
-        x1 = x0
-        y1 = y0
-
-    if (r_cross & 1) != (l_cross & 1):
-        # on edge if left and right crossings not of same parity
+    first = 0
+    for ring_size in [nr_vertices] if rings is None else rings:
+        # Initialization the loop, every ring closes on its first vertex
+        x1 = column_points[first + ring_size - 1] - column_i
+        y1 = row_points[first + ring_size - 1] - row_i
+
+        # For each edge e = (i-1, i), see if it crosses ray
+        for vertice in range(first, first + ring_size):
+            x0 = column_points[vertice] - column_i
+            y0 = row_points[vertice] - row_i
+
+            if (-eps < x0 < eps) and (-eps < y0 < eps):
+                # it is a vertex with an eps tolerance
+                return 2
+
+            # if e straddles the x-axis
+            if (y0 > 0) != (y1 > 0):
+                # check if it crosses the ray
+                if ((x0 * y1 - x1 * y0) / (y1 - y0)) > 0:
+                    r_cross += 1
+                    r_wind += 1 if y0 > 0 else -1
+            # if reversed e straddles the x-axis
+            if (y0 < 0) != (y1 < 0):
+                # check if it crosses the ray
+                if ((x0 * y1 - x1 * y0) / (y1 - y0)) < 0:
+                    l_cross += 1
+                    l_wind += 1 if y1 < 0 else -1
+
+            x1 = x0
+            y1 = y0
+
+        first += ring_size
+
+    if fill_rule == "nonzero":
+        r_inside = r_wind != 0
+        l_inside = l_wind != 0
+    else:
+        r_inside = bool(r_cross & 1)
+        l_inside = bool(l_cross & 1)
+
+    if r_inside != l_inside:
+        # on edge if left and right rays disagree
         return 3
 
-    if r_cross & 1:
-        # inside if odd number of crossings
+    if r_inside:
+        # inside if odd number of crossings, or a nonzero winding
         return 1
 
     # outside if even number of crossings
     return 0
 
 
-def fill_polyline_rourke(row, column, nparr):
+def fill_polyline_rourke(row, column, nparr, rings=None, fill_rule="evenodd"):
     """
     Generate coordinates of pixels within polygon.
 
+    Scanline implementation of the inside-outside algorithm, the edge
+    crossings of all rows are computed at once and whole spans are filled.
+
+    Parameters
+    ----------
+    row : ndarray
+        Row coordinates of vertices of polygon.
+    column : ndarray
+        Column coordinates of vertices of polygon.
+    nparr : ndarray
+        Array of points that define the filled polygon.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+    fill_rule : str
+        Inside of the rings: evenodd or nonzero.
+    Returns
+    -------
+    nparr : numpy.ndarray
+        Array of points that define the filled polygon.
+    """
+    span_rows, span_starts, span_stops = polygon_spans(
+        row, column, nparr.shape, rings, fill_rule
+    )
+    if isinstance(nparr, BitMask):
+        return nparr.fill_spans(span_rows, span_starts, span_stops)
+
+    return fill_spans(nparr, span_rows, span_starts, span_stops)
+
+
+def fill_polyline_rourke_reference(
+    row, column, nparr, rings=None, fill_rule="evenodd"
+):
+    """
+    Generate coordinates of pixels within polygon, pixel by pixel.
+
+    Reference implementation of ``fill_polyline_rourke`` testing
+    every pixel of the bounding box with ``point_in_polygons``.
+
     Parameters
     ----------
     row : ndarray
@@ -298,6 +848,10 @@ def fill_polyline_rourke(row, column, nparr):
         Column coordinates of vertices of polygon.
     nparr : ndarray
         Array of points that define the filled polygon.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+    fill_rule : str
+        Inside of the rings: evenodd or nonzero.
     Returns
     -------
     nparr : numpy.ndarray
@@ -309,9 +863,9 @@ def fill_polyline_rourke(row, column, nparr):
 
     # check minimum and maximum row and column values
     min_row = int(max(0, rows.min()))
-    max_row = int(math.ceil(rows.max()))
+    max_row = int(min(nparr.shape[0] - 1, math.ceil(rows.max())))
     min_column = int(max(0, columns.min()))
-    max_column = int(math.ceil(columns.max()))
+    max_column = int(min(nparr.shape[1] - 1, math.ceil(columns.max())))
 
     # make contiguous arrays of row and column coordinates
     # faster access in memory if they are next to each other
@@ -325,7 +879,9 @@ def fill_polyline_rourke(row, column, nparr):
     # verify points in polygon
     for row_i in range(min_row, max_row + 1):
         for column_i in range(min_column, max_column + 1):
-            if point_in_polygons(column_points, row_points, column_i, row_i):
+            if point_in_polygons(
+                column_points, row_points, column_i, row_i, rings, fill_rule
+            ):
                 row_coord_output.append(row_i)
                 column_coord_output.append(column_i)
     nparr[row_coord_output, column_coord_output] = 1
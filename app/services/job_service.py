@@ -0,0 +1,270 @@
+"""
+Asynchronous fill job service.
+"""
+import json
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from app.config import (JOB_MAX_PENDING, JOB_RESUME_SECONDS, JOB_WORKERS,
+                        SessionLocal)
+from app.models import Job
+from app.serializers import PolySerializer
+from app.services.cache_service import settle_artifact
+from app.services.poly_service import process_poly
+from app.services.preview_service import render_poly_preview
+from app.services.vertex_service import vertices_json
+
+# Process pool running the fill jobs, created on first use
+executor = None
+executor_lock = threading.Lock()
+
+# Number of jobs submitted to the pool and not finished yet
+pending_jobs = 0
+
+
+def get_executor():
+    """
+    Get the process pool running the fill jobs.
+
+    Returns
+    -------
+    ProcessPoolExecutor
+        The bounded process pool.
+    """
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            # spawn workers so they open their own database connections
+            executor = ProcessPoolExecutor(
+                max_workers=JOB_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return executor
+
+
+def submit_job(db, poly, points=None, rings=None):
+    """
+    Queue a fill job for a poly item.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    poly : PolySerializer
+        Poly item to fill.
+    points : numpy.ndarray, optional
+        The vertices, when they were not sent as npinput.
+    rings : list, optional
+        Number of vertices of every ring of the vertices.
+
+    Returns
+    -------
+    Job
+        The queued job.
+    """
+    global pending_jobs
+
+    with executor_lock:
+        if pending_jobs >= JOB_MAX_PENDING:
+            raise OverflowError("Too many pending jobs. Please try again later.")
+        pending_jobs += 1
+
+    try:
+        payload = poly.dict()
+        payload.pop("asynchronous", None)
+        if payload["npinput"] is None and points is not None:
+            payload["npinput"] = vertices_json(points, rings=rings)
+
+        job = Job(
+            id=str(uuid.uuid4()),
+            name=poly.name,
+            status="queued",
+            payload=json.dumps(payload),
+            created_at=datetime.now(),
+        )
+        db.add(job)
+        db.commit()
+    except:
+        release_job()
+        raise
+
+    dispatch_job(job.id, job.payload)
+
+    return job
+
+
+def dispatch_job(job_id, payload):
+    """
+    Hand a queued job over to the process pool.
+
+    Parameters
+    ----------
+    job_id : str
+        The id of the job.
+    payload : str
+        The poly item to fill, as JSON.
+    """
+    future = get_executor().submit(run_job, job_id, payload)
+    future.add_done_callback(lambda done: finish_job(job_id, done))
+
+
+def query_job(db, job_id):
+    """
+    Query a fill job by id.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    job_id : str
+        The id of the job.
+
+    Returns
+    -------
+    Job or None
+        The job, None when it does not exist.
+    """
+    return db.query(Job).filter(Job.id == job_id).first()
+
+
+def run_job(job_id, payload):
+    """
+    Run a fill job inside a worker process.
+
+    The job is claimed by moving it from queued to running in a single
+    update, a job dispatched twice only runs once.
+
+    Parameters
+    ----------
+    job_id : str
+        The id of the job.
+    payload : str
+        The poly item to fill, as JSON.
+    """
+    with SessionLocal() as db:
+        claimed = (
+            db.query(Job)
+            .filter(Job.id == job_id, Job.status == "queued")
+            .update(
+                {"status": "running", "started_at": datetime.now()},
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        if not claimed:
+            return
+        job = db.query(Job).filter(Job.id == job_id).first()
+
+        claimed = None
+        try:
+            new_poly = process_poly(PolySerializer(**json.loads(payload)), db)
+            claimed = new_poly.content_hash
+            db.add(new_poly)
+            db.flush()
+            preview = (new_poly.content_hash, new_poly.arrayfile, new_poly.imagefile)
+
+            job.poly_id = new_poly.id
+            job.status = "done"
+        except Exception as error:
+            db.rollback()
+            job.status = "failed"
+            job.error = str(error)
+
+        job.finished_at = datetime.now()
+        try:
+            db.commit()
+        finally:
+            if claimed is not None:
+                settle_artifact(claimed)
+
+        if job.status == "done":
+            try:
+                render_poly_preview(*preview)
+            except Exception:
+                # the fill is stored, only its preview is missing
+                pass
+
+
+def finish_job(job_id, future):
+    """
+    Release a finished job and record crashes of its worker.
+
+    Parameters
+    ----------
+    job_id : str
+        The id of the job.
+    future : Future
+        The future of the job.
+    """
+    release_job()
+
+    error = future.exception()
+    if error is None:
+        return
+
+    with SessionLocal() as db:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if job is not None:
+            job.status = "failed"
+            job.error = str(error) or error.__class__.__name__
+            job.finished_at = datetime.now()
+            db.commit()
+
+
+def release_job():
+    """
+    Free the slot of a pending job.
+    """
+    global pending_jobs
+
+    with executor_lock:
+        pending_jobs -= 1
+
+
+def resume_jobs():
+    """
+    Requeue the jobs interrupted by a restart.
+
+    Every worker process of the app resumes the jobs when it starts, so
+    every job is claimed with a conditional update before it is
+    dispatched: only one of the processes starting within
+    JOB_RESUME_SECONDS requeues it. The jobs queued after the process
+    started belong to the process that queued them.
+    """
+    global pending_jobs
+
+    started = datetime.now()
+    resumable = (
+        Job.status.in_(["queued", "running"]),
+        Job.created_at < started,
+        or_(
+            Job.resumed_at.is_(None),
+            Job.resumed_at < started - timedelta(seconds=JOB_RESUME_SECONDS),
+        ),
+    )
+
+    with SessionLocal() as db:
+        jobs = db.query(Job.id, Job.payload).filter(*resumable).all()
+
+        for job_id, payload in jobs:
+            claimed = (
+                db.query(Job)
+                .filter(Job.id == job_id, *resumable)
+                .update(
+                    {"status": "queued", "started_at": None, "resumed_at": started},
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            if not claimed:
+                continue
+
+            with executor_lock:
+                pending_jobs += 1
+            dispatch_job(job_id, payload)
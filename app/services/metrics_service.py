@@ -0,0 +1,199 @@
+"""
+Stage timing and metrics service.
+"""
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from app.config import METRICS_TRACEMALLOC
+
+# Upper bounds of the histogram buckets, in seconds and in bytes
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = tuple(1 << shift for shift in range(16, 34, 2))
+
+
+class Histogram:
+    """
+    Cumulative histogram of observations, by label, in Prometheus style.
+    """
+
+    def __init__(self, name, description, buckets):
+        """
+        Create an empty histogram.
+
+        Parameters
+        ----------
+        name : str
+            Name of the metric.
+        description : str
+            Help text of the metric.
+        buckets : tuple
+            Upper bounds of the buckets, increasing.
+        """
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label, value):
+        """
+        Record an observation.
+
+        Parameters
+        ----------
+        label : str
+            Stage the observation belongs to.
+        value : float
+            The observed value.
+        """
+        with self.lock:
+            counts, total, count = self.series.get(
+                label, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.series[label] = (counts, total + value, count + 1)
+
+    def render(self):
+        """
+        Render the histogram in the Prometheus text format.
+
+        Returns
+        -------
+        list
+            Lines of the histogram.
+        """
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+
+        with self.lock:
+            for label in sorted(self.series):
+                counts, total, count = self.series[label]
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(
+                        f'{self.name}_bucket{{stage="{label}",le="{bound}"}} {bucket}'
+                    )
+                lines.append(f'{self.name}_bucket{{stage="{label}",le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{stage="{label}"}} {total}')
+                lines.append(f'{self.name}_count{{stage="{label}"}} {count}')
+
+        return lines
+
+
+# Histograms of the stages of this process
+stage_seconds = Histogram(
+    "polyfill_stage_seconds", "Time spent in every stage of a fill.", SECONDS_BUCKETS
+)
+stage_peak_bytes = Histogram(
+    "polyfill_stage_peak_bytes",
+    "Peak traced memory of every stage of a fill.",
+    BYTES_BUCKETS,
+)
+
+
+class StageTimer:
+    """
+    Timings of the stages of a single request.
+    """
+
+    def __init__(self):
+        """
+        Create a timer without stages.
+        """
+        self.stages = {}
+        self.peaks = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage and record it in the histograms.
+
+        The peak memory is only traced when METRICS_TRACEMALLOC is set,
+        it covers every thread of the process.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        """
+        tracing = METRICS_TRACEMALLOC and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            self.stages[name] = self.stages.get(name, 0) + elapsed
+            stage_seconds.observe(name, elapsed / 1e9)
+
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                self.peaks[name] = max(self.peaks.get(name, 0), peak)
+                stage_peak_bytes.observe(name, peak)
+
+    def breakdown(self):
+        """
+        Milliseconds spent in every stage.
+
+        Returns
+        -------
+        dict
+            The stages and their times.
+        """
+        return {name: round(elapsed / 1e6, 3) for name, elapsed in self.stages.items()}
+
+    def dumps(self):
+        """
+        Encode the stage breakdown as JSON.
+
+        Returns
+        -------
+        str
+            Milliseconds spent in every stage.
+        """
+        return json.dumps(self.breakdown(), separators=(",", ":"))
+
+    def server_timing(self):
+        """
+        Build the Server-Timing header of the stages.
+
+        Returns
+        -------
+        str
+            Value of the header.
+        """
+        return ", ".join(
+            f"{name};dur={duration}" for name, duration in self.breakdown().items()
+        )
+
+
+def start_tracing():
+    """
+    Start tracing memory allocations when METRICS_TRACEMALLOC is set.
+    """
+    if METRICS_TRACEMALLOC and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def render_metrics():
+    """
+    Render all metrics of this process in the Prometheus text format.
+
+    Returns
+    -------
+    str
+        The metrics.
+    """
+    lines = stage_seconds.render()
+    if METRICS_TRACEMALLOC:
+        lines += stage_peak_bytes.render()
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,667 @@
+"""
+Poly processing service.
+"""
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+from app.config import (CANVAS_MAX_HEIGHT, CANVAS_MAX_WIDTH, FILL_BAND_HEIGHT,
+                        FILL_MEMMAP, FILL_PACKED, FILL_WORKERS,
+                        FLOOD_MAX_SPANS, POLYS_MAX_LIMIT, POLYS_PAGE_LIMIT)
+from app.models import Poly
+from app.services.cache_service import (claim_artifact, fill_key, key_lock,
+                                        mask_cache, record_artifact)
+from app.services.combine_service import open_mask
+from app.services.file_management import (FILE_FORMATS, nparray_path,
+                                          save_nparray_to_file)
+from app.services.filling_service import (CANVAS_SHAPE, RING_ALGORITHMS,
+                                          expand_to_canvas, fill_polyline)
+from app.services.metrics_service import StageTimer
+from app.services.preview_service import preview_path
+from app.services.scanline_service import FILL_RULES
+from app.services.stats_service import (mask_stats, polygon_area,
+                                        stats_fields)
+from app.services.vertex_service import (pack_vertices, parse_rings,
+                                         unpack_vertices, vertices_bbox,
+                                         vertices_json)
+
+# Orders of the poly items of a listing
+SORT_ORDERS = ["id", "area", "-area"]
+
+# Fields of the poly items a listing can return
+POLY_FIELDS = [
+    "id",
+    "name",
+    "npinput",
+    "imagefile",
+    "arrayfile",
+    "exectime",
+    "exectime_stages",
+    "algorithm",
+    "fill_rule",
+    "xsize",
+    "ysize",
+    "xoffset",
+    "yoffset",
+    "xcanvas",
+    "ycanvas",
+    "content_hash",
+    "area",
+    "pixels",
+]
+
+
+def validate_poly(poly, rings=None):
+    """
+    Validate the fill parameters of a poly item.
+
+    Parameters
+    ----------
+    poly : PolySerializer
+        Poly item to validate.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+    """
+    if poly.algorithm not in ["rourke", "flood", "fast", "outline"]:
+        raise ValueError("Invalid algorithm. Pick one of: rourke, flood, fast, outline")
+
+    if poly.array_format not in FILE_FORMATS:
+        raise ValueError("Invalid array format. Pick one of: npy, packbits, rle, tiles")
+
+    if poly.connectivity not in [4, 8]:
+        raise ValueError("Invalid connectivity. Pick one of: 4, 8")
+
+    if poly.fill_rule not in FILL_RULES:
+        raise ValueError("Invalid fill rule. Pick one of: evenodd, nonzero")
+
+    if poly.algorithm not in RING_ALGORITHMS and (
+        rings is not None or poly.fill_rule != "evenodd"
+    ):
+        raise ValueError(
+            "Only the rourke and outline algorithms fill rings with a fill rule."
+        )
+
+    check_canvas(poly_canvas(poly))
+
+
+def check_canvas(canvas):
+    """
+    Check the shape of a canvas is within the limits.
+
+    Parameters
+    ----------
+    canvas : tuple
+        Rows and columns of the canvas.
+    """
+    height, width = canvas
+    if not 1 <= height <= CANVAS_MAX_HEIGHT:
+        raise ValueError(f"Canvas height must be between 1 and {CANVAS_MAX_HEIGHT}")
+    if not 1 <= width <= CANVAS_MAX_WIDTH:
+        raise ValueError(f"Canvas width must be between 1 and {CANVAS_MAX_WIDTH}")
+
+
+def poly_canvas(poly):
+    """
+    Get the canvas of a poly item.
+
+    Parameters
+    ----------
+    poly : PolySerializer
+        The poly item.
+
+    Returns
+    -------
+    tuple
+        Rows and columns of the canvas, the default canvas when the
+        request does not set them.
+    """
+    height = poly.canvas_height if poly.canvas_height is not None else CANVAS_SHAPE[0]
+    width = poly.canvas_width if poly.canvas_width is not None else CANVAS_SHAPE[1]
+
+    return height, width
+
+
+def poly_columns(fields=None):
+    """
+    Get the columns of a projection of the poly items.
+
+    Parameters
+    ----------
+    fields : str, optional
+        Comma separated names of the fields, all fields but the vertices
+        by default. The id is always returned.
+
+    Returns
+    -------
+    list
+        The names of the columns.
+    """
+    if not fields:
+        return [name for name in POLY_FIELDS if name != "npinput"]
+
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    for name in names:
+        if name not in POLY_FIELDS:
+            raise ValueError(f"Invalid field. Pick from: {', '.join(POLY_FIELDS)}")
+
+    return ["id"] + [name for name in dict.fromkeys(names) if name != "id"]
+
+
+def query_polys(
+    db,
+    names,
+    after_id=None,
+    limit=POLYS_PAGE_LIMIT,
+    algorithm=None,
+    min_exectime=None,
+    max_exectime=None,
+    min_area=None,
+    max_area=None,
+    sort="id",
+):
+    """
+    Query a page of poly items after an id, in id or area order.
+
+    Only the requested columns are loaded, as plain rows. Pages sorted
+    by area continue after the area and id of the last poly item of the
+    previous page, poly items without an area are left out.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    names : list
+        The names of the columns to load.
+    after_id : int, optional
+        The id of the last poly item of the previous page.
+    limit : int
+        Maximum number of poly items of the page.
+    algorithm : str, optional
+        Only poly items filled with this algorithm.
+    min_exectime : float, optional
+        Only poly items that took at least this many seconds.
+    max_exectime : float, optional
+        Only poly items that took at most this many seconds.
+    min_area : float, optional
+        Only poly items with at least this area.
+    max_area : float, optional
+        Only poly items with at most this area.
+    sort : str
+        Order of the poly items: id, area or -area for decreasing areas.
+
+    Returns
+    -------
+    list
+        The rows of the page.
+    """
+    if limit < 1 or limit > POLYS_MAX_LIMIT:
+        raise ValueError(f"Limit must be between 1 and {POLYS_MAX_LIMIT}")
+    if sort not in SORT_ORDERS:
+        raise ValueError(f"Invalid sort. Pick one of: {', '.join(SORT_ORDERS)}")
+
+    columns = [getattr(Poly, name) for name in names]
+
+    # the vertices of new poly items are stored packed
+    vertices = "npinput" in names
+    if vertices:
+        columns += [Poly.vertices, Poly.vertex_dtype, Poly.rings]
+
+    query = db.query(*columns)
+
+    if algorithm is not None:
+        query = query.filter(Poly.algorithm == algorithm)
+    if min_exectime is not None:
+        query = query.filter(Poly.exectime >= min_exectime)
+    if max_exectime is not None:
+        query = query.filter(Poly.exectime <= max_exectime)
+    if min_area is not None:
+        query = query.filter(Poly.area >= min_area)
+    if max_area is not None:
+        query = query.filter(Poly.area <= max_area)
+
+    if sort == "id":
+        if after_id is not None:
+            query = query.filter(Poly.id > after_id)
+        query = query.order_by(Poly.id)
+    else:
+        query = area_page(db, query, after_id, sort == "-area")
+
+    rows = [tuple(row) for row in query.limit(limit)]
+    if not vertices:
+        return rows
+
+    index = names.index("npinput")
+    for number, row in enumerate(rows):
+        row, (packed, dtype, rings) = list(row[:-3]), row[-3:]
+        if row[index] is None and packed is not None:
+            row[index] = vertices_json(
+                unpack_vertices(packed, dtype), dtype, json.loads(rings or "null")
+            )
+        rows[number] = tuple(row)
+
+    return rows
+
+
+def area_page(db, query, after_id=None, descending=False):
+    """
+    Sort a query of poly items by area, after the poly item of an id.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    query : Query
+        The query of the poly items.
+    after_id : int, optional
+        The id of the last poly item of the previous page.
+    descending : bool
+        Whether the largest areas come first.
+
+    Returns
+    -------
+    Query
+        The sorted query, ties sorted by id in the same direction.
+    """
+    query = query.filter(Poly.area.isnot(None))
+
+    if after_id is not None:
+        area = db.query(Poly.area).filter(Poly.id == after_id).scalar()
+        if area is None:
+            raise ValueError("The after_id poly item must exist and have an area")
+        if descending:
+            query = query.filter(
+                or_(Poly.area < area, and_(Poly.area == area, Poly.id < after_id))
+            )
+        else:
+            query = query.filter(
+                or_(Poly.area > area, and_(Poly.area == area, Poly.id > after_id))
+            )
+
+    if descending:
+        return query.order_by(Poly.area.desc(), Poly.id.desc())
+
+    return query.order_by(Poly.area, Poly.id)
+
+
+def encode_polys(names, rows):
+    """
+    Encode a page of poly items as a JSON array, one item at a time.
+
+    Parameters
+    ----------
+    names : list
+        The names of the columns.
+    rows : list
+        The rows of the page.
+
+    Yield
+    -------
+    bytes
+        Chunks of the JSON array.
+    """
+    yield b"["
+    for index, row in enumerate(rows):
+        item = json.dumps(dict(zip(names, row)))
+        yield (item if not index else f",{item}").encode("utf-8")
+    yield b"]"
+
+
+def query_poly(db, poly_id):
+    """
+    Query a poly item by id.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    poly_id : int
+        The id of the poly item.
+
+    Returns
+    -------
+    Poly or None
+        The poly item, None when it does not exist.
+    """
+    return db.query(Poly).filter(Poly.id == poly_id).first()
+
+
+def poly_details(poly):
+    """
+    Get the fields of a poly item, with its vertices as JSON.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+
+    Returns
+    -------
+    dict
+        The fields of the poly item.
+    """
+    details = {name: getattr(poly, name) for name in POLY_FIELDS}
+
+    if details["npinput"] is None and poly.vertices is not None:
+        details["npinput"] = vertices_json(
+            poly_vertices(poly), poly.vertex_dtype, poly_rings(poly)
+        )
+
+    return details
+
+
+def poly_vertices(poly):
+    """
+    Get the vertices of a stored poly item.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+
+    Returns
+    -------
+    numpy.ndarray
+        The vertices, as float64 (row, column) pairs.
+    """
+    if poly.vertices is not None:
+        return unpack_vertices(poly.vertices, poly.vertex_dtype)
+
+    return parse_rings(poly.npinput)[0]
+
+
+def poly_rings(poly):
+    """
+    Get the rings of a stored poly item.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+
+    Returns
+    -------
+    list or None
+        Number of vertices of every ring, None for a single ring.
+    """
+    if poly.vertices is not None:
+        return json.loads(poly.rings) if poly.rings else None
+
+    return parse_rings(poly.npinput)[1]
+
+
+def stored_stats(db, poly, extents=False):
+    """
+    Compute the statistics of a stored poly item.
+
+    The pixels are the ones of its stored mask, whatever its algorithm.
+    The area, centroid and bounding box are the ones of its vertices,
+    combined masks having none use the ones of their pixels. The
+    statistics of a poly item stored before they were kept are stored
+    once computed.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    poly : Poly
+        The poly item.
+    extents : bool
+        Whether to return the extent of every filled row.
+
+    Returns
+    -------
+    dict
+        The statistics, as returned by ``polygon_stats``.
+    """
+    offset = (poly.xoffset or 0, poly.yoffset or 0)
+    stats = mask_stats(open_mask(poly), offset, extents)
+
+    if poly.vertices is not None or poly.npinput is not None:
+        points = poly_vertices(poly)
+        area, centroid = polygon_area(
+            points, poly_rings(poly), poly.fill_rule or "evenodd"
+        )
+        stats.update(area=area, centroid=centroid, bbox=list(vertices_bbox(points)))
+
+    if poly.pixels is None:
+        poly.area = stats["area"]
+        poly.pixels = stats["pixels"]
+        db.commit()
+
+    return stats
+
+
+def vertex_fields(points, rings=None):
+    """
+    Get the packed vertices and bounding box columns of a poly item.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The vertices, as (row, column) pairs.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+
+    Returns
+    -------
+    dict
+        The vertex columns of the poly item.
+    """
+    packed, dtype = pack_vertices(points)
+    xmin, ymin, xmax, ymax = vertices_bbox(points)
+
+    return {
+        "vertices": packed,
+        "vertex_dtype": dtype,
+        "rings": json.dumps(rings) if rings is not None else None,
+        "xmin": xmin,
+        "ymin": ymin,
+        "xmax": xmax,
+        "ymax": ymax,
+    }
+
+
+def process_poly(poly, db=None, points=None, timer=None, rings=None):
+    """
+    Fill a poly item and save its artifacts.
+
+    Identical fills share their artifacts: when a poly with the same
+    content hash is stored, its artifacts are linked instead of recomputed.
+    The vertices are stored packed, not as the JSON text, and the time of
+    every stage recorded so far is stored with the execution time.
+    The artifacts are claimed until the caller commits the poly item and
+    calls ``settle_artifact``, so deleting the stored poly meanwhile does
+    not remove them.
+
+    Parameters
+    ----------
+    poly : PolySerializer
+        Poly item to process.
+    db : Session, optional
+        Database session used to look up stored artifacts.
+    points : numpy.ndarray, optional
+        The vertices, parsed from the npinput of the poly item by default.
+    timer : StageTimer, optional
+        Timer of the request, a new one by default.
+    rings : list, optional
+        Number of vertices of every ring of the given vertices, a single
+        ring by default.
+
+    Returns
+    -------
+    Poly
+        The new poly item, not yet added to the database.
+    """
+    start_time = datetime.now()
+    if timer is None:
+        timer = StageTimer()
+    if points is None:
+        with timer.stage("parse"):
+            points, rings = parse_rings(poly.npinput)
+    key = fill_key(points, poly, poly_canvas(poly), rings)
+
+    with key_lock(key):
+        stored = None
+        if db is not None:
+            with timer.stage("lookup"):
+                stored = db.query(Poly).filter(Poly.content_hash == key).first()
+
+        if stored is not None and os.path.isfile(stored.arrayfile):
+            record_artifact(True)
+            stats = {"area": stored.area, "pixels": stored.pixels}
+            if stored.pixels is None:
+                with timer.stage("stats"):
+                    stats = stats_fields(
+                        points, open_mask(stored), rings, poly.fill_rule
+                    )
+            end_time = datetime.now()
+
+            new_poly = Poly(
+                name=poly.name,
+                xsize=stored.xsize,
+                ysize=stored.ysize,
+                xoffset=stored.xoffset,
+                yoffset=stored.yoffset,
+                xcanvas=stored.xcanvas,
+                ycanvas=stored.ycanvas,
+                imagefile=stored_preview(stored, poly, key),
+                arrayfile=stored.arrayfile,
+                exectime=(end_time - start_time).total_seconds(),
+                exectime_stages=timer.dumps(),
+                algorithm=poly.algorithm,
+                fill_rule=poly.fill_rule,
+                content_hash=key,
+                **vertex_fields(points, rings),
+                **stats,
+            )
+        else:
+            record_artifact(False)
+            new_poly = fill_poly(poly, points, key, timer, rings)
+
+        # the artifacts are kept until the poly item is committed
+        claim_artifact(key)
+
+    return new_poly
+
+
+def fill_poly(poly, points, key, timer=None, rings=None):
+    """
+    Fill a poly item and save its artifacts under its content hash.
+
+    The preview image is not rendered here, see ``render_poly_preview``.
+    With FILL_MEMMAP npy results are filled straight into their file, so
+    the mask is never held in memory and needs no separate save. With
+    FILL_PACKED the mask is held with 1 bit per pixel until it is saved.
+
+    Parameters
+    ----------
+    poly : PolySerializer
+        Poly item to process.
+    points : numpy.ndarray
+        The vertices, as (row, column) pairs.
+    key : str
+        Content hash of the fill.
+    timer : StageTimer, optional
+        Timer of the request, a new one by default.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+
+    Returns
+    -------
+    Poly
+        The new poly item, not yet added to the database.
+    """
+    if timer is None:
+        timer = StageTimer()
+    memmap = FILL_MEMMAP and poly.array_format == "npy"
+    out_path = nparray_path(key, "npy") if memmap else None
+
+    try:
+        with timer.stage("rasterize"):
+            results = fill_polyline(
+                points,
+                poly.algorithm,
+                poly.flood_x,
+                poly.flood_y,
+                crop=not poly.full_canvas,
+                connectivity=poly.connectivity,
+                max_spans=FLOOD_MAX_SPANS,
+                workers=FILL_WORKERS,
+                band_height=FILL_BAND_HEIGHT,
+                out_path=out_path,
+                canvas=poly_canvas(poly),
+                packed=FILL_PACKED,
+                rings=rings,
+                fill_rule=poly.fill_rule,
+            )
+    except:
+        # never leave a partially filled file behind
+        if out_path is not None and os.path.isfile(out_path):
+            os.remove(out_path)
+        raise
+
+    if memmap:
+        mask = results.mask
+        offset = results.offset
+        save_file = out_path
+    else:
+        # only build the full canvas when explicitly asked for
+        mask = expand_to_canvas(results) if poly.full_canvas else results.mask
+        offset = (0, 0) if poly.full_canvas else results.offset
+        with timer.stage("save"):
+            save_file = save_nparray_to_file(
+                mask, key, poly.array_format, offset, poly.algorithm
+            )
+
+    if not memmap:
+        mask_cache.put(key, mask)
+
+    with timer.stage("stats"):
+        stats = stats_fields(points, mask, rings, poly.fill_rule)
+
+    return Poly(
+        name=poly.name,
+        xsize=mask.shape[0],
+        ysize=mask.shape[1],
+        xoffset=offset[0],
+        yoffset=offset[1],
+        xcanvas=results.canvas[0],
+        ycanvas=results.canvas[1],
+        imagefile=str(preview_path(key)) if poly.preview else None,
+        arrayfile=str(save_file),
+        exectime=results[1],
+        exectime_stages=timer.dumps(),
+        algorithm=poly.algorithm,
+        fill_rule=poly.fill_rule,
+        content_hash=key,
+        **vertex_fields(points, rings),
+        **stats,
+    )
+
+
+def stored_preview(stored, poly, key):
+    """
+    Get the preview image of a poly item linked to stored artifacts.
+
+    Parameters
+    ----------
+    stored : Poly
+        The stored poly item with the same content hash.
+    poly : PolySerializer
+        Poly item to process.
+    key : str
+        Content hash of the fill.
+
+    Returns
+    -------
+    str or None
+        Path of the preview, None when no preview is requested.
+    """
+    if not poly.preview:
+        return None
+    if stored.imagefile is not None:
+        return stored.imagefile
+
+    return str(preview_path(key))
@@ -0,0 +1,212 @@
+"""
+Preview rendering service.
+"""
+import io
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from app.config import PREVIEW_MAX_SIZE, TILE_SIZE
+from app.services.cache_service import mask_cache
+from app.services.file_management import (FILE_FORMATS, load_nparray_from_file,
+                                          load_tile_from_file,
+                                          open_nparray_file)
+from app.services.metrics_service import StageTimer
+from app.services.tile_service import mask_tile, tile_levels
+
+# Number of mask bytes pooled at once
+POOL_BAND_BYTES = 1 << 22
+
+
+def preview_path(filename):
+    """
+    Path of the preview image of a fill.
+
+    Parameters
+    ----------
+    filename : str
+        The filename of the fill artifacts.
+
+    Returns
+    -------
+    Path
+        Path of the PNG file in the data folder.
+    """
+    return Path(__file__).parents[1] / f"data/{filename}-preview.png"
+
+
+def pool_mask(mask, max_size=PREVIEW_MAX_SIZE):
+    """
+    Downsample a mask with block max-pooling.
+
+    Every pixel of the thumbnail is filled when any pixel of its square
+    block of the mask is filled, so thin outlines never vanish. The mask
+    is pooled one band of rows at a time, so memory-mapped masks are
+    streamed instead of loaded at once.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray
+        Array of points that define the filled polygon.
+    max_size : int
+        Maximum number of rows and columns of the thumbnail.
+
+    Returns
+    -------
+    numpy.ndarray
+        The thumbnail, as booleans.
+    """
+    if max_size < 1:
+        raise ValueError("Preview size must be positive.")
+
+    rows, columns = mask.shape
+    if not rows or not columns:
+        return np.zeros((1, 1), dtype=bool)
+
+    block = max(1, math.ceil(max(rows, columns) / max_size))
+    pooled_columns = math.ceil(columns / block)
+    pooled = np.zeros((math.ceil(rows / block), pooled_columns), dtype=bool)
+
+    # whole blocks of rows, about POOL_BAND_BYTES of the mask at a time
+    band_rows = block * max(1, POOL_BAND_BYTES // (block * columns))
+    padded = np.zeros((band_rows, pooled_columns * block), dtype=bool)
+
+    for first in range(0, rows, band_rows):
+        band = mask[first : first + band_rows]
+        band_blocks = math.ceil(band.shape[0] / block)
+        padded[: band_blocks * block] = False
+        padded[: band.shape[0], :columns] = band != 0
+
+        blocks = padded[: band_blocks * block].reshape(
+            band_blocks, block, pooled_columns, block
+        )
+        pooled[first // block : first // block + band_blocks] = blocks.any(axis=(1, 3))
+
+    return pooled
+
+
+def render_preview(mask, loc_path, max_size=PREVIEW_MAX_SIZE):
+    """
+    Render the PNG preview of a mask.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray
+        Array of points that define the filled polygon.
+    loc_path : Path
+        Path of the PNG file.
+    max_size : int
+        Maximum number of rows and columns of the preview.
+
+    Returns
+    -------
+    Path
+        Path of the PNG file.
+    """
+    loc_path = Path(loc_path)
+    image = Image.fromarray(pool_mask(mask, max_size).astype(np.uint8) * 255, "L")
+
+    # never expose a partially written image
+    partial_path = loc_path.with_name(f"{loc_path.name}.partial")
+    image.save(partial_path, format="PNG")
+    os.replace(partial_path, loc_path)
+
+    return loc_path
+
+
+def render_poly_preview(content_hash, arrayfile, imagefile):
+    """
+    Render the missing preview of a stored fill.
+
+    Meant to run after the response is sent, the mask is taken from the
+    result cache when it is hot and loaded from its file otherwise.
+
+    Parameters
+    ----------
+    content_hash : str
+        Content hash of the fill.
+    arrayfile : str
+        Path of the stored mask.
+    imagefile : str
+        Path of the preview to render.
+    """
+    if imagefile is None or os.path.isfile(imagefile):
+        return
+
+    mask = mask_cache.get(content_hash) if content_hash is not None else None
+    if mask is None and not os.path.isfile(arrayfile):
+        return
+
+    with StageTimer().stage("preview"):
+        if mask is None:
+            mask, _ = load_nparray_from_file(arrayfile)
+
+        render_preview(mask, imagefile)
+
+
+def poly_tile(poly, level, tx, ty):
+    """
+    Get a tile of the pyramid of the mask of a stored poly.
+
+    Tiled masks only decode the requested tile, the masks of the other
+    formats are pooled on the fly: only the window of the tile is read
+    from a mapped file and unpacked from a packed mask.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+    level : int
+        Level of the tile, 0 is the full resolution.
+    tx : int
+        Column of the tile.
+    ty : int
+        Row of the tile.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        The pixels of the tile, None when the tile is empty.
+    """
+    if level < 0 or tx < 0 or ty < 0:
+        raise ValueError("Level and tile coordinates must not be negative")
+
+    if Path(poly.arrayfile).suffix == FILE_FORMATS["tiles"]:
+        return load_tile_from_file(poly.arrayfile, level, tx, ty)
+
+    mask = mask_cache.get(poly.content_hash) if poly.content_hash is not None else None
+    if mask is None:
+        mask = open_nparray_file(poly.arrayfile)
+    offset = (poly.xoffset or 0, poly.yoffset or 0)
+    levels = tile_levels(
+        (offset[0] + mask.shape[0], offset[1] + mask.shape[1]), TILE_SIZE
+    )
+    if level >= levels:
+        raise ValueError(f"Level must be between 0 and {levels - 1}")
+
+    tile = mask_tile(mask, offset, level, tx, ty, TILE_SIZE)
+
+    return tile if tile.any() else None
+
+
+def encode_tile_png(tile):
+    """
+    Encode a tile as a black and white PNG image.
+
+    Parameters
+    ----------
+    tile : numpy.ndarray
+        The pixels of the tile.
+
+    Returns
+    -------
+    bytes
+        The PNG image.
+    """
+    encoded = io.BytesIO()
+    Image.fromarray(tile != 0).save(encoded, format="PNG")
+
+    return encoded.getvalue()
@@ -0,0 +1,376 @@
+"""
+Scanline polygon filling service.
+"""
+import math
+
+import numpy as np
+
+# Tolerance for vertices labelling
+EPS = 1e-12
+
+# Rules deciding which pixels are inside the rings
+FILL_RULES = ["evenodd", "nonzero"]
+
+
+def polygon_spans(rows, columns, shape, rings=None, fill_rule="evenodd"):
+    """
+    Compute the filled spans of a polygon row by row.
+
+    The spans follow the same vertex/edge/inside classification as
+    ``point_in_polygons``: a pixel is filled when it is a vertex, lies on
+    an edge or is inside the polygon. Instead of testing every pixel,
+    the edge crossings of every scanline are computed at once and
+    paired into spans. The edges of all rings are crossed in the same
+    pass, so holes and disjoint parts need no mask of their own.
+
+    Parameters
+    ----------
+    rows : ndarray
+        Row coordinates of vertices of polygon.
+    columns : ndarray
+        Column coordinates of vertices of polygon.
+    shape : tuple
+        Shape of the array the spans are clipped to.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+    fill_rule : str
+        Inside of the rings: evenodd or nonzero.
+
+    Returns
+    -------
+    span_rows : numpy.ndarray
+        Row of every span.
+    span_starts : numpy.ndarray
+        First column of every span.
+    span_stops : numpy.ndarray
+        Column after the last column of every span.
+    """
+    row_points = np.ascontiguousarray(np.atleast_1d(rows), "float64")
+    column_points = np.ascontiguousarray(np.atleast_1d(columns), "float64")
+    window = spans_window(row_points, column_points, shape)
+
+    if window is None:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+
+    return window_spans(
+        polygon_edges(row_points, column_points, rings),
+        (row_points, column_points),
+        window,
+        fill_rule,
+    )
+
+
+def spans_window(row_points, column_points, shape):
+    """
+    Compute the rows and columns a polygon can fill.
+
+    Parameters
+    ----------
+    row_points : numpy.ndarray
+        Row coordinates of vertices of polygon.
+    column_points : numpy.ndarray
+        Column coordinates of vertices of polygon.
+    shape : tuple
+        Shape of the array the spans are clipped to.
+
+    Returns
+    -------
+    tuple or None
+        First row, last row, first column and last column,
+        None when the polygon is outside the array.
+    """
+    # check minimum and maximum row and column values
+    min_row = int(max(0, row_points.min()))
+    max_row = int(min(shape[0] - 1, math.ceil(row_points.max())))
+    min_column = int(max(0, column_points.min()))
+    max_column = int(min(shape[1] - 1, math.ceil(column_points.max())))
+
+    if min_row > max_row or min_column > max_column:
+        return None
+
+    return min_row, max_row, min_column, max_column
+
+
+def ring_neighbours(rings, count, step):
+    """
+    Index of a neighbour of every vertex within its ring.
+
+    Parameters
+    ----------
+    rings : list or None
+        Number of vertices of every ring, a single ring when None.
+    count : int
+        Number of vertices.
+    step : int
+        Position of the neighbour: -1 for the previous vertex and 1 for
+        the next one.
+
+    Returns
+    -------
+    numpy.ndarray
+        Index of the neighbour of every vertex.
+    """
+    sizes = np.array([count] if rings is None else rings, dtype=np.int64)
+    starts = np.repeat(np.cumsum(sizes) - sizes, sizes)
+    lengths = np.repeat(sizes, sizes)
+
+    return starts + (np.arange(count) - starts + step) % lengths
+
+
+def polygon_edges(row_points, column_points, rings=None):
+    """
+    Build the edges e = (i-1, i) of a polygon, every ring closing on itself.
+
+    Parameters
+    ----------
+    row_points : numpy.ndarray
+        Row coordinates of vertices of polygon.
+    column_points : numpy.ndarray
+        Column coordinates of vertices of polygon.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+
+    Returns
+    -------
+    tuple
+        Start rows, start columns, end rows and end columns of the edges.
+    """
+    previous = ring_neighbours(rings, row_points.shape[0], -1)
+
+    return (
+        row_points[previous],
+        column_points[previous],
+        row_points,
+        column_points,
+    )
+
+
+def window_spans(edges, vertices, window, fill_rule="evenodd"):
+    """
+    Compute the filled spans of a set of edges within a window.
+
+    Every scanline of the window must be crossed by all of its edges,
+    which holds for all edges of a polygon and for the edges of a
+    polygon overlapping a band of rows.
+
+    Parameters
+    ----------
+    edges : tuple
+        Start rows, start columns, end rows and end columns of the edges.
+    vertices : tuple
+        Row and column coordinates of the vertices in the window.
+    window : tuple
+        First row, last row, first column and last column to fill.
+    fill_rule : str
+        Inside of the rings: evenodd or nonzero.
+
+    Returns
+    -------
+    span_rows : numpy.ndarray
+        Row of every span.
+    span_starts : numpy.ndarray
+        First column of every span.
+    span_stops : numpy.ndarray
+        Column after the last column of every span.
+    """
+    if fill_rule not in FILL_RULES:
+        raise ValueError("Invalid fill rule. Pick one of: evenodd, nonzero")
+
+    min_row, max_row, min_column, max_column = window
+    row_start, column_start, row_end, column_end = edges
+    low = np.minimum(row_start, row_end)
+    high = np.maximum(row_start, row_end)
+    directions = np.where(row_end > row_start, 1, -1)
+
+    # scanlines crossed by the right ray: low <= row < high
+    right_rows, right_cross, right_edges = edge_crossings(
+        row_start,
+        column_start,
+        row_end,
+        column_end,
+        np.maximum(np.ceil(low), min_row),
+        np.minimum(np.ceil(high) - 1, max_row),
+    )
+    # scanlines crossed by the left ray: low < row <= high
+    left_rows, left_cross, left_edges = edge_crossings(
+        row_start,
+        column_start,
+        row_end,
+        column_end,
+        np.maximum(np.floor(low) + 1, min_row),
+        np.minimum(np.floor(high), max_row),
+    )
+
+    right = inside_crossings(directions[right_edges], fill_rule)
+    left = inside_crossings(directions[left_edges], fill_rule)
+
+    span_rows = np.concatenate([right_rows[right], left_rows[left]])
+    span_starts = np.concatenate(
+        [np.ceil(right_cross[right]), np.floor(left_cross[left]) + 1]
+    )
+    span_stops = np.concatenate(
+        [np.ceil(right_cross[right + 1]), np.floor(left_cross[left + 1]) + 1]
+    )
+
+    # vertices are always part of the polygon
+    row_points, column_points = vertices
+    vertex_rows = np.round(row_points)
+    vertex_columns = np.round(column_points)
+    on_vertex = (
+        (np.abs(row_points - vertex_rows) < EPS)
+        & (np.abs(column_points - vertex_columns) < EPS)
+        & (vertex_rows >= min_row)
+        & (vertex_rows <= max_row)
+        & (vertex_columns >= min_column)
+        & (vertex_columns <= max_column)
+    )
+    span_rows = np.concatenate([span_rows, vertex_rows[on_vertex]])
+    span_starts = np.concatenate([span_starts, vertex_columns[on_vertex]])
+    span_stops = np.concatenate([span_stops, vertex_columns[on_vertex] + 1])
+
+    # clip the spans to the bounding box
+    span_starts = np.maximum(span_starts, min_column)
+    span_stops = np.minimum(span_stops, max_column + 1)
+    keep = span_starts < span_stops
+
+    return (
+        span_rows[keep].astype(np.int64),
+        span_starts[keep].astype(np.int64),
+        span_stops[keep].astype(np.int64),
+    )
+
+
+def edge_crossings(row_start, column_start, row_end, column_end, first, last):
+    """
+    Intersect every edge with the scanlines it crosses.
+
+    Parameters
+    ----------
+    row_start : numpy.ndarray
+        Start row of every edge.
+    column_start : numpy.ndarray
+        Start column of every edge.
+    row_end : numpy.ndarray
+        End row of every edge.
+    column_end : numpy.ndarray
+        End column of every edge.
+    first : numpy.ndarray
+        First scanline crossed by every edge.
+    last : numpy.ndarray
+        Last scanline crossed by every edge.
+
+    Returns
+    -------
+    cross_rows : numpy.ndarray
+        Scanline of every crossing, sorted.
+    cross_columns : numpy.ndarray
+        Column of every crossing, sorted within its scanline.
+    cross_edges : numpy.ndarray
+        Edge of every crossing.
+    """
+    counts = np.maximum(last - first + 1, 0).astype(np.int64)
+    total = int(counts.sum())
+
+    # one entry per (edge, scanline) pair
+    edges = np.repeat(np.arange(counts.shape[0]), counts)
+    steps = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    cross_rows = first[edges] + steps
+
+    # intersection of the edge with the scanline
+    y0 = row_start[edges] - cross_rows
+    y1 = row_end[edges] - cross_rows
+    cross_columns = (column_start[edges] * y1 - column_end[edges] * y0) / (y1 - y0)
+
+    order = np.lexsort((cross_columns, cross_rows))
+
+    return cross_rows[order], cross_columns[order], edges[order]
+
+
+def inside_crossings(directions, fill_rule="evenodd"):
+    """
+    Find the crossings a span of the inside starts at.
+
+    Every scanline is crossed as many times upwards as downwards by
+    closed rings, so the running counts return to zero at the end of
+    every scanline and never carry over to the next one.
+
+    Parameters
+    ----------
+    directions : numpy.ndarray
+        Direction of the edge of every sorted crossing: 1 when its end
+        row is after its start row and -1 otherwise.
+    fill_rule : str
+        Inside of the rings: evenodd or nonzero.
+
+    Returns
+    -------
+    numpy.ndarray
+        Index of the crossings followed by the inside, the span stops
+        at the next crossing.
+    """
+    if fill_rule == "nonzero":
+        # inside while the rings wind around the pixels
+        return np.flatnonzero(np.cumsum(directions) != 0)
+
+    # inside after an odd number of crossings
+    return np.arange(0, directions.shape[0] - 1, 2)
+
+
+def fill_spans(nparr, span_rows, span_starts, span_stops, value=1):
+    """
+    Fill spans of an array with slice assignment.
+
+    Parameters
+    ----------
+    nparr : numpy.ndarray
+        Array to fill.
+    span_rows : numpy.ndarray
+        Row of every span.
+    span_starts : numpy.ndarray
+        First column of every span.
+    span_stops : numpy.ndarray
+        Column after the last column of every span.
+    value : int
+        Value to fill the spans with.
+
+    Returns
+    -------
+    nparr : numpy.ndarray
+        The filled array.
+    """
+    for row, start, stop in zip(
+        span_rows.tolist(), span_starts.tolist(), span_stops.tolist()
+    ):
+        nparr[row, start:stop] = value
+
+    return nparr
+
+
+def mask_spans(nparr):
+    """
+    Compute the runs of filled pixels of every row of an array.
+
+    Parameters
+    ----------
+    nparr : numpy.ndarray
+        Array of points that define the filled polygon.
+
+    Returns
+    -------
+    span_rows : numpy.ndarray
+        Row of every span.
+    span_starts : numpy.ndarray
+        First column of every span.
+    span_stops : numpy.ndarray
+        Column after the last column of every span.
+    """
+    filled = np.zeros((nparr.shape[0], nparr.shape[1] + 2), dtype=np.int8)
+    filled[:, 1:-1] = nparr != 0
+
+    # a run starts where the row steps up and stops where it steps down
+    steps = np.diff(filled, axis=1)
+    span_rows, span_starts = np.nonzero(steps == 1)
+    _, span_stops = np.nonzero(steps == -1)
+
+    return span_rows, span_starts, span_stops
@@ -0,0 +1,511 @@
+"""
+Spatial index service.
+"""
+import math
+import threading
+from datetime import timedelta
+
+import numpy as np
+
+from app.config import (POLYS_MAX_LIMIT, POLYS_PAGE_LIMIT,
+                        SPATIAL_REFRESH_SECONDS)
+from app.models import Poly
+from app.services.contains_service import (has_vertices, mask_intersects,
+                                           poly_edge_index)
+from app.services.vertex_service import parse_rings, vertices_bbox
+
+# Number of children of every node of the packed tree
+NODE_CAPACITY = 16
+
+# Number of boxes changed since the last packing that triggers a repacking
+REPACK_CHANGES = 1024
+
+
+class PackedRTree:
+    """
+    Static R-tree of bounding boxes, packed with Sort-Tile-Recursive.
+
+    The boxes are sorted into vertical slices by the center of their
+    rows, then by the center of their columns within every slice, and
+    every NODE_CAPACITY consecutive boxes get a parent node. The levels
+    are flat arrays: the children of node i are the boxes
+    i * NODE_CAPACITY to (i + 1) * NODE_CAPACITY of the level below.
+    """
+
+    def __init__(self, ids, boxes):
+        """
+        Pack boxes.
+
+        Parameters
+        ----------
+        ids : numpy.ndarray
+            Id of every box.
+        boxes : numpy.ndarray
+            The boxes, as (min row, min column, max row, max column).
+        """
+        count = ids.shape[0]
+        leaves = math.ceil(count / NODE_CAPACITY)
+        slice_size = math.ceil(math.sqrt(leaves)) * NODE_CAPACITY
+
+        # tile the boxes: slices by row center, then column center
+        rows = np.argsort(boxes[:, 0] + boxes[:, 2], kind="stable")
+        slices = np.empty(count, dtype=np.int64)
+        slices[rows] = np.arange(count) // max(slice_size, 1)
+        order = np.lexsort((boxes[:, 1] + boxes[:, 3], slices))
+
+        self.ids = ids[order]
+        self.sorter = np.argsort(self.ids, kind="stable")
+        self.levels = [boxes[order]]
+        while self.levels[-1].shape[0] > NODE_CAPACITY:
+            below = self.levels[-1]
+            starts = np.arange(0, below.shape[0], NODE_CAPACITY)
+            self.levels.append(
+                np.concatenate(
+                    [
+                        np.minimum.reduceat(below[:, :2], starts),
+                        np.maximum.reduceat(below[:, 2:], starts),
+                    ],
+                    axis=1,
+                )
+            )
+
+    def __len__(self):
+        """
+        Number of boxes of the tree.
+        """
+        return self.ids.shape[0]
+
+    def boxes_of(self, ids):
+        """
+        Get the boxes of ids.
+
+        Parameters
+        ----------
+        ids : numpy.ndarray
+            The ids.
+
+        Returns
+        -------
+        numpy.ndarray
+            The box of every id, NaN for the ids missing from the tree.
+        """
+        boxes = np.full((ids.shape[0], 4), np.nan)
+        if not len(self):
+            return boxes
+
+        positions = np.searchsorted(self.ids, ids, sorter=self.sorter)
+        positions = self.sorter[np.minimum(positions, len(self) - 1)]
+        found = self.ids[positions] == ids
+        boxes[found] = self.levels[0][positions[found]]
+
+        return boxes
+
+    def search(self, box):
+        """
+        Find the boxes intersecting a box, level by level.
+
+        Parameters
+        ----------
+        box : tuple
+            Min row, min column, max row and max column of the query.
+
+        Returns
+        -------
+        numpy.ndarray
+            Id of every intersecting box.
+        """
+        nodes = np.arange(self.levels[-1].shape[0])
+        for depth in range(len(self.levels) - 1, -1, -1):
+            nodes = nodes[boxes_intersect(self.levels[depth][nodes], box)]
+            if depth:
+                children = nodes[:, None] * NODE_CAPACITY + np.arange(NODE_CAPACITY)
+                children = children.ravel()
+                nodes = children[children < self.levels[depth - 1].shape[0]]
+
+        return self.ids[nodes]
+
+
+def boxes_intersect(boxes, box):
+    """
+    Test boxes against a box, borders included.
+
+    Parameters
+    ----------
+    boxes : numpy.ndarray
+        The boxes, as (min row, min column, max row, max column).
+    box : tuple
+        Min row, min column, max row and max column of the query.
+
+    Returns
+    -------
+    numpy.ndarray
+        Whether every box intersects the query.
+    """
+    return (
+        (boxes[:, 0] <= box[2])
+        & (boxes[:, 2] >= box[0])
+        & (boxes[:, 1] <= box[3])
+        & (boxes[:, 3] >= box[1])
+    )
+
+
+class SpatialIndex:
+    """
+    In-process index of the bounding boxes of the stored polys.
+
+    The index is loaded from the database on the first search. Polys
+    created, edited or deleted by this process are kept apart from the
+    packed tree until enough changes pile up to repack it. Polys created
+    or edited by other processes, like the fill job workers, are read
+    again by their update time on every search, and the ones they deleted
+    are dropped once a search finds them missing.
+    """
+
+    def __init__(self):
+        """
+        Create an index to load on the first search.
+        """
+        self.lock = threading.Lock()
+        self.tree = None
+        self.updated_at = None
+        self.added = {}
+        self.removed = set()
+
+    def reset(self):
+        """
+        Drop the index, it is loaded again on the next search.
+        """
+        with self.lock:
+            self.tree = None
+            self.updated_at = None
+            self.added = {}
+            self.removed = set()
+
+    def add(self, poly):
+        """
+        Add or move the bounding box of a poly item.
+
+        Parameters
+        ----------
+        poly : Poly
+            The stored poly item.
+        """
+        with self.lock:
+            if self.tree is None or poly.xmin is None:
+                return
+            self.removed.add(poly.id)
+            self.added[poly.id] = (poly.xmin, poly.ymin, poly.xmax, poly.ymax)
+            self.repack()
+
+    def remove(self, poly_id):
+        """
+        Remove the bounding box of a poly item.
+
+        Parameters
+        ----------
+        poly_id : int
+            The id of the poly item.
+        """
+        with self.lock:
+            if self.tree is None:
+                return
+            self.removed.add(poly_id)
+            self.added.pop(poly_id, None)
+            self.repack()
+
+    def repack(self, force=False):
+        """
+        Pack the changed boxes into a new tree once there are enough of them.
+
+        Parameters
+        ----------
+        force : bool
+            Pack the tree whatever the number of changes.
+        """
+        if not force and len(self.added) + len(self.removed) < REPACK_CHANGES:
+            return
+
+        keep = ~np.isin(self.tree.ids, list(self.removed))
+        ids, boxes = self.added_boxes()
+        self.tree = PackedRTree(
+            np.concatenate([self.tree.ids[keep], ids]),
+            np.concatenate([self.tree.levels[0][keep], boxes]),
+        )
+        self.added = {}
+        self.removed = set()
+
+    def load(self, db):
+        """
+        Load the boxes of the polys changed since the last load.
+
+        The first load packs all boxes, the next ones add or move the
+        boxes of the polys updated since by other processes. The polys
+        updated shortly before the last load are read again, in case
+        their transaction was committed after it. Legacy polys without a
+        bounding box nor vertices are left out.
+
+        Parameters
+        ----------
+        db : Session
+            Database session.
+        """
+        query = db.query(
+            Poly.id, Poly.xmin, Poly.ymin, Poly.xmax, Poly.ymax, Poly.updated_at
+        )
+        if self.updated_at is not None:
+            since = self.updated_at - timedelta(seconds=SPATIAL_REFRESH_SECONDS)
+            query = query.filter(Poly.updated_at >= since)
+        rows = query.order_by(Poly.id).all()
+
+        ids, boxes = [], []
+        for row in rows:
+            box = tuple(row[1:5]) if row[1] is not None else poly_bbox(db, row[0])
+            if box is not None:
+                ids.append(row[0])
+                boxes.append(box)
+        db.commit()
+        updated = [row[5] for row in rows if row[5] is not None]
+        ids = np.array(ids, dtype=np.int64)
+        boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+
+        with self.lock:
+            if self.tree is None:
+                self.tree = PackedRTree(ids, boxes)
+            else:
+                # only the boxes missing from the index or moved are changes
+                moved = ~(self.indexed_boxes(ids) == boxes).all(axis=1)
+                self.removed.update(ids[moved].tolist())
+                self.added.update(zip(ids[moved].tolist(), boxes[moved].tolist()))
+                self.repack()
+            if updated:
+                self.updated_at = max([*updated, self.updated_at or updated[0]])
+
+    def indexed_boxes(self, ids):
+        """
+        Get the boxes the index holds for ids.
+
+        Parameters
+        ----------
+        ids : numpy.ndarray
+            The ids.
+
+        Returns
+        -------
+        numpy.ndarray
+            The box of every id, NaN for the ids missing from the index.
+        """
+        boxes = self.tree.boxes_of(ids)
+        for index, poly_id in enumerate(ids.tolist()):
+            if poly_id in self.added:
+                boxes[index] = self.added[poly_id]
+            elif poly_id in self.removed:
+                boxes[index] = np.nan
+
+        return boxes
+
+    def search(self, db, box):
+        """
+        Find the polys whose bounding box intersects a box.
+
+        Parameters
+        ----------
+        db : Session
+            Database session.
+        box : tuple
+            Min row, min column, max row and max column of the query.
+
+        Returns
+        -------
+        numpy.ndarray
+            The ids of the polys, sorted.
+        """
+        self.load(db)
+
+        with self.lock:
+            ids = self.tree.search(box)
+            if self.removed:
+                ids = ids[~np.isin(ids, list(self.removed))]
+            if self.added:
+                added, boxes = self.added_boxes()
+                ids = np.concatenate([ids, added[boxes_intersect(boxes, box)]])
+
+        return np.sort(ids)
+
+    def added_boxes(self):
+        """
+        Get the boxes added since the last packing.
+
+        Returns
+        -------
+        ids : numpy.ndarray
+            Id of every box.
+        boxes : numpy.ndarray
+            The boxes, as (min row, min column, max row, max column).
+        """
+        ids = np.fromiter(self.added, np.int64, len(self.added))
+        boxes = np.array(list(self.added.values()), dtype=np.float64)
+
+        return ids, boxes.reshape(-1, 4)
+
+
+def poly_bbox(db, poly_id):
+    """
+    Compute and save the bounding box of a poly stored before the bounding
+    box columns.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    poly_id : int
+        The id of the poly item.
+
+    Returns
+    -------
+    tuple or None
+        Min row, min column, max row and max column, None when the poly
+        has no vertices to compute it from.
+    """
+    npinput = db.query(Poly.npinput).filter(Poly.id == poly_id).scalar()
+    if npinput is None:
+        return None
+
+    box = vertices_bbox(parse_rings(npinput)[0])
+    db.query(Poly).filter(Poly.id == poly_id).update(
+        dict(zip(["xmin", "ymin", "xmax", "ymax"], box)), synchronize_session=False
+    )
+
+    return box
+
+
+# Bounding boxes of the stored polys, shared by the requests of this process
+spatial_index = SpatialIndex()
+
+
+def query_box(row=None, column=None, bbox=None):
+    """
+    Get the box of a point or bounding box query.
+
+    Parameters
+    ----------
+    row : float, optional
+        Row of the point.
+    column : float, optional
+        Column of the point.
+    bbox : str, optional
+        Comma separated min row, min column, max row and max column.
+
+    Returns
+    -------
+    tuple
+        Min row, min column, max row and max column of the query.
+    """
+    if (row is None) != (column is None) or (row is None) == (bbox is None):
+        raise ValueError("Query either a point (row and column) or a bbox")
+
+    if bbox is None:
+        return (row, column, row, column)
+
+    try:
+        box = tuple(float(value) for value in bbox.split(","))
+    except ValueError:
+        box = ()
+    if len(box) != 4 or not np.isfinite(box).all():
+        raise ValueError(
+            "Bbox must be four numbers: min row, min column, max row, max column"
+        )
+    if box[0] > box[2] or box[1] > box[3]:
+        raise ValueError("Bbox minimums must not exceed its maximums")
+
+    return box
+
+
+def search_polys(db, box, exact=False, after_id=None, limit=POLYS_PAGE_LIMIT):
+    """
+    Find a page of the polys intersecting a point or a box, in id order.
+
+    Parameters
+    ----------
+    db : Session
+        Database session.
+    box : tuple
+        Min row, min column, max row and max column of the query, the
+        same row and column twice for a point.
+    exact : bool
+        Check the polygons of the candidates, not only their bounding box.
+    after_id : int, optional
+        Only polys with a greater id.
+    limit : int
+        Maximum number of polys.
+
+    Returns
+    -------
+    list
+        The id, name and bounding box of every poly.
+    """
+    if limit < 1 or limit > POLYS_MAX_LIMIT:
+        raise ValueError(f"Limit must be between 1 and {POLYS_MAX_LIMIT}")
+
+    ids = spatial_index.search(db, box)
+    if after_id is not None:
+        ids = ids[ids > after_id]
+
+    found = []
+    for start in range(0, ids.shape[0], limit):
+        batch = ids[start : start + limit].tolist()
+        if exact:
+            polys = db.query(Poly).filter(Poly.id.in_(batch)).order_by(Poly.id).all()
+        else:
+            polys = (
+                db.query(Poly.id, Poly.name, Poly.xmin, Poly.ymin, Poly.xmax, Poly.ymax)
+                .filter(Poly.id.in_(batch))
+                .order_by(Poly.id)
+                .all()
+            )
+
+        # the polys deleted by other processes leave their boxes behind
+        for poly_id in set(batch) - {poly.id for poly in polys}:
+            spatial_index.remove(poly_id)
+        if exact:
+            polys = [poly for poly in polys if poly_intersects(poly, box)]
+
+        found.extend(
+            {
+                "id": poly.id,
+                "name": poly.name,
+                "bbox": [poly.xmin, poly.ymin, poly.xmax, poly.ymax],
+            }
+            for poly in polys
+        )
+        if len(found) >= limit:
+            return found[:limit]
+
+    return found
+
+
+def poly_intersects(poly, box):
+    """
+    Check the polygon of a poly item intersects a point or a box.
+
+    Parameters
+    ----------
+    poly : Poly
+        The poly item.
+    box : tuple
+        Min row, min column, max row and max column of the query.
+
+    Returns
+    -------
+    bool
+        Whether the point is inside, on a vertex or on an edge, or the box
+        overlaps the polygon.
+    """
+    if not has_vertices(poly):
+        return mask_intersects(poly, box)
+
+    index = poly_edge_index(poly)
+
+    if box[0] == box[2] and box[1] == box[3]:
+        return bool(index.classify(np.array([box[:2]]), poly.fill_rule or "evenodd")[0])
+
+    return index.intersects_box(box, poly.fill_rule or "evenodd")
@@ -0,0 +1,410 @@
+"""
+Polygon statistics service.
+"""
+import numpy as np
+
+from app.services.band_service import band_payloads
+from app.services.bitmask_service import BitMask
+from app.services.filling_service import CANVAS_SHAPE
+from app.services.scanline_service import (FILL_RULES, mask_spans,
+                                           polygon_edges, ring_neighbours,
+                                           spans_window, window_spans)
+from app.services.vertex_service import vertices_bbox
+
+# Number of rows of spans computed at once
+STATS_BAND_ROWS = 1024
+
+# Number of filled bits of every byte
+BYTE_PIXELS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(
+    axis=1
+)
+
+
+class SpanStats:
+    """
+    Running statistics of the filled pixels of a mask, given as spans.
+
+    The spans of a band of rows may overlap, they are merged before
+    being counted. The spans of different calls must not share rows.
+    """
+
+    def __init__(self, width, extents=False):
+        """
+        Start the statistics of an empty mask.
+
+        Parameters
+        ----------
+        width : int
+            Number of columns of the canvas, no span stops after it.
+        extents : bool
+            Whether to keep the extent of every row.
+        """
+        self.width = width
+        self.pixels = 0
+        self.row_sum = 0
+        self.column_sum = 0
+        self.bbox = None
+        self.extents = [] if extents else None
+
+    def add(self, rows, starts, stops):
+        """
+        Add the spans of a band of rows.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Row of every span.
+        starts : numpy.ndarray
+            First column of every span.
+        stops : numpy.ndarray
+            Column after the last column of every span.
+        """
+        rows, starts, stops = merge_spans(rows, starts, stops, self.width)
+        if not rows.shape[0]:
+            return
+
+        lengths = stops - starts
+        self.pixels += int(lengths.sum())
+        self.row_sum += int((rows * lengths).sum())
+        # sum of the columns of every span, the product is always even
+        self.column_sum += int(((starts + stops - 1) * lengths).sum() // 2)
+
+        box = [rows[0], starts.min(), rows[-1], stops.max() - 1]
+        if self.bbox is not None:
+            box = np.minimum(self.bbox[:2], box[:2]).tolist() + np.maximum(
+                self.bbox[2:], box[2:]
+            ).tolist()
+        self.bbox = [int(value) for value in box]
+
+        if self.extents is not None:
+            first = np.flatnonzero(np.diff(rows, prepend=-1))
+            last = np.append(first[1:], rows.shape[0]) - 1
+            self.extents.extend(
+                np.stack([rows[first], starts[first], stops[last]], axis=1).tolist()
+            )
+
+    def summary(self):
+        """
+        Get the statistics of the spans added so far.
+
+        Returns
+        -------
+        dict
+            Number of filled pixels, bounding box of the filled pixels and
+            the [row, first column, stop column] extent of every filled
+            row when kept.
+        """
+        summary = {"pixels": self.pixels, "pixel_bbox": self.bbox}
+        if self.extents is not None:
+            summary["extents"] = self.extents
+
+        return summary
+
+
+def merge_spans(rows, starts, stops, width):
+    """
+    Merge the overlapping spans of the same rows.
+
+    Parameters
+    ----------
+    rows : numpy.ndarray
+        Row of every span.
+    starts : numpy.ndarray
+        First column of every span.
+    stops : numpy.ndarray
+        Column after the last column of every span.
+    width : int
+        Number of columns of the canvas, no span stops after it.
+
+    Returns
+    -------
+    tuple
+        Rows, starts and stops of disjoint spans, sorted by row and start.
+    """
+    order = np.lexsort((starts, rows))
+    rows = rows[order].astype(np.int64)
+    starts = starts[order].astype(np.int64)
+    stops = stops[order].astype(np.int64)
+
+    # running stop of the previous spans, restarting on every row
+    ends = np.maximum.accumulate(rows * width + stops)
+    previous = np.concatenate([[-1], ends[:-1]]) - rows * width
+    starts = np.maximum(starts, previous)
+    keep = starts < stops
+
+    return rows[keep], starts[keep], stops[keep]
+
+
+def ring_weights(row_points, column_points, rings, areas, fill_rule="evenodd"):
+    """
+    Weigh the area of every ring by how it changes the filled region.
+
+    A ring fills its inside when it is not filled just outside of it and
+    cuts a hole out of the filled region otherwise. Whether the region
+    just outside a ring is filled is decided by the other rings crossed
+    by a ray from its first vertex.
+
+    Parameters
+    ----------
+    row_points : numpy.ndarray
+        Row coordinates of vertices of polygon.
+    column_points : numpy.ndarray
+        Column coordinates of vertices of polygon.
+    rings : list or None
+        Number of vertices of every ring, a single ring when None.
+    areas : numpy.ndarray
+        Signed area of every ring.
+    fill_rule : str
+        Inside of the rings: evenodd or nonzero.
+
+    Returns
+    -------
+    numpy.ndarray
+        Weight of every ring: 1 when it fills, -1 when it cuts a hole
+        and 0 when it does neither.
+    """
+    if rings is None or len(rings) == 1:
+        return np.ones(1)
+
+    row_start, column_start, row_end, column_end = polygon_edges(
+        row_points, column_points, rings
+    )
+    directions = np.where(row_end > row_start, 1, -1)
+    owners = np.repeat(np.arange(len(rings)), rings)
+    firsts = np.cumsum(rings) - np.array(rings)
+
+    weights = np.zeros(len(rings))
+    for ring, first in enumerate(firsts):
+        row, column = row_points[first], column_points[first]
+        crossed = np.flatnonzero(
+            ((row_start <= row) & (row < row_end))
+            | ((row_end <= row) & (row < row_start))
+        )
+        crossed = crossed[owners[crossed] != ring]
+        cross_columns = column_start[crossed] + (row - row_start[crossed]) * (
+            column_end[crossed] - column_start[crossed]
+        ) / (row_end[crossed] - row_start[crossed])
+        crossed = crossed[cross_columns > column]
+
+        if fill_rule == "nonzero":
+            # a ring of negative area winds once around its inside
+            winding = directions[crossed].sum()
+            before, after = winding != 0, winding - np.sign(areas[ring]) != 0
+        else:
+            before = crossed.shape[0] % 2 == 1
+            after = not before
+        weights[ring] = int(after) - int(before)
+
+    return weights
+
+
+def polygon_area(points, rings=None, fill_rule="evenodd"):
+    """
+    Compute the area and centroid of a polygon with the shoelace formula.
+
+    The area is exact when the rings cross neither themselves nor each
+    other, the rings nested in an odd number of rings being holes for
+    the evenodd rule and the ones winding back for the nonzero rule.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The vertices, as (row, column) pairs.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+    fill_rule : str
+        Inside of the rings: evenodd or nonzero.
+
+    Returns
+    -------
+    area : float
+        The area of the polygon.
+    centroid : list or None
+        Row and column of the centroid, None when the area is zero.
+    """
+    if fill_rule not in FILL_RULES:
+        raise ValueError("Invalid fill rule. Pick one of: evenodd, nonzero")
+
+    row_points = np.ascontiguousarray(points[:, 0], "float64")
+    column_points = np.ascontiguousarray(points[:, 1], "float64")
+    following = ring_neighbours(rings, row_points.shape[0], 1)
+    next_rows = row_points[following]
+    next_columns = column_points[following]
+
+    cross = row_points * next_columns - next_rows * column_points
+    sizes = np.array([row_points.shape[0]] if rings is None else rings)
+    firsts = np.cumsum(sizes) - sizes
+    areas = np.add.reduceat(cross, firsts) / 2
+    row_moments = np.add.reduceat((row_points + next_rows) * cross, firsts) / 6
+    column_moments = np.add.reduceat((column_points + next_columns) * cross, firsts) / 6
+
+    weights = ring_weights(row_points, column_points, rings, areas, fill_rule)
+    area = float((weights * np.abs(areas)).sum())
+    if area <= 0:
+        return 0.0, None
+
+    signs = weights * np.sign(areas)
+    centroid = [
+        float((signs * row_moments).sum() / area),
+        float((signs * column_moments).sum() / area),
+    ]
+
+    return area, centroid
+
+
+def polygon_stats(
+    points,
+    rings=None,
+    canvas=CANVAS_SHAPE,
+    fill_rule="evenodd",
+    extents=False,
+    band_rows=STATS_BAND_ROWS,
+):
+    """
+    Compute the statistics of a polygon from its vertices.
+
+    The filled pixels are counted from the spans of the scanlines, with
+    the rules of the rourke fill, one band of rows at a time: no mask is
+    allocated and the memory only grows with the edges crossing a band.
+    The fast fill only fills the same pixels when the vertices are
+    integers.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The vertices, as (row, column) pairs.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+    canvas : tuple
+        Shape of the canvas the pixels are clipped to.
+    fill_rule : str
+        Inside of the rings: evenodd or nonzero.
+    extents : bool
+        Whether to return the extent of every filled row.
+    band_rows : int
+        Number of rows of spans computed at once.
+
+    Returns
+    -------
+    dict
+        Area, centroid and bounding box of the polygon, then the number,
+        bounding box and row extents of its filled pixels.
+    """
+    area, centroid = polygon_area(points, rings, fill_rule)
+    row_points = np.ascontiguousarray(points[:, 0], "float64")
+    column_points = np.ascontiguousarray(points[:, 1], "float64")
+    spans = SpanStats(canvas[1], extents)
+
+    window = spans_window(row_points, column_points, canvas)
+    if window is not None:
+        for _, _, payload in band_payloads(
+            row_points, column_points, window, band_rows, rings, fill_rule
+        ):
+            spans.add(*window_spans(*payload))
+
+    return {
+        "area": area,
+        "centroid": centroid,
+        "bbox": list(vertices_bbox(points)),
+        **spans.summary(),
+    }
+
+
+def mask_stats(mask, offset=(0, 0), extents=False, band_rows=STATS_BAND_ROWS):
+    """
+    Compute the statistics of a stored mask, one band of rows at a time.
+
+    The area is the number of filled pixels and the centroid the mean of
+    their centers.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray or BitMask
+        The mask.
+    offset : tuple
+        Row and column of the mask within the canvas.
+    extents : bool
+        Whether to return the extent of every filled row.
+    band_rows : int
+        Number of rows of the mask read at once.
+
+    Returns
+    -------
+    dict
+        The statistics, as returned by ``polygon_stats``.
+    """
+    spans = SpanStats(offset[1] + mask.shape[1], extents)
+
+    for first in range(0, mask.shape[0], band_rows):
+        rows, starts, stops = mask_spans(np.asarray(mask[first : first + band_rows]))
+        spans.add(rows + first + offset[0], starts + offset[1], stops + offset[1])
+
+    summary = spans.summary()
+    centroid = None
+    if spans.pixels:
+        centroid = [spans.row_sum / spans.pixels, spans.column_sum / spans.pixels]
+
+    return {
+        "area": float(spans.pixels),
+        "centroid": centroid,
+        "bbox": summary["pixel_bbox"],
+        **summary,
+    }
+
+
+def mask_pixels(mask, band_rows=STATS_BAND_ROWS):
+    """
+    Count the filled pixels of a mask, one band of rows at a time.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray or BitMask
+        The mask.
+    band_rows : int
+        Number of rows of the mask read at once.
+
+    Returns
+    -------
+    int
+        Number of filled pixels.
+    """
+    packed = isinstance(mask, BitMask)
+    rows = mask.bits if packed else mask
+
+    pixels = 0
+    for first in range(0, rows.shape[0], band_rows):
+        band = np.asarray(rows[first : first + band_rows])
+        if packed:
+            pixels += int(BYTE_PIXELS[band].sum(dtype=np.int64))
+        else:
+            pixels += int(np.count_nonzero(band))
+
+    return pixels
+
+
+def stats_fields(points, mask, rings=None, fill_rule="evenodd"):
+    """
+    Get the statistics columns of a poly item.
+
+    The area is the one of the polygon and the pixels are counted from
+    the mask it was filled into, so they follow its algorithm.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The vertices, as (row, column) pairs.
+    mask : numpy.ndarray or BitMask
+        The filled mask of the poly item.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+    fill_rule : str
+        Inside of the rings: evenodd or nonzero.
+
+    Returns
+    -------
+    dict
+        The area and number of filled pixels of the poly item.
+    """
+    area, _ = polygon_area(points, rings, fill_rule or "evenodd")
+
+    return {"area": area, "pixels": mask_pixels(mask)}
@@ -0,0 +1,194 @@
+"""
+Tiled mask service.
+"""
+import zlib
+
+import numpy as np
+
+from app.services.bitmask_service import BitMask
+
+# zlib level of the packed tiles
+TILE_COMPRESSION = 6
+
+
+def tile_levels(extent, tile_size):
+    """
+    Number of levels of a pyramid, down to a single tile.
+
+    Parameters
+    ----------
+    extent : tuple
+        Rows and columns from the canvas origin to the end of the mask.
+    tile_size : int
+        Rows and columns of every tile.
+
+    Returns
+    -------
+    int
+        Number of levels, level 0 is the full resolution.
+    """
+    levels = 1
+    rows, columns = extent
+    while rows > tile_size or columns > tile_size:
+        rows, columns = (rows + 1) // 2, (columns + 1) // 2
+        levels += 1
+
+    return levels
+
+
+def tile_pyramid(nparray, offset, tile_size):
+    """
+    Split a mask into the tiles of every level of its pyramid.
+
+    The tiles are aligned on the canvas origin, tile (tx, ty) of level k
+    covers the columns tx * tile_size * 2**k and the rows ty * tile_size
+    * 2**k onwards. Every level max-pools 2 by 2 blocks of the level
+    below, one band of tiles at a time, the pooled levels are held
+    packed. Tiles without any filled pixel are skipped.
+
+    Parameters
+    ----------
+    nparray : numpy.ndarray or BitMask
+        The mask.
+    offset : tuple
+        Row and column of the mask within the canvas.
+    tile_size : int
+        Rows and columns of every tile, a multiple of 8.
+
+    Yield
+    -------
+    tuple
+        Level, column and row of the tile and its pixels as uint8.
+    """
+    if tile_size < 8 or tile_size % 8:
+        raise ValueError("Tile size must be a positive multiple of 8.")
+
+    extent = (offset[0] + nparray.shape[0], offset[1] + nparray.shape[1])
+    levels = tile_levels(extent, tile_size)
+    source, origin = nparray, (int(offset[0]), int(offset[1]))
+
+    if not nparray.shape[0] or not nparray.shape[1]:
+        return
+
+    for level in range(levels):
+        rows, columns = source.shape
+        first_tx = origin[1] // tile_size
+        first_ty = origin[0] // tile_size
+        tiles_x = -(-(origin[1] + columns) // tile_size) - first_tx
+        tiles_y = -(-(origin[0] + rows) // tile_size) - first_ty
+
+        # the pooled level starts on the tile grid of this level
+        half = tile_size // 2
+        pooled = BitMask((tiles_y * half, tiles_x * half))
+        band = np.zeros((tile_size, tiles_x * tile_size), dtype=np.uint8)
+        left = origin[1] - first_tx * tile_size
+
+        for ty in range(first_ty, first_ty + tiles_y):
+            top = max(origin[0], ty * tile_size)
+            bottom = min(origin[0] + rows, (ty + 1) * tile_size)
+            band[:] = 0
+            band[
+                top - ty * tile_size : bottom - ty * tile_size, left : left + columns
+            ] = source[top - origin[0] : bottom - origin[0]]
+
+            tiles = band.reshape(tile_size, tiles_x, tile_size).swapaxes(0, 1)
+            for index in np.flatnonzero(tiles.any(axis=(1, 2))):
+                yield level, first_tx + int(index), ty, tiles[index].copy()
+
+            blocks = band.reshape(half, 2, tiles_x * half, 2).any(axis=(1, 3))
+            row = (ty - first_ty) * half
+            pooled.bits[row : row + half] = np.packbits(blocks, axis=1)
+
+        source, origin = pooled, (first_ty * half, first_tx * half)
+
+
+def encode_tile(tile):
+    """
+    Compress a tile.
+
+    Parameters
+    ----------
+    tile : numpy.ndarray
+        The pixels of the tile.
+
+    Returns
+    -------
+    bytes
+        The rows packed like ``numpy.packbits``, then deflated.
+    """
+    return zlib.compress(np.packbits(tile != 0, axis=1).tobytes(), TILE_COMPRESSION)
+
+
+def decode_tile(payload, tile_size):
+    """
+    Decompress a tile.
+
+    Parameters
+    ----------
+    payload : bytes
+        The compressed tile.
+    tile_size : int
+        Rows and columns of the tile.
+
+    Returns
+    -------
+    numpy.ndarray
+        The pixels of the tile, as uint8.
+    """
+    packed = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+
+    return np.unpackbits(packed.reshape(tile_size, -1), axis=1, count=tile_size)
+
+
+def mask_tile(mask, offset, level, tx, ty, tile_size):
+    """
+    Cut a tile of any level out of a whole mask.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray or BitMask
+        The mask, only the window of the tile is read.
+    offset : tuple
+        Row and column of the mask within the canvas.
+    level : int
+        Level of the tile, 0 is the full resolution.
+    tx : int
+        Column of the tile.
+    ty : int
+        Row of the tile.
+    tile_size : int
+        Rows and columns of every tile.
+
+    Returns
+    -------
+    numpy.ndarray
+        The pixels of the tile, as uint8.
+    """
+    block = 2**level
+    span = tile_size * block
+    top, left = ty * span - offset[0], tx * span - offset[1]
+    tile = np.zeros((tile_size, tile_size), dtype=np.uint8)
+
+    rows = (max(top, 0), min(top + span, mask.shape[0]))
+    columns = (max(left, 0), min(left + span, mask.shape[1]))
+    if rows[0] >= rows[1] or columns[0] >= columns[1]:
+        return tile
+
+    # pool only the part of the mask within the tile, on the blocks of the tile
+    first = ((rows[0] - top) // block, (columns[0] - left) // block)
+    lead = (rows[0] - top - first[0] * block, columns[0] - left - first[1] * block)
+    blocks = (
+        -(-(lead[0] + rows[1] - rows[0]) // block),
+        -(-(lead[1] + columns[1] - columns[0]) // block),
+    )
+    padded = np.zeros((blocks[0] * block, blocks[1] * block), dtype=bool)
+    padded[
+        lead[0] : lead[0] + rows[1] - rows[0],
+        lead[1] : lead[1] + columns[1] - columns[0],
+    ] = (mask[rows[0] : rows[1], columns[0] : columns[1]] != 0)
+
+    tile[first[0] : first[0] + blocks[0], first[1] : first[1] + blocks[1]] = (
+        padded.reshape(blocks[0], block, blocks[1], block).any(axis=(1, 3))
+    )
+
+    return tile
@@ -0,0 +1,358 @@
+"""
+Polygon vertices service.
+"""
+import json
+import re
+import warnings
+
+import numpy as np
+
+# Bytes of the JSON array of [row, column] pairs
+OPEN, CLOSE, COMMA = ord("["), ord("]"), ord(",")
+STRUCTURE = np.array([OPEN, CLOSE, COMMA], dtype=np.uint8)
+WHITESPACE = np.frombuffer(b" \t\n\r", dtype=np.uint8)
+
+# Drops the brackets, leaving the comma separated numbers
+BRACKETS = str.maketrans("[]", "  ")
+
+# Arrays of rings start with three brackets and separate their rings
+# with the comma between a closing bracket and two opening ones
+RINGS_START = re.compile(r"\s*\[\s*\[\s*\[")
+RING_SEPARATOR = re.compile(r"(?<=\])\s*,\s*(?=\[\s*\[)")
+
+# Binary vertex formats and their little-endian dtypes
+VERTEX_DTYPES = {"int32": "<i4", "float64": "<f8"}
+
+
+def parse_vertices(npinput):
+    """
+    Parse a JSON array of vertex pairs straight into a NumPy array.
+
+    The text is validated with a single regular expression and parsed by
+    NumPy, without building a Python object per coordinate.
+
+    Parameters
+    ----------
+    npinput : str
+        JSON array of [row, column] pairs.
+
+    Returns
+    -------
+    numpy.ndarray
+        The vertices, as float64 (row, column) pairs.
+    """
+    if not isinstance(npinput, str):
+        raise ValueError("Input array must be a string")
+
+    pairs = vertices_structure(npinput)
+    if pairs is None:
+        raise ValueError("Input array must be a JSON array of [row, column] pairs")
+
+    if not pairs:
+        return check_vertices(np.zeros((0, 2)))
+
+    try:
+        with warnings.catch_warnings():
+            # a malformed number stops the parsing early, caught by the count
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(
+                npinput.translate(BRACKETS), dtype=np.float64, sep=","
+            )
+    except ValueError:
+        values = None
+
+    if values is None or values.shape[0] != 2 * pairs:
+        raise ValueError("Input array must be a JSON array of [row, column] pairs")
+
+    return check_vertices(values.reshape(-1, 2))
+
+
+def parse_rings(npinput):
+    """
+    Parse a JSON array of vertex pairs or of rings of vertex pairs.
+
+    Every ring is parsed like ``parse_vertices`` and the rings are
+    concatenated, a polygon with holes or several parts is one array.
+
+    Parameters
+    ----------
+    npinput : str
+        JSON array of [row, column] pairs, or of such arrays.
+
+    Returns
+    -------
+    points : numpy.ndarray
+        The vertices of all rings, as float64 (row, column) pairs.
+    rings : list or None
+        Number of vertices of every ring, None for a single ring.
+    """
+    if not isinstance(npinput, str):
+        raise ValueError("Input array must be a string")
+
+    if RINGS_START.match(npinput) is None:
+        return parse_vertices(npinput), None
+
+    text = npinput.strip()
+    if not text.endswith("]"):
+        raise ValueError("Input array must be a JSON array of rings")
+
+    parts = [parse_vertices(part) for part in RING_SEPARATOR.split(text[1:-1])]
+    if len(parts) == 1:
+        return parts[0], None
+
+    return np.concatenate(parts), [part.shape[0] for part in parts]
+
+
+def parse_ring_sizes(text, count):
+    """
+    Parse the comma separated sizes of the rings of binary vertices.
+
+    Parameters
+    ----------
+    text : str
+        Number of vertices of every ring, e.g. "4,4".
+    count : int
+        Number of vertices.
+
+    Returns
+    -------
+    list or None
+        Number of vertices of every ring, None for a single ring.
+    """
+    try:
+        rings = [int(size) for size in text.split(",")]
+    except ValueError:
+        raise ValueError("Rings must be comma separated vertex counts")
+
+    return check_rings(rings, count)
+
+
+def check_rings(rings, count):
+    """
+    Check the rings hold all the vertices.
+
+    Parameters
+    ----------
+    rings : list or None
+        Number of vertices of every ring.
+    count : int
+        Number of vertices.
+
+    Returns
+    -------
+    list or None
+        The rings, None for a single ring.
+    """
+    if rings is None or (len(rings) == 1 and rings[0] == count):
+        return None
+
+    if not rings or min(rings) < 1 or sum(rings) != count:
+        raise ValueError("Rings must hold all the vertices, at least one each")
+
+    return list(rings)
+
+
+def vertices_structure(npinput):
+    """
+    Check the brackets and commas of a JSON array of vertex pairs.
+
+    The check runs on the bytes of the text as NumPy arrays, the numbers
+    themselves are checked when they are parsed.
+
+    Parameters
+    ----------
+    npinput : str
+        JSON array of [row, column] pairs.
+
+    Returns
+    -------
+    int or None
+        Number of pairs, None when the array is malformed.
+    """
+    raw = np.frombuffer(npinput.encode("utf-8"), dtype=np.uint8)
+    positions = np.flatnonzero(~np.isin(raw, WHITESPACE))
+    chars = raw[positions]
+
+    if chars.shape[0] < 2 or chars[0] != OPEN or chars[-1] != CLOSE:
+        return None
+
+    # whitespace must not split a number, e.g. "1 2"
+    structural = np.isin(chars, STRUCTURE)
+    if (~structural[1:] & ~structural[:-1] & (np.diff(positions) > 1)).any():
+        return None
+
+    opens = np.flatnonzero(chars == OPEN)[1:]
+    closes = np.flatnonzero(chars == CLOSE)[:-1]
+    commas = np.flatnonzero(chars == COMMA)
+    pairs = opens.shape[0]
+
+    if not pairs:
+        return 0 if chars.shape[0] == 2 else None
+
+    if (
+        closes.shape[0] != pairs
+        or commas.shape[0] != 2 * pairs - 1
+        or opens[0] != 1
+        or closes[-1] != chars.shape[0] - 2
+        or (closes <= opens).any()
+    ):
+        return None
+
+    # pairs are separated by a single comma and hold a single comma
+    if (opens[1:] != closes[:-1] + 2).any() or (chars[closes[:-1] + 1] != COMMA).any():
+        return None
+    if (np.searchsorted(commas, closes) - np.searchsorted(commas, opens) != 1).any():
+        return None
+
+    return pairs
+
+
+def parse_binary_vertices(payload, dtype="int32"):
+    """
+    Parse packed little-endian vertex pairs.
+
+    Parameters
+    ----------
+    payload : bytes
+        The (row, column) pairs, packed without padding.
+    dtype : str
+        Type of the coordinates: int32 or float64.
+
+    Returns
+    -------
+    numpy.ndarray
+        The vertices, as float64 (row, column) pairs.
+    """
+    if dtype not in VERTEX_DTYPES:
+        raise ValueError("Invalid vertex type. Pick one of: int32, float64")
+
+    itemsize = np.dtype(VERTEX_DTYPES[dtype]).itemsize
+    if len(payload) % (2 * itemsize):
+        raise ValueError(f"Binary vertices must be whole {dtype} pairs")
+
+    values = np.frombuffer(payload, dtype=VERTEX_DTYPES[dtype])
+
+    return check_vertices(values.astype(np.float64).reshape(-1, 2))
+
+
+def check_vertices(points):
+    """
+    Check the vertices describe a polygon.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The vertices, as (row, column) pairs.
+
+    Returns
+    -------
+    numpy.ndarray
+        The same vertices.
+    """
+    if not points.shape[0]:
+        raise ValueError("Input array must hold at least one vertex")
+
+    if not np.isfinite(points).all():
+        raise ValueError("Vertices must be finite numbers")
+
+    return points
+
+
+def pack_vertices(points):
+    """
+    Pack vertices for storage, as int32 when they all are integers.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The vertices, as (row, column) pairs.
+
+    Returns
+    -------
+    payload : bytes
+        The packed little-endian pairs.
+    dtype : str
+        Type of the coordinates: int32 or float64.
+    """
+    info = np.iinfo(np.int32)
+    integral = (
+        (points == np.round(points)).all()
+        and points.min() >= info.min
+        and points.max() <= info.max
+    )
+    dtype = "int32" if integral else "float64"
+
+    return points.astype(VERTEX_DTYPES[dtype]).tobytes(), dtype
+
+
+def unpack_vertices(payload, dtype):
+    """
+    Unpack stored vertices.
+
+    Parameters
+    ----------
+    payload : bytes
+        The packed little-endian pairs.
+    dtype : str
+        Type of the coordinates: int32 or float64.
+
+    Returns
+    -------
+    numpy.ndarray
+        The vertices, as float64 (row, column) pairs.
+    """
+    values = np.frombuffer(payload, dtype=VERTEX_DTYPES[dtype])
+
+    return values.astype(np.float64).reshape(-1, 2)
+
+
+def vertices_json(points, dtype="float64", rings=None):
+    """
+    Encode vertices as a JSON array of pairs.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The vertices, as (row, column) pairs.
+    dtype : str
+        Type of the coordinates: int32 or float64.
+    rings : list, optional
+        Number of vertices of every ring, a single ring by default.
+
+    Returns
+    -------
+    str
+        JSON array of [row, column] pairs, or of such arrays for rings.
+    """
+    pairs = (points.astype(np.int64) if dtype == "int32" else points).tolist()
+
+    if rings is not None:
+        ends = np.cumsum(rings).tolist()
+        pairs = [pairs[end - size : end] for size, end in zip(rings, ends)]
+
+    return json.dumps(pairs, separators=(",", ":"))
+
+
+def vertices_bbox(points):
+    """
+    Compute the bounding box of vertices.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The vertices, as (row, column) pairs.
+
+    Returns
+    -------
+    tuple
+        Minimum row, minimum column, maximum row and maximum column.
+    """
+    minimum = points.min(axis=0)
+    maximum = points.max(axis=0)
+
+    return (
+        float(minimum[0]),
+        float(minimum[1]),
+        float(maximum[0]),
+        float(maximum[1]),
+    )
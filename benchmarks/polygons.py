@@ -0,0 +1,181 @@
+"""
+Polygon generators of the benchmark suite.
+"""
+import numpy as np
+
+# Top left corner of the generated polygons on the canvas
+ORIGIN = (16, 16)
+
+
+def ring(size, radii):
+    """
+    Place radii evenly around the center of a square.
+
+    Parameters
+    ----------
+    size : int
+        Side of the square bounding box.
+    radii : numpy.ndarray
+        Radius of every vertex, as a fraction of half the side.
+
+    Returns
+    -------
+    numpy.ndarray
+        The vertices, as (row, column) pairs.
+    """
+    half = (size - 1) / 2
+    angles = np.linspace(0, 2 * np.pi, radii.shape[0], endpoint=False)
+    rows = ORIGIN[0] + half + half * radii * np.sin(angles)
+    columns = ORIGIN[1] + half + half * radii * np.cos(angles)
+
+    return np.round(np.stack([rows, columns], axis=1))
+
+
+def convex(size, vertices):
+    """
+    Regular polygon.
+
+    Parameters
+    ----------
+    size : int
+        Side of the square bounding box.
+    vertices : int
+        Number of vertices.
+
+    Returns
+    -------
+    numpy.ndarray
+        The vertices, as (row, column) pairs.
+    """
+    return ring(size, np.ones(vertices))
+
+
+def concave(size, vertices):
+    """
+    Polygon with random dents, the same for the same arguments.
+
+    Parameters
+    ----------
+    size : int
+        Side of the square bounding box.
+    vertices : int
+        Number of vertices.
+
+    Returns
+    -------
+    numpy.ndarray
+        The vertices, as (row, column) pairs.
+    """
+    rng = np.random.default_rng(vertices)
+
+    return ring(size, rng.uniform(0.3, 1.0, vertices))
+
+
+def star(size, vertices):
+    """
+    Star with alternating outer and inner vertices.
+
+    Parameters
+    ----------
+    size : int
+        Side of the square bounding box.
+    vertices : int
+        Number of vertices.
+
+    Returns
+    -------
+    numpy.ndarray
+        The vertices, as (row, column) pairs.
+    """
+    return ring(size, np.where(np.arange(vertices) % 2, 0.4, 1.0))
+
+
+def spiral(size, vertices):
+    """
+    Spiral band winding out from the center and back.
+
+    Parameters
+    ----------
+    size : int
+        Side of the square bounding box.
+    vertices : int
+        Number of vertices.
+
+    Returns
+    -------
+    numpy.ndarray
+        The vertices, as (row, column) pairs.
+    """
+    half = (size - 1) / 2
+    steps = max(vertices // 2, 2)
+    angles = np.linspace(0, 6 * np.pi, steps)
+    outer = np.linspace(0.2, 1.0, steps)
+    inner = outer - 0.12
+
+    points = []
+    for radii, order in [(outer, slice(None)), (inner, slice(None, None, -1))]:
+        rows = ORIGIN[0] + half + half * radii[order] * np.sin(angles[order])
+        columns = ORIGIN[1] + half + half * radii[order] * np.cos(angles[order])
+        points.append(np.stack([rows, columns], axis=1))
+
+    return np.round(np.concatenate(points))
+
+
+def many_vertex(size, vertices):
+    """
+    Jagged circle meant for very large vertex counts.
+
+    Parameters
+    ----------
+    size : int
+        Side of the square bounding box.
+    vertices : int
+        Number of vertices.
+
+    Returns
+    -------
+    numpy.ndarray
+        The vertices, as (row, column) pairs.
+    """
+    rng = np.random.default_rng(vertices)
+
+    return ring(size, rng.uniform(0.9, 1.0, vertices))
+
+
+def rectilinear(size, vertices):
+    """
+    Staircase with axis-aligned edges only.
+
+    Parameters
+    ----------
+    size : int
+        Side of the square bounding box.
+    vertices : int
+        Number of vertices, rounded down to a whole number of steps.
+
+    Returns
+    -------
+    numpy.ndarray
+        The vertices, as (row, column) pairs.
+    """
+    steps = max((vertices - 2) // 2, 1)
+    edges = np.round(np.linspace(0, size - 1, steps + 1))
+
+    points = [(edges[0], edges[0])]
+    for index in range(steps):
+        points.append((edges[index], edges[index + 1]))
+        points.append((edges[index + 1], edges[index + 1]))
+    points.append((edges[-1], edges[0]))
+
+    return np.array(points) + np.array(ORIGIN)
+
+
+# Generators by name
+SHAPES = {
+    "convex": convex,
+    "concave": concave,
+    "star": star,
+    "spiral": spiral,
+    "many_vertex": many_vertex,
+    "rectilinear": rectilinear,
+}
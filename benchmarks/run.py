@@ -0,0 +1,411 @@
+"""
+Benchmarks of the fill engines, the save and preview stages and the
+end-to-end POST path.
+
+Run from the project root:
+
+    python -m benchmarks.run --output baseline.json
+    python -m benchmarks.run --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from app.services.file_management import save_nparray_to_file
+from app.services.filling_service import (CANVAS_SHAPE, fill_polygon_fast,
+                                          fill_polyline_flood,
+                                          fill_polyline_rourke, polygon_window)
+from app.services.preview_service import render_preview
+from benchmarks.polygons import SHAPES
+
+# Bounding box sides and vertex counts of the generated polygons
+SIZES = [256, 1024, 4096]
+QUICK_SIZES = [256, 1024]
+VERTICES = [16, 256]
+MANY_VERTICES = [10000, 100000]
+
+# Fill stages, run on the polygon's window like the service does
+FILL_STAGES = {
+    "fast": lambda nparr, rows, columns: fill_polygon_fast(nparr, rows, columns),
+    "rourke": lambda nparr, rows, columns: fill_polyline_rourke(rows, columns, nparr),
+    "flood": lambda nparr, rows, columns: fill_polyline_flood(rows, columns, nparr),
+}
+
+# skimage's polygon tests every pixel of the box against every edge, it is
+# left out past this many pixel-edge tests to keep the suite laptop-sized
+FAST_MAX_WORK = 10**9
+
+# Relative slowdown flagged as a regression
+THRESHOLD = 0.25
+
+
+def measure(stage, setup, repeat):
+    """
+    Time a stage and record its peak memory.
+
+    Parameters
+    ----------
+    stage : callable
+        The work to measure, taking the result of the setup.
+    setup : callable
+        Untimed preparation run before every call of the stage.
+    repeat : int
+        Number of timed calls.
+
+    Returns
+    -------
+    dict
+        Minimum and median time in nanoseconds and peak traced bytes.
+    """
+    timings = []
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter_ns()
+        stage(argument)
+        timings.append(time.perf_counter_ns() - start)
+
+    # a separate traced call, tracing slows the timed ones down
+    argument = setup()
+    tracemalloc.start()
+    try:
+        stage(argument)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "min_ns": int(min(timings)),
+        "median_ns": int(np.median(timings)),
+        "peak_bytes": int(peak),
+    }
+
+
+def cases(quick=False):
+    """
+    List the polygons of the suite.
+
+    Parameters
+    ----------
+    quick : bool
+        Leave out the largest bounding boxes and vertex counts.
+
+    Yield
+    -------
+    tuple
+        Name of the case, shape, bounding box side and vertex count.
+    """
+    for shape in SHAPES:
+        counts = MANY_VERTICES if shape == "many_vertex" else VERTICES
+        for size in QUICK_SIZES if quick else SIZES:
+            for vertices in counts[:1] if quick else counts:
+                yield f"{shape}-{size}-{vertices}", shape, size, vertices
+
+
+def bench_case(shape, size, vertices, repeat, scratch):
+    """
+    Run the fill, save and preview stages on one polygon.
+
+    Parameters
+    ----------
+    shape : str
+        Name of the polygon generator.
+    size : int
+        Side of the bounding box.
+    vertices : int
+        Number of vertices.
+    repeat : int
+        Number of timed calls of every stage.
+    scratch : Path
+        Folder of the preview files.
+
+    Returns
+    -------
+    dict
+        Measures of every stage.
+    """
+    points = SHAPES[shape](size, vertices)
+    offset, window = polygon_window(points[:, 0], points[:, 1], CANVAS_SHAPE)
+    rows = points[:, 0] - offset[0]
+    columns = points[:, 1] - offset[1]
+
+    def blank():
+        return np.zeros(window, dtype=np.uint8)
+
+    stages = {}
+    for name, fill in FILL_STAGES.items():
+        if name == "fast" and window[0] * window[1] * vertices > FAST_MAX_WORK:
+            continue
+        stages[name] = measure(
+            lambda nparr, fill=fill: fill(nparr, rows, columns), blank, repeat
+        )
+
+    mask = fill_polyline_rourke(rows, columns, blank())
+    filename = f"benchmark-{os.getpid()}"
+
+    for file_format in ["npy", "packbits", "rle"]:
+        stages[f"save_{file_format}"] = measure(
+            lambda nparr, file_format=file_format: os.remove(
+                save_nparray_to_file(nparr, filename, file_format, offset)
+            ),
+            lambda: mask,
+            repeat,
+        )
+
+    stages["preview"] = measure(
+        lambda nparr: render_preview(nparr, scratch / "preview.png"),
+        lambda: mask,
+        repeat,
+    )
+
+    return stages
+
+
+def bench_post(repeat):
+    """
+    Time the POST path end to end, against the scratch database.
+
+    Parameters
+    ----------
+    repeat : int
+        Number of timed requests.
+
+    Returns
+    -------
+    dict
+        Measures of the requests.
+    """
+    from fastapi.testclient import TestClient
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from app.config import Base, get_async_db, get_db
+    from main import app
+
+    # keep the benchmark offline, on a scratch sqlite database
+    scratch = tempfile.TemporaryDirectory()
+    engine = create_engine(f"sqlite:///{Path(scratch.name) / 'benchmarks.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)
+
+    def scratch_db():
+        with session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = scratch_db
+    app.dependency_overrides[get_async_db] = scratch_db
+    client = TestClient(app)
+    npinput = json.dumps(SHAPES["star"](1024, 256).astype(int).tolist())
+    names = iter(range(repeat + 1))
+
+    def post(name):
+        return client.post(
+            "/api/v1/polys",
+            json={
+                "name": name,
+                "npinput": npinput,
+                "algorithm": "rourke",
+                "imagefile": None,
+                "arrayfile": None,
+                "exectime": None,
+            },
+        )
+
+    try:
+        return measure(
+            post, lambda: f"benchmark-{os.getpid()}-{next(names)}", repeat
+        )
+    finally:
+        # deleting the polys removes their artifacts
+        polys = client.get("/api/v1/polys", params={"fields": "name"}).json()
+        for poly in polys:
+            client.delete(f"/api/v1/polys/{poly['id']}")
+
+        app.dependency_overrides.clear()
+        engine.dispose()
+        scratch.cleanup()
+
+
+def calibrate():
+    """
+    Time a fixed NumPy workload, to compare results across machines.
+
+    Returns
+    -------
+    int
+        Median time of the workload in nanoseconds.
+    """
+    nparr = np.arange(1 << 22, dtype=np.int64)
+
+    return measure(lambda values: np.sort(values[::-1]), lambda: nparr, 5)[
+        "median_ns"
+    ]
+
+
+def run_suite(quick=False, repeat=5, post=False):
+    """
+    Run the benchmark suite.
+
+    Parameters
+    ----------
+    quick : bool
+        Leave out the largest bounding boxes and vertex counts.
+    repeat : int
+        Number of timed calls of every stage.
+    post : bool
+        Also time the POST path end to end.
+
+    Returns
+    -------
+    dict
+        The machine, the calibration time and the measures of every stage.
+    """
+    results = []
+
+    with tempfile.TemporaryDirectory() as scratch:
+        for case, shape, size, vertices in cases(quick):
+            stages = bench_case(shape, size, vertices, repeat, Path(scratch))
+            for stage, measures in stages.items():
+                results.append(
+                    {
+                        "case": case,
+                        "shape": shape,
+                        "size": size,
+                        "vertices": vertices,
+                        "stage": stage,
+                        **measures,
+                    }
+                )
+            print(f"{case}: done", file=sys.stderr)
+
+    if post:
+        results.append({"case": "post", "stage": "post", **bench_post(repeat)})
+
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "calibration_ns": calibrate(),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=THRESHOLD, normalize=False):
+    """
+    Compare the fastest times of two runs.
+
+    The minimum is the least noisy measure of a stage, the other calls
+    only add scheduling and cache noise.
+
+    Parameters
+    ----------
+    current : dict
+        The new run.
+    baseline : dict
+        The stored run.
+    threshold : float
+        Relative slowdown flagged as a regression.
+    normalize : bool
+        Scale the times by the calibration time of each run, for runs
+        made on different machines.
+
+    Returns
+    -------
+    list
+        Case, stage and ratio of every measure found in both runs, and
+        whether it regressed.
+    """
+    scale = 1.0
+    if normalize:
+        scale = baseline["meta"]["calibration_ns"] / current["meta"]["calibration_ns"]
+
+    stored = {
+        (result["case"], result["stage"]): result["min_ns"]
+        for result in baseline["results"]
+    }
+
+    report = []
+    for result in current["results"]:
+        key = (result["case"], result["stage"])
+        if key not in stored or not stored[key]:
+            continue
+        ratio = result["min_ns"] * scale / stored[key]
+        report.append(
+            {
+                "case": key[0],
+                "stage": key[1],
+                "ratio": round(ratio, 3),
+                "regression": ratio > 1 + threshold,
+            }
+        )
+
+    return report
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+
+    Parameters
+    ----------
+    argv : list, optional
+        The arguments, sys.argv by default.
+
+    Returns
+    -------
+    int
+        Exit code, 1 when a regression is found.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--quick", action="store_true", help="smaller suite")
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls")
+    parser.add_argument("--post", action="store_true", help="time the POST path")
+    parser.add_argument("--output", help="file to write the results to")
+    parser.add_argument("--compare", help="baseline results to compare to")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument(
+        "--normalize",
+        action="store_true",
+        help="scale by the calibration time, for another machine's baseline",
+    )
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.quick, args.repeat, args.post)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        results["comparison"] = compare(
+            results, baseline, args.threshold, args.normalize
+        )
+
+        for entry in results["comparison"]:
+            flag = "REGRESSION" if entry["regression"] else ""
+            print(
+                f"{entry['case']:<24} {entry['stage']:<14} {entry['ratio']:>7.3f} {flag}",
+                file=sys.stderr,
+            )
+
+    encoded = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(encoded)
+    else:
+        print(encoded)
+
+    return int(any(entry["regression"] for entry in results.get("comparison", [])))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,7 +3,12 @@ Main application module.
 """
 from fastapi import FastAPI
 
+from app.routers.cache_router import router as cache_router
+from app.routers.job_router import router as job_router
+from app.routers.metrics_router import router as metrics_router
 from app.routers.poly_router import router
+from app.services.job_service import resume_jobs
+from app.services.metrics_service import start_tracing
 
 app = FastAPI()
 
@@ -13,3 +18,27 @@ app.include_router(
     tags=["polys"],
     responses={404: {"description": "Not found"}},
 )
+app.include_router(
+    router=job_router,
+    prefix="/api/v1",
+    tags=["jobs"],
+    responses={404: {"description": "Not found"}},
+)
+
+app.include_router(
+    router=cache_router,
+    prefix="/api/v1",
+    tags=["cache"],
+)
+
+# scraped at the usual Prometheus path, outside the versioned API
+app.include_router(router=metrics_router, tags=["metrics"])
+
+
+@app.on_event("startup")
+def startup():
+    """
+    Requeue the fill jobs interrupted by a restart and start tracing memory.
+    """
+    resume_jobs()
+    start_tracing()
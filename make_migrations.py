@@ -2,6 +2,6 @@
 Database migration file.
 """
 from app.config.database import Base, engine
-from app.models import Poly
+from app.models import Job, Poly
 
 Base.metadata.create_all(engine)
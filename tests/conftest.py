@@ -0,0 +1,49 @@
+"""
+Shared test fixtures.
+"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.config import Base, get_async_db, get_db
+from app.services.spatial_service import spatial_index
+from main import app
+
+
+@pytest.fixture(name="session")
+def fixture_session():
+    """
+    Session factory of a scratch in-memory database.
+    """
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+
+    yield sessionmaker(bind=engine)
+
+    engine.dispose()
+
+
+@pytest.fixture(name="client")
+def fixture_client(session):
+    """
+    Client of the API on the scratch database.
+    """
+
+    def scratch_db():
+        with session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = scratch_db
+    app.dependency_overrides[get_async_db] = scratch_db
+    spatial_index.reset()
+
+    yield TestClient(app)
+
+    app.dependency_overrides.clear()
+    spatial_index.reset()
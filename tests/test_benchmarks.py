@@ -0,0 +1,43 @@
+"""
+Benchmark suite tests.
+"""
+import numpy as np
+
+from app.services.filling_service import fill_polyline
+from benchmarks.polygons import ORIGIN, SHAPES
+from benchmarks.run import compare
+
+
+def test_polygons_fill_their_box():
+    """
+    Testing every generated polygon fills a part of its bounding box.
+    """
+    for name, shape in SHAPES.items():
+        points = shape(64, 16)
+        result = fill_polyline(points, "rourke", crop=True)
+
+        assert points.min() >= min(ORIGIN), name
+        assert points.max() <= max(ORIGIN) + 63, name
+        assert 0 < result.mask.sum() < 64 * 64, name
+
+
+def test_compare_flags_regressions():
+    """
+    Testing the comparison flags the stages slower than the threshold.
+    """
+    def run(fast, rourke, calibration):
+        return {
+            "meta": {"calibration_ns": calibration},
+            "results": [
+                {"case": "star", "stage": "fast", "min_ns": fast},
+                {"case": "star", "stage": "rourke", "min_ns": rourke},
+            ],
+        }
+
+    report = compare(run(130, 200, 10), run(100, 200, 10), 0.25)
+    assert [entry["regression"] for entry in report] == [True, False]
+
+    # twice as slow on a machine twice as slow
+    report = compare(run(200, 400, 20), run(100, 200, 10), 0.25, normalize=True)
+    assert not any(entry["regression"] for entry in report)
+    assert np.allclose([entry["ratio"] for entry in report], 1.0)
@@ -0,0 +1,120 @@
+"""
+Bit-packed mask and canvas tests.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from app.serializers import PolySerializer
+from app.services import (BitMask, file_management, fill_polyline,
+                          load_nparray_from_file, save_nparray_to_file)
+from app.services.poly_service import validate_poly
+
+
+def test_fill_spans_packed():
+    """
+    Testing spans within a byte, across bytes and on byte boundaries.
+    """
+    shape = (3, 40)
+    span_rows = np.array([0, 1, 1, 2, 2])
+    span_starts = np.array([2, 0, 13, 8, 39])
+    span_stops = np.array([5, 8, 35, 16, 40])
+
+    expected = np.zeros(shape, dtype=np.uint8)
+    for row, start, stop in zip(span_rows, span_starts, span_stops):
+        expected[row, start:stop] = 1
+
+    mask = BitMask(shape).fill_spans(span_rows, span_starts, span_stops)
+
+    assert mask.nbytes == 15
+    assert (mask.to_array() == expected).all()
+    assert (mask[1:3] == expected[1:3]).all()
+    assert (BitMask.from_array(expected).bits == mask.bits).all()
+
+
+def test_unpack_windows():
+    """
+    Testing windows and pixels of a packed mask unpack like the uint8 mask.
+    """
+    generator = np.random.default_rng(3)
+    expected = (generator.random((20, 37)) < 0.5).astype(np.uint8)
+    mask = BitMask.from_array(expected)
+
+    for rows, columns in [
+        (slice(None), slice(None)),
+        (slice(3, 9), slice(5, 6)),
+        (slice(0, 20), slice(8, 16)),
+        (slice(-4, None), slice(13, 40)),
+        (slice(7, 2), slice(9, 30)),
+        (slice(2, 7), slice(30, 9)),
+    ]:
+        window = mask[rows, columns]
+        assert window.shape == expected[rows, columns].shape
+        assert (window == expected[rows, columns]).all()
+
+    rows, columns = np.nonzero(np.ones_like(expected))
+    assert (mask[rows, columns] == expected[rows, columns]).all()
+
+    with pytest.raises(TypeError):
+        mask[::2]
+    with pytest.raises(TypeError):
+        mask[rows, 2:5]
+
+
+@pytest.mark.parametrize("algorithm", ["rourke", "fast", "outline"])
+def test_packed_fill_matches(algorithm):
+    """
+    Testing packed fills are identical to uint8 fills.
+    """
+    points = [[2.5, 3], [40, 9], [61, 70.25], [20, 55], [9, 80]]
+    canvas = (64, 77)
+
+    unpacked = fill_polyline(points, algorithm, crop=True, canvas=canvas)
+    packed = fill_polyline(points, algorithm, crop=True, canvas=canvas, packed=True)
+
+    assert isinstance(packed.mask, BitMask)
+    assert packed.canvas == canvas
+    assert packed.offset == unpacked.offset
+    assert (packed.mask.to_array() == unpacked.mask).all()
+
+
+@pytest.mark.parametrize("file_format", ["npy", "packbits", "rle"])
+def test_save_packed(file_format, monkeypatch):
+    """
+    Testing packed masks are saved band by band in every format.
+    """
+    monkeypatch.setattr(file_management, "UNPACK_BAND_ROWS", 7)
+    result = fill_polyline(
+        [[1, 1], [30, 4], [12, 25]], "rourke", canvas=(32, 27), packed=True
+    )
+
+    save_file = save_nparray_to_file(result.mask, "test_packed", file_format)
+    try:
+        loaded, _ = load_nparray_from_file(save_file)
+    finally:
+        os.remove(save_file)
+
+    assert (loaded == result.mask.to_array()).all()
+
+
+def test_canvas_bounds():
+    """
+    Testing requested canvases over the server maximum are refused.
+    """
+    poly = PolySerializer(
+        name="a",
+        npinput=None,
+        imagefile=None,
+        arrayfile=None,
+        exectime=None,
+        algorithm="rourke",
+        canvas_width=64,
+        canvas_height=10**6,
+    )
+
+    with pytest.raises(ValueError):
+        validate_poly(poly)
+
+    poly.canvas_height = 64
+    validate_poly(poly)
@@ -0,0 +1,238 @@
+"""
+Bulk ingest tests.
+"""
+import asyncio
+import json
+import os
+
+from app.models import Poly
+from app.services import bulk_service
+from app.services.bulk_service import (feature_fields, fill_record,
+                                       ingest_records, split_records)
+
+
+def split(chunks, max_bytes=16):
+    """
+    Collect the records of a chunked body.
+    """
+
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [record async for record in split_records(body(), max_bytes)]
+
+    return asyncio.run(collect())
+
+
+def test_split_records():
+    """
+    Testing records split across chunks, blank and oversized lines.
+    """
+    assert split([b'{"a"', b": 1}\n\n\x1e[2]\n", b"[3]"]) == [
+        (1, b'{"a": 1}'),
+        (3, b"[2]"),
+        (4, b"[3]"),
+    ]
+    assert split([b"[1]\n" + b"x" * 10, b"x" * 10, b"x\n[4]\n"]) == [
+        (1, b"[1]"),
+        (2, None),
+        (3, b"[4]"),
+    ]
+
+
+def test_feature_fields():
+    """
+    Testing GeoJSON features turn into (row, column) rings.
+    """
+    fields = feature_fields(
+        {
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[[1, 2], [5, 2], [5, 8], [1, 2]]],
+            },
+            "properties": {"name": "feature"},
+        }
+    )
+
+    assert fields["name"] == "feature"
+    assert json.loads(fields["npinput"]) == [[2, 1], [2, 5], [8, 5]]
+
+
+def test_bulk_endpoint(client):
+    """
+    Testing records are stored in batches and failures reported per line.
+    """
+    records = [
+        {"name": f"bulk-{index}", "npinput": [[1, 1], [1, 9 + index], [9, 5]]}
+        for index in range(12)
+    ]
+    records[3]["npinput"] = "[[1, 1]"
+    records[5]["name"] = "bulk-4"
+    records[7] = {
+        "type": "Feature",
+        "geometry": {"type": "Polygon", "coordinates": [[[1, 1], [9, 1], [5, 9]]]},
+        "properties": {"name": "feature", "algorithm": "fast"},
+    }
+    body = "\n".join(json.dumps(record) for record in records)
+
+    response = client.post(
+        "/api/v1/polys/bulk?algorithm=rourke&canvas_height=20&canvas_width=30",
+        content=body,
+    )
+    results = [json.loads(line) for line in response.text.splitlines()]
+
+    assert results[-1] == {"status": "done", "created": 10, "failed": 2}
+    failed = {result["line"] for result in results if result["status"] == "error"}
+    assert failed == {4, 6}
+    filled = [result["line"] for result in results if result["status"] == "filled"]
+    assert sorted(filled) == [1, 2, 3, 5, 7, 8, 9, 10, 11, 12]
+    stored = [result for result in results if result["status"] == "stored"]
+    assert sorted(sum((result["lines"] for result in stored), [])) == sorted(filled)
+    assert len(set(sum((result["ids"] for result in stored), []))) == 10
+
+    polys = {poly["name"]: poly for poly in client.get("/api/v1/polys").json()}
+    assert len(polys) == 10
+    assert polys["feature"]["algorithm"] == "fast"
+    assert polys["bulk-11"]["content_hash"] != polys["bulk-10"]["content_hash"]
+
+    for poly in polys.values():
+        client.delete(f"/api/v1/polys/{poly['id']}")
+
+
+def test_ingest_batches(session):
+    """
+    Testing names clash across batches and backpressure keeps the order.
+    """
+    lines = [
+        json.dumps({"name": f"batch-{index % 5}", "npinput": [[0, 0], [0, 9], [9, 9]]})
+        for index in range(8)
+    ]
+
+    async def body():
+        for line in lines:
+            yield line.encode() + b"\n"
+
+    async def collect(db):
+        defaults = {"algorithm": "rourke", "canvas_height": 10, "canvas_width": 10}
+        return [
+            json.loads(line)
+            async for line in ingest_records(
+                body(), db, defaults, workers=1, batch_size=2
+            )
+        ]
+
+    with session() as db:
+        results = asyncio.run(collect(db))
+        stored = db.query(Poly).all()
+
+        assert results[-1] == {"status": "done", "created": 5, "failed": 3}
+        filled = set()
+        for result in results[:-1]:
+            if result["status"] == "filled":
+                filled.add(result["line"])
+            elif result["status"] == "stored":
+                # the records of a batch are reported as soon as they are filled
+                assert filled.issuperset(result["lines"])
+        assert filled == {1, 2, 3, 4, 5}
+        assert sorted(poly.name for poly in stored) == [f"batch-{i}" for i in range(5)]
+        # identical fills share one mask
+        assert len({poly.arrayfile for poly in stored}) == 1
+
+        for poly in stored:
+            db.delete(poly)
+        db.commit()
+        for path in {poly.arrayfile for poly in stored}:
+            os.remove(path)
+
+
+def test_ingest_failures(session, monkeypatch):
+    """
+    Testing unexpected fill errors fail their record and an aborted upload
+    still stores the fills already made.
+    """
+    lines = [
+        json.dumps({"name": name, "npinput": [[0, 0], [0, 9], [9, index]]})
+        for index, name in enumerate(["first", "broken", "second", "invalid"])
+    ]
+    lines[3] = json.dumps({"name": "invalid", "npinput": "[[0, 0]"})
+
+    def fill(poly, points, rings, db=None):
+        if poly.name == "broken":
+            raise RuntimeError("Fill crashed")
+        return fill_record(poly, points, rings, db)
+
+    monkeypatch.setattr(bulk_service, "fill_record", fill)
+
+    async def body():
+        for line in lines:
+            yield line.encode() + b"\n"
+
+    async def collect(db):
+        defaults = {"algorithm": "rourke", "canvas_height": 10, "canvas_width": 10}
+        results = []
+        records = ingest_records(body(), db, defaults, workers=1, batch_size=10)
+        async for line in records:
+            results.append(json.loads(line))
+            if results[-1]["line"] == 4:
+                # the client goes away before the batch is inserted
+                await records.aclose()
+                break
+        return results
+
+    with session() as db:
+        results = asyncio.run(collect(db))
+        stored = db.query(Poly).all()
+
+        statuses = {result["line"]: result["status"] for result in results}
+        assert statuses.items() >= {(1, "filled"), (2, "error"), (4, "error")}
+        assert statuses.get(3, "filled") == "filled"
+        assert {"line": 2, "status": "error", "detail": "Fill crashed"} in results
+        assert sorted(poly.name for poly in stored) == ["first", "second"]
+
+        for poly in stored:
+            db.delete(poly)
+            os.remove(poly.arrayfile)
+        db.commit()
+
+
+def test_ingest_insert_clash(session, monkeypatch):
+    """
+    Testing a record clashing with a poly stored meanwhile fails after the
+    flush of its batch.
+    """
+
+    def fill(poly, points, rings, db=None):
+        # another upload stores the same name while the record is filled
+        with session() as other:
+            other.add(Poly(name=poly.name, algorithm="rourke"))
+            other.commit()
+        return fill_record(poly, points, rings, db)
+
+    monkeypatch.setattr(bulk_service, "fill_record", fill)
+
+    async def body():
+        yield b'{"name": "clash", "npinput": [[0, 0], [0, 9], [9, 9]]}\n'
+
+    async def collect(db):
+        defaults = {"algorithm": "rourke", "canvas_height": 10, "canvas_width": 10}
+        return [
+            json.loads(line) async for line in ingest_records(body(), db, defaults)
+        ]
+
+    with session() as db:
+        results = asyncio.run(collect(db))
+
+        assert [result["status"] for result in results] == ["filled", "error", "done"]
+        assert results[1] == {
+            "line": 1,
+            "status": "error",
+            "detail": "Poly with that name already exists",
+        }
+        assert results[2] == {"status": "done", "created": 0, "failed": 1}
+        assert db.query(Poly).one().arrayfile is None
+
+        db.query(Poly).delete()
+        db.commit()
@@ -0,0 +1,202 @@
+"""
+Fill result cache tests.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from app.models import Poly
+from app.serializers import PolySerializer
+from app.services import cache_service
+from app.services.bitmask_service import BitMask
+from app.services.cache_service import (KEY_LOCK_STRIPES, MaskCache,
+                                        canonical_points, fill_key,
+                                        get_poly_mask, hold_keys, key_lock,
+                                        release_artifacts, settle_artifact)
+from app.services.file_management import save_nparray_to_file
+from app.services.poly_service import process_poly
+
+
+def test_mask_cache_budget():
+    """
+    Test the least recently used masks are evicted over budget.
+    """
+    cache = MaskCache(250)
+    cache.put("a", np.zeros(100, np.uint8))
+    cache.put("b", np.zeros(100, np.uint8))
+
+    # touch a so b is the least recently used
+    assert cache.get("a") is not None
+    cache.put("c", np.zeros(100, np.uint8))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] == 200
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+
+def test_mask_cache_read_only():
+    """
+    Test cached masks cannot be changed in place.
+    """
+    cache = MaskCache(1000)
+    cache.put("a", np.zeros((2, 2), np.uint8))
+
+    with pytest.raises(ValueError):
+        cache.get("a")[0, 0] = 1
+
+
+def test_poly_mask_packed(monkeypatch):
+    """
+    Test packed masks are loaded and cached without being unpacked.
+    """
+    monkeypatch.setattr(cache_service, "mask_cache", MaskCache(1000))
+    expected = np.eye(12, 20, dtype=np.uint8)
+    path = save_nparray_to_file(BitMask.from_array(expected), "packed", "packbits")
+    poly = Poly(arrayfile=str(path), content_hash="packed")
+
+    try:
+        mask = get_poly_mask(poly)
+        assert isinstance(mask, BitMask)
+        assert (mask[2:5, 1:6] == expected[2:5, 1:6]).all()
+
+        cache_service.mask_cache.put("packed", mask)
+        assert get_poly_mask(poly).bits.base is mask.bits
+    finally:
+        os.remove(path)
+
+
+def test_fill_key_canonical():
+    """
+    Test the content hash ignores the starting vertex and the closing
+    vertex, but not the fill parameters.
+    """
+    points = [[1, 1], [1, 5], [5, 5], [5, 1]]
+    rotated = [[5, 5], [5, 1], [1, 1], [1, 5], [5, 5]]
+
+    assert canonical_points(rotated) == canonical_points(points)
+
+    poly = PolySerializer(
+        name="a",
+        npinput=None,
+        imagefile=None,
+        arrayfile=None,
+        exectime=None,
+        algorithm="fast",
+    )
+    other = PolySerializer(
+        name="b",
+        npinput=None,
+        imagefile=None,
+        arrayfile=None,
+        exectime=None,
+        algorithm="rourke",
+    )
+    canvas = (19200, 10800)
+
+    assert fill_key(points, poly, canvas) == fill_key(rotated, poly, canvas)
+    assert fill_key(points, poly, canvas) != fill_key(points, other, canvas)
+
+    # the flood parameters only make flood fills differ
+    seeded = poly.copy(update={"flood_x": 3, "flood_y": 3, "connectivity": 8})
+    assert fill_key(points, seeded, canvas) == fill_key(points, poly, canvas)
+    flood = poly.copy(update={"algorithm": "flood"})
+    seeded = flood.copy(update={"flood_x": 3, "flood_y": 3})
+    assert fill_key(points, seeded, canvas) != fill_key(points, flood, canvas)
+
+
+def test_key_locks_striped():
+    """
+    Test content hashes share a fixed set of locks.
+    """
+    keys = [f"key-{index}" for index in range(4 * KEY_LOCK_STRIPES)]
+    assert len({id(key_lock(key)) for key in keys}) <= KEY_LOCK_STRIPES
+
+    # hashes sharing a lock are held together without blocking
+    shared = [keys[0]]
+    index = 0
+    while len(shared) < 2:
+        index += 1
+        if key_lock(f"other-{index}") is key_lock(keys[0]):
+            shared.append(f"other-{index}")
+    with hold_keys(shared):
+        assert key_lock(keys[0]).locked()
+    assert not key_lock(keys[0]).locked()
+
+
+def request(name, preview=False):
+    """
+    Poly item of a small triangle.
+    """
+    return PolySerializer(
+        name=name,
+        npinput="[[1, 1], [1, 9], [9, 5]]",
+        imagefile=None,
+        arrayfile=None,
+        exectime=None,
+        algorithm="rourke",
+        canvas_height=10,
+        canvas_width=10,
+        preview=preview,
+    )
+
+
+def test_claimed_artifacts_kept(session):
+    """
+    Test linked artifacts survive a delete until the new poly is committed.
+    """
+    with session() as db:
+        first = process_poly(request("first"), db)
+        db.add(first)
+        db.commit()
+        settle_artifact(first.content_hash)
+        key, path = first.content_hash, first.arrayfile
+
+        # a second poly links the artifacts, then the first one is deleted
+        second = process_poly(request("second"), db)
+        assert second.arrayfile == path
+        db.delete(first)
+        db.commit()
+        release_artifacts(db, key, [path])
+        assert os.path.isfile(path)
+
+        db.add(second)
+        db.commit()
+        settle_artifact(key)
+        db.delete(second)
+        db.commit()
+        release_artifacts(db, key, [path])
+        assert not os.path.isfile(path)
+
+
+def test_linked_preview_requested(session):
+    """
+    Test a poly linked to stored artifacts only gets a preview when asked.
+    """
+    with session() as db:
+        first = process_poly(request("first", preview=True), db)
+        db.add(first)
+        db.commit()
+        settle_artifact(first.content_hash)
+        key, path, preview = first.content_hash, first.arrayfile, first.imagefile
+        assert preview is not None
+
+        second = process_poly(request("second"), db)
+        third = process_poly(request("third", preview=True), db)
+        settle_artifact(key)
+        settle_artifact(key)
+
+        assert second.imagefile is None
+        assert third.imagefile == preview
+
+        db.delete(first)
+        db.commit()
+        release_artifacts(db, key, [path])
+        assert not os.path.isfile(path)
@@ -0,0 +1,161 @@
+"""
+Mask algebra tests.
+"""
+import json
+
+import numpy as np
+import pytest
+
+from app.services.bitmask_service import BitMask
+from app.services.combine_service import crop_mask
+from app.services.filling_service import expand_to_canvas, fill_polyline
+from app.services.stats_service import mask_pixels
+
+# Polygons of the tests and the format of their masks, on a 60 by 80 canvas
+POLYGONS = [
+    ([[5, 5], [5, 40], [40, 40], [40, 5]], "npy"),
+    ([[20, 20], [20, 70], [50, 45]], "packbits"),
+    ([[30, 10], [55, 10], [55, 30]], "rle"),
+]
+
+
+@pytest.fixture(name="client")
+def fixture_client(client):
+    """
+    Client of the API on a scratch database holding the test polygons.
+    """
+    for index, (vertices, array_format) in enumerate(POLYGONS):
+        response = client.post(
+            "/api/v1/polys",
+            json={
+                "name": f"input-{index}",
+                "npinput": json.dumps(vertices),
+                "algorithm": "rourke",
+                "array_format": array_format,
+                "imagefile": None,
+                "arrayfile": None,
+                "exectime": None,
+                "canvas_height": 60,
+                "canvas_width": 80,
+                "preview": False,
+            },
+        )
+        assert response.status_code == 201
+
+    yield client
+
+    for poly in client.get("/api/v1/polys").json():
+        client.delete(f"/api/v1/polys/{poly['id']}")
+
+
+def canvas_mask(index):
+    """
+    Fill a test polygon on the whole canvas.
+    """
+    result = fill_polyline(
+        np.array(POLYGONS[index][0], dtype=np.float64), "rourke", canvas=(60, 80)
+    )
+
+    return expand_to_canvas(result) != 0
+
+
+def spans_mask(body):
+    """
+    Draw the spans of a combined mask on the whole canvas.
+    """
+    mask = np.zeros((60, 80), dtype=bool)
+    for row, start, stop in body["spans"]:
+        mask[row, start:stop] = True
+
+    return mask
+
+
+@pytest.mark.parametrize(
+    "operation, ids",
+    [
+        ("union", [1, 2, 3]),
+        ("intersection", [1, 2]),
+        ("intersection", [1, 2, 3]),
+        ("difference", [1, 2, 3]),
+        ("difference", [3, 1]),
+    ],
+)
+def test_combine_matches_canvas(client, operation, ids):
+    """
+    Testing combined masks match the operation on whole canvases.
+    """
+    masks = [canvas_mask(poly_id - 1) for poly_id in ids]
+    expected = masks[0].copy()
+    for mask in masks[1:]:
+        if operation == "union":
+            expected |= mask
+        elif operation == "intersection":
+            expected &= mask
+        else:
+            expected &= ~mask
+
+    response = client.post(
+        "/api/v1/polys/combine", json={"operation": operation, "ids": ids}
+    )
+    body = response.json()
+
+    assert response.status_code == 200
+    assert (spans_mask(body) == expected).all()
+    assert body["pixels"] == expected.sum()
+    if expected.any():
+        rows, columns = np.nonzero(expected)
+        assert body["offset"] == [rows.min(), columns.min()]
+        assert body["shape"] == [np.ptp(rows) + 1, np.ptp(columns) + 1]
+
+
+def test_stored_combination(client):
+    """
+    Testing stored combinations are linked, queried and not edited.
+    """
+    request = {"operation": "union", "ids": [1, 3], "name": "union", "preview": True}
+    response = client.post("/api/v1/polys/combine", json=request)
+    body = response.json()
+    assert response.status_code == 201
+    assert body["algorithm"] == "union"
+
+    request = {**request, "ids": [3, 1], "name": "again"}
+    linked = client.post("/api/v1/polys/combine", json=request).json()
+    assert linked["file_url"] == body["file_url"]
+
+    classes = client.post(
+        f"/api/v1/polys/{body['id']}/contains", json=[[10, 10], [50, 20], [50, 60]]
+    ).json()
+    assert classes == [1, 1, 0]
+
+    found = client.get("/api/v1/polys/search?row=50&column=20&exact=true").json()
+    assert [poly["name"] for poly in found] == ["input-2", "union", "again"]
+
+    preview = client.get(f"/api/v1/polys/{body['id']}/preview")
+    assert preview.status_code == 200
+
+    edit = {"edits": [{"index": 0, "vertex": [1, 1]}]}
+    assert client.patch(f"/api/v1/polys/{body['id']}", json=edit).status_code == 400
+    request = {"operation": "intersection", "ids": [2, 3], "name": "empty"}
+    assert client.post("/api/v1/polys/combine", json=request).status_code == 400
+    request = {"operation": "xor", "ids": [1, 2]}
+    assert client.post("/api/v1/polys/combine", json=request).status_code == 400
+    request = {"operation": "union", "ids": [1, 9]}
+    assert client.post("/api/v1/polys/combine", json=request).status_code == 404
+
+
+def test_crop_mask():
+    """
+    Testing packed masks are cropped to their filled pixels.
+    """
+    mask = np.zeros((20, 30), dtype=np.uint8)
+    mask[3:7, 11:19] = 1
+    mask[15, 12] = 1
+    packed = BitMask.from_array(mask)
+
+    cropped, offset = crop_mask(
+        packed, mask.any(axis=1), mask.any(axis=0), np.array([100, 200])
+    )
+
+    assert offset == (103, 211)
+    assert (cropped.to_array() == mask[3:16, 11:19]).all()
+    assert mask_pixels(cropped) == mask.sum()
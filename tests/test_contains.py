@@ -0,0 +1,89 @@
+"""
+Point in polygon query tests.
+"""
+import numpy as np
+import pytest
+
+from app.models import Poly
+from app.services.contains_service import EdgeIndex, encode_classes
+from app.services.filling_service import point_in_polygons
+
+
+@pytest.mark.parametrize("fill_rule", ["evenodd", "nonzero"])
+@pytest.mark.parametrize("seed", range(4))
+def test_index_matches_reference(seed, fill_rule):
+    """
+    Testing the indexed classes match point_in_polygons.
+    """
+    generator = np.random.default_rng(seed)
+    points = generator.integers(0, 40, size=(30, 2)).astype(np.float64)
+    rings = [12, 10, 8]
+    queries = np.concatenate(
+        [
+            generator.uniform(-5, 45, size=(300, 2)),
+            generator.integers(-2, 42, size=(300, 2)),
+            points,
+        ]
+    )
+
+    classes = EdgeIndex(points, rings).classify(queries, fill_rule)
+    expected = [
+        point_in_polygons(
+            points[:, 1], points[:, 0], column, row, rings, fill_rule
+        )
+        for row, column in queries
+    ]
+
+    assert classes.tolist() == expected
+
+
+def test_index_slabs():
+    """
+    Testing short edges spread over slabs while tall edges share few of them.
+    """
+    angles = np.linspace(0, 2 * np.pi, 400, endpoint=False)
+    circle = np.stack([100 + 90 * np.sin(angles), 100 + 90 * np.cos(angles)], axis=1)
+    index = EdgeIndex(circle)
+
+    assert index.slabs > 100
+    assert index.slab_edges.shape[0] < 3 * circle.shape[0]
+    zigzag = np.stack([np.arange(20) % 2 * 50, np.arange(20)], axis=1)
+    assert EdgeIndex(zigzag).slabs == 1
+
+
+def test_encode_classes():
+    """
+    Testing the classes are encoded as a JSON array.
+    """
+    assert encode_classes(np.array([0, 1, 2, 3], dtype=np.uint8)) == b"[0,1,2,3]"
+    assert encode_classes(np.zeros(0, dtype=np.uint8)) == b"[]"
+
+
+def test_contains_endpoint(client, session):
+    """
+    Testing points are classified against a stored poly item.
+    """
+    with session() as db:
+        db.add(
+            Poly(
+                name="square",
+                npinput="[[0, 0], [0, 10], [10, 10], [10, 0]]",
+                algorithm="rourke",
+            )
+        )
+        db.commit()
+
+    url = "/api/v1/polys/1/contains"
+    response = client.post(url, content="[[5, 5], [20, 5], [0, 0], [0, 5]]")
+    assert response.status_code == 200
+    assert response.json() == [1, 0, 2, 3]
+    assert response.headers["Server-Timing"].startswith("parse;dur=")
+
+    packed = np.array([[5, 5], [20, 5]], dtype="<i4").tobytes()
+    response = client.post(f"{url}?dtype=int32&output=binary", content=packed)
+    assert response.content == bytes([1, 0])
+
+    assert client.post(url, content="[[5, 5], [20]]").status_code == 400
+    assert client.post("/api/v1/polys/2/contains", content="[[5, 5]]").json() == {
+        "detail": "Poly not found"
+    }
@@ -3,10 +3,12 @@ Poly service tests.
 """
 import os
 
+import numpy as np
 from fastapi.testclient import TestClient
 from numpy import load
 
-from app.services import fill_polyline, save_nparray_to_file
+from app.services import (fill_polyline, load_nparray_from_file,
+                          save_nparray_to_file)
 from main import app
 
 client = TestClient(app)
@@ -44,3 +46,65 @@ def tests_create_poly():
     # remove the file
     if os.path.isfile(save_file):
         os.remove(save_file)
+
+
+def tests_compact_formats_round_trip():
+    """
+    Test saving a cropped mask as bit-packed and run-length
+    encoded files and loading it back.
+    """
+    points = [[1, 1], [5, 5], [5, 1], [9, 3], [1, 11]]
+    result = fill_polyline(points, "rourke", crop=True)
+
+    for file_format, suffix in [("packbits", ".npb"), ("rle", ".rle")]:
+        save_file = save_nparray_to_file(
+            result.mask, "test_poly", file_format, result.offset, "rourke"
+        )
+        loaded_arr, header = load_nparray_from_file(save_file)
+
+        assert save_file.suffix == suffix
+        assert header["format"] == file_format
+        assert header["shape"] == list(result.mask.shape)
+        assert header["offset"] == list(result.offset)
+        assert header["algorithm"] == "rourke"
+        assert loaded_arr.dtype == result.mask.dtype
+        assert (loaded_arr == result.mask).all()
+
+        # remove the file
+        if os.path.isfile(save_file):
+            os.remove(save_file)
+
+
+def tests_npy_format_loads():
+    """
+    Test existing npy files keep loading through the format loader.
+    """
+    nparr = np.zeros((3, 4), dtype=np.uint8)
+    nparr[1, 1:3] = 1
+
+    save_file = save_nparray_to_file(nparr, "test_poly")
+    loaded_arr, header = load_nparray_from_file(save_file)
+
+    assert header["format"] == "npy"
+    assert (loaded_arr == nparr).all()
+
+    # remove the file
+    if os.path.isfile(save_file):
+        os.remove(save_file)
+
+
+def tests_fill_into_memmap(tmp_path):
+    """
+    Test filling straight into a memory-mapped npy file.
+    """
+    points = [[3, 3], [40, 7], [22, 90], [31, 44], [7, 60]]
+
+    for algorithm, workers in [("rourke", 1), ("flood", 1), ("fast", 2)]:
+        out_path = str(tmp_path / f"{algorithm}.npy")
+        expected = fill_polyline(points, algorithm, crop=True)
+        result = fill_polyline(
+            points, algorithm, crop=True, workers=workers, out_path=out_path
+        )
+
+        assert result.offset == expected.offset
+        assert (load(out_path) == expected.mask).all()
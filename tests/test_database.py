@@ -0,0 +1,39 @@
+"""
+Database configuration tests.
+"""
+from app.config.database import engine_options, get_db
+from app.config.environment import env_flag
+
+
+def test_engine_options():
+    """
+    Testing the pool is only sized for pooled engines.
+    """
+    assert "pool_size" in engine_options("postgresql://user@host/db")
+    assert "pool_size" not in engine_options("sqlite:///poly.db")
+    assert engine_options("sqlite:///poly.db")["echo"] is False
+
+
+def test_session_per_request():
+    """
+    Testing every request gets its own session.
+    """
+    first = get_db()
+    second = get_db()
+
+    assert next(first) is not next(second)
+
+    first.close()
+    second.close()
+
+
+def test_env_flag(monkeypatch):
+    """
+    Testing boolean settings fall back to their default when not set.
+    """
+    monkeypatch.delenv("POLYFILL_FLAG", raising=False)
+    assert env_flag("POLYFILL_FLAG", True) is True
+
+    for value, flag in [("1", True), ("Yes", True), ("TRUE", True), ("off", False)]:
+        monkeypatch.setenv("POLYFILL_FLAG", value)
+        assert env_flag("POLYFILL_FLAG", not flag) is flag
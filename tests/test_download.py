@@ -0,0 +1,85 @@
+"""
+Artifact download tests.
+"""
+import json
+
+import pytest
+
+from app.services.download_service import parse_range, stream_file
+
+
+def test_parse_range():
+    """
+    Testing single byte ranges are parsed and others ignored.
+    """
+    assert parse_range("bytes=0-9", 100) == (0, 10)
+    assert parse_range("bytes=90-", 100) == (90, 100)
+    assert parse_range("bytes=-10", 100) == (90, 100)
+    assert parse_range("bytes=95-200", 100) == (95, 100)
+
+    for header in [None, "items=0-9", "bytes=0-1,5-6", "bytes=9-0", "bytes=a-"]:
+        assert parse_range(header, 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=100-", 100)
+
+
+def test_stream_file(tmp_path):
+    """
+    Testing ranges are streamed in chunks.
+    """
+    path = tmp_path / "artifact.bin"
+    path.write_bytes(bytes(range(100)))
+
+    chunks = list(stream_file(path, 5, 50, chunk_bytes=20))
+    assert [len(chunk) for chunk in chunks] == [20, 20, 5]
+    assert b"".join(chunks) == bytes(range(5, 50))
+
+
+def test_download_endpoints(client):
+    """
+    Testing downloads with ranges and conditional requests.
+    """
+    response = client.post(
+        "/api/v1/polys",
+        json={
+            "name": "download",
+            "npinput": json.dumps([[10, 10], [10, 80], [60, 40]]),
+            "algorithm": "rourke",
+            "array_format": "packbits",
+            "imagefile": None,
+            "arrayfile": None,
+            "exectime": None,
+            "canvas_height": 100,
+            "canvas_width": 100,
+        },
+    )
+    body = response.json()
+    with open(body["file_url"], "rb") as mask_file:
+        stored = mask_file.read()
+
+    url = "/api/v1/polys/1/array"
+    response = client.get(url)
+    etag = f'"{body["content_hash"]}-array"'
+    assert response.content == stored
+    assert response.headers["etag"] == etag
+
+    response = client.get(url, headers={"Range": "bytes=8-19"})
+    assert response.status_code == 206
+    assert response.content == stored[8:20]
+    assert response.headers["content-range"] == f"bytes 8-19/{len(stored)}"
+
+    response = client.get(url, headers={"Range": "bytes=8-19", "If-Range": '"x"'})
+    assert response.status_code == 200
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    response = client.get(url, headers={"Range": f"bytes={len(stored)}-"})
+    assert response.status_code == 416
+
+    url = "/api/v1/polys/1/preview"
+    preview = client.get(url)
+    assert preview.status_code == 200
+    assert preview.content.startswith(b"\x89PNG")
+    headers = {"If-None-Match": preview.headers["etag"]}
+    assert client.get(url, headers=headers).status_code == 304
+    assert client.get("/api/v1/polys/2/array").status_code == 404
+
+    client.delete("/api/v1/polys/1")
@@ -0,0 +1,190 @@
+"""
+Vertex edit tests.
+"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+from app.services import edit_service
+from app.services.file_management import load_nparray_from_file
+from app.services.filling_service import expand_to_canvas, fill_polyline
+
+# Polygon of the tests, on a canvas of 120 rows and 100 columns
+VERTICES = [[10, 10], [10, 80], [60, 90], [100, 70], [90, 20]]
+
+
+def create(client, name, **fields):
+    """
+    Create a poly item of the test polygon.
+    """
+    response = client.post(
+        "/api/v1/polys",
+        json={
+            "name": name,
+            "npinput": json.dumps(VERTICES),
+            "imagefile": None,
+            "arrayfile": None,
+            "exectime": None,
+            "canvas_height": 120,
+            "canvas_width": 100,
+            "preview": False,
+            **fields,
+        },
+    )
+    assert response.status_code == 201
+
+    return client.get("/api/v1/polys").json()[-1]["id"]
+
+
+def expected_mask(vertices, algorithm, full_canvas):
+    """
+    Fill the polygon from scratch.
+    """
+    result = fill_polyline(
+        np.array(vertices, dtype=np.float64),
+        algorithm,
+        crop=not full_canvas,
+        canvas=(120, 100),
+    )
+
+    return expand_to_canvas(result) if full_canvas else result.mask
+
+
+def test_patch_float_outline(client):
+    """
+    Testing outlines of float vertices outside a window are patched exactly.
+    """
+    vertices = [[90.4, 2.6], [0.1, 81.9], [59.3, 75.1], [32.3, 56.3]]
+    poly_id = create(
+        client, "float-outline", algorithm="outline", npinput=json.dumps(vertices)
+    )
+
+    response = client.patch(
+        f"/api/v1/polys/{poly_id}",
+        json={"edits": [{"index": 2, "vertex": [57.2, 72.8]}]},
+    )
+    body = response.json()
+    assert body["update"] == "patched"
+
+    vertices[2] = [57.2, 72.8]
+    mask, _ = load_nparray_from_file(body["file_url"])
+    assert (mask == expected_mask(vertices, "outline", False)).all()
+    assert client.get(f"/api/v1/polys/{poly_id}").json()["pixels"] == mask.sum()
+
+    client.delete(f"/api/v1/polys/{poly_id}")
+
+
+def test_patch_keeps_stored_mask(client, monkeypatch):
+    """
+    Testing the stored mask is kept until a patched edit is committed.
+    """
+    poly_id = create(client, "kept", algorithm="rourke")
+    stored = client.get(f"/api/v1/polys/{poly_id}").json()["arrayfile"]
+    files = set(os.listdir(os.path.dirname(stored)))
+
+    def broken_patch(*args, **kwargs):
+        raise ValueError("Patch failed")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(edit_service, "patch_mask", broken_patch)
+        response = client.patch(
+            f"/api/v1/polys/{poly_id}",
+            json={"edits": [{"index": 3, "vertex": [100, 50]}]},
+        )
+    assert response.status_code == 400
+    assert os.path.isfile(stored)
+    assert client.get(f"/api/v1/polys/{poly_id}").json()["arrayfile"] == stored
+    assert set(os.listdir(os.path.dirname(stored))) == files
+
+    response = client.patch(
+        f"/api/v1/polys/{poly_id}",
+        json={"edits": [{"index": 3, "vertex": [100, 50]}]},
+    )
+    assert response.json()["update"] == "patched"
+    assert os.path.isfile(response.json()["file_url"])
+    assert not os.path.isfile(stored)
+
+    client.delete(f"/api/v1/polys/{poly_id}")
+
+
+@pytest.mark.parametrize(
+    "algorithm, array_format, full_canvas",
+    [
+        ("rourke", "npy", False),
+        ("rourke", "packbits", True),
+        ("fast", "rle", False),
+        ("outline", "packbits", False),
+    ],
+)
+def test_patch_matches_fill(client, algorithm, array_format, full_canvas):
+    """
+    Testing a patched mask matches the fill of the edited polygon.
+    """
+    poly_id = create(
+        client,
+        "edited",
+        algorithm=algorithm,
+        array_format=array_format,
+        full_canvas=full_canvas,
+    )
+
+    response = client.patch(
+        f"/api/v1/polys/{poly_id}",
+        json={"edits": [{"index": 2, "vertex": [45, 90]}]},
+    )
+    body = response.json()
+    assert response.status_code == 200
+    assert body["update"] == "patched"
+    assert body["windows"] == [[10, 70, 100, 90]]
+    assert "rasterize" in body["stages"]
+
+    edited = [list(vertex) for vertex in VERTICES]
+    edited[2] = [45, 90]
+    mask, _ = load_nparray_from_file(body["file_url"])
+    assert (mask == expected_mask(edited, algorithm, full_canvas)).all()
+    assert client.get(f"/api/v1/polys/{poly_id}").json()["pixels"] == mask.sum()
+
+    client.delete(f"/api/v1/polys/{poly_id}")
+
+
+def test_shared_and_moved_window(client):
+    """
+    Testing shared masks are copied and moved windows are filled again.
+    """
+    first = create(client, "first", algorithm="rourke")
+    second = create(client, "second", algorithm="rourke")
+    shared = client.get(f"/api/v1/polys/{first}").json()["arrayfile"]
+
+    # the bounding box grows, so the cropped mask does too
+    response = client.patch(
+        f"/api/v1/polys/{second}",
+        json={"edits": [{"index": 0, "vertex": [5, 5]}]},
+    )
+    assert response.json()["update"] == "filled"
+    assert response.json()["shape"] == [96, 86]
+    assert load_nparray_from_file(shared)[0].shape == (91, 81)
+
+    response = client.patch(
+        f"/api/v1/polys/{second}",
+        json={"edits": [{"index": 0, "vertex": [10, 10]}]},
+    )
+    assert response.json()["update"] == "linked"
+    assert response.json()["file_url"] == shared
+
+    response = client.patch(
+        f"/api/v1/polys/{second}",
+        json={"edits": [{"index": 3, "vertex": [100, 50]}]},
+    )
+    assert response.json()["update"] == "patched"
+    assert load_nparray_from_file(shared)[0].sum() == expected_mask(
+        VERTICES, "rourke", False
+    ).sum()
+
+    assert client.patch(
+        f"/api/v1/polys/{second}", json={"edits": [{"index": 9, "vertex": [1, 1]}]}
+    ).status_code == 400
+
+    client.delete(f"/api/v1/polys/{first}")
+    client.delete(f"/api/v1/polys/{second}")
@@ -0,0 +1,194 @@
+"""
+Asynchronous fill job tests.
+"""
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models import Job
+from app.services import job_service
+from app.services.job_service import resume_jobs
+
+
+@pytest.fixture(name="run_jobs")
+def fixture_run_jobs(session, monkeypatch):
+    """
+    Hold the fill jobs in a thread on the scratch database until run.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(job_service, "SessionLocal", session)
+    monkeypatch.setattr(job_service, "executor", executor)
+    monkeypatch.setattr(job_service, "pending_jobs", 0)
+
+    # the only worker waits, the requests must not share the connection
+    gate = threading.Event()
+    executor.submit(gate.wait)
+
+    def run_jobs():
+        gate.set()
+        executor.shutdown(wait=True)
+
+    yield run_jobs
+
+    run_jobs()
+
+
+def submit(client, name):
+    """
+    Queue a fill job of a small polygon.
+    """
+    return client.post(
+        "/api/v1/polys",
+        json={
+            "name": name,
+            "npinput": "[[1, 1], [1, 9], [9, 5]]",
+            "algorithm": "rourke",
+            "imagefile": None,
+            "arrayfile": None,
+            "exectime": None,
+            "canvas_height": 10,
+            "canvas_width": 10,
+            "preview": False,
+            "asynchronous": True,
+        },
+    )
+
+
+def test_job_done(client, run_jobs):
+    """
+    Testing a queued job stores its poly item once it has run.
+    """
+    response = submit(client, "queued")
+    assert response.status_code == 202
+    body = response.json()
+    assert body["status"] == "queued"
+    assert body["status_url"].endswith(f"/api/v1/jobs/{body['job_id']}")
+    job = client.get(body["status_url"]).json()
+    assert job["status"] == "queued"
+    assert job["started_at"] is None
+    assert job_service.pending_jobs == 1
+
+    run_jobs()
+
+    job = client.get(body["status_url"]).json()
+    assert job["status"] == "done"
+    assert job["run_time"] >= 0
+    poly = client.get(f"/api/v1/polys/{job['poly_id']}").json()
+    assert poly["name"] == "queued"
+    assert job_service.pending_jobs == 0
+    assert client.get("/api/v1/jobs/missing").status_code == 404
+
+    client.delete(f"/api/v1/polys/{job['poly_id']}")
+
+
+def test_job_failed(client, run_jobs, monkeypatch):
+    """
+    Testing a job failing to fill records its error.
+    """
+
+    def broken_fill(*args, **kwargs):
+        raise ValueError("Fill failed")
+
+    monkeypatch.setattr(job_service, "process_poly", broken_fill)
+
+    body = submit(client, "broken").json()
+    run_jobs()
+
+    job = client.get(body["status_url"]).json()
+    assert job["status"] == "failed"
+    assert job["error"] == "Fill failed"
+    assert job["poly_id"] is None
+    assert job["finished_at"] is not None
+    assert client.get("/api/v1/polys").json() == []
+
+
+def test_job_limit(client, session, run_jobs, monkeypatch):
+    """
+    Testing jobs over the pending limit are refused without being stored.
+    """
+    monkeypatch.setattr(job_service, "JOB_MAX_PENDING", 0)
+
+    response = submit(client, "refused")
+    assert response.status_code == 429
+    assert job_service.pending_jobs == 0
+    with session() as db:
+        assert db.query(Job).count() == 0
+
+
+def test_resume_jobs(session, run_jobs, monkeypatch):
+    """
+    Testing the unfinished jobs are requeued on startup.
+    """
+    dispatched = []
+    monkeypatch.setattr(
+        job_service, "dispatch_job", lambda job_id, payload: dispatched.append(job_id)
+    )
+
+    ids = {}
+    with session() as db:
+        for status in ["queued", "running", "done", "failed", "resumed"]:
+            ids[status] = str(uuid.uuid4())
+            db.add(
+                Job(
+                    id=ids[status],
+                    name=status,
+                    status="queued" if status == "resumed" else status,
+                    payload="{}",
+                    created_at=datetime.now() - timedelta(seconds=1),
+                    started_at=datetime.now(),
+                    # requeued by another process starting at the same time
+                    resumed_at=datetime.now() if status == "resumed" else None,
+                )
+            )
+        db.commit()
+
+    resume_jobs()
+
+    assert sorted(dispatched) == sorted([ids["queued"], ids["running"]])
+    assert job_service.pending_jobs == 2
+    with session() as db:
+        running = db.query(Job).filter(Job.id == ids["running"]).first()
+        assert running.status == "queued"
+        assert running.started_at is None
+        assert running.resumed_at is not None
+        done = db.query(Job).filter(Job.id == ids["done"]).first()
+        assert done.status == "done"
+
+    # the other workers of the app find the jobs claimed
+    resume_jobs()
+    assert len(dispatched) == 2
+
+
+def test_job_runs_once(session, run_jobs, monkeypatch):
+    """
+    Testing a job dispatched twice is only run by the first worker.
+    """
+
+    def fill_twice(*args, **kwargs):
+        raise AssertionError("The job ran twice")
+
+    monkeypatch.setattr(job_service, "process_poly", fill_twice)
+
+    job_id = str(uuid.uuid4())
+    with session() as db:
+        db.add(
+            Job(
+                id=job_id,
+                name="running",
+                status="running",
+                payload="{}",
+                created_at=datetime.now(),
+                started_at=datetime.now(),
+            )
+        )
+        db.commit()
+
+    job_service.run_job(job_id, "{}")
+
+    with session() as db:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        assert job.status == "running"
+        assert job.error is None
@@ -0,0 +1,74 @@
+"""
+Stage timing and metrics tests.
+"""
+import json
+
+from app.services.metrics_service import Histogram, StageTimer
+
+
+def test_histogram_render():
+    """
+    Testing the buckets are cumulative and end with +Inf.
+    """
+    histogram = Histogram("fill_seconds", "Fill time.", (0.1, 1))
+    for value in [0.05, 0.5, 5]:
+        histogram.observe("rasterize", value)
+
+    lines = histogram.render()
+
+    assert lines[1] == "# TYPE fill_seconds histogram"
+    assert 'fill_seconds_bucket{stage="rasterize",le="0.1"} 1' in lines
+    assert 'fill_seconds_bucket{stage="rasterize",le="1"} 2' in lines
+    assert 'fill_seconds_bucket{stage="rasterize",le="+Inf"} 3' in lines
+    assert 'fill_seconds_count{stage="rasterize"} 3' in lines
+
+
+def test_stage_timer():
+    """
+    Testing repeated stages add up and are listed in the Server-Timing header.
+    """
+    timer = StageTimer()
+    for _ in range(2):
+        with timer.stage("parse"):
+            pass
+    with timer.stage("save"):
+        pass
+
+    assert list(timer.breakdown()) == ["parse", "save"]
+    assert timer.server_timing().startswith("parse;dur=")
+    assert json.loads(timer.dumps()) == timer.breakdown()
+
+
+def test_post_stage_timings(client):
+    """
+    Testing a created poly item reports, stores and exports its stages.
+    """
+    response = client.post(
+        "/api/v1/polys",
+        json={
+            "name": "timed",
+            "npinput": "[[1, 1], [1, 30], [30, 30], [30, 1]]",
+            "algorithm": "rourke",
+            "imagefile": None,
+            "arrayfile": None,
+            "exectime": None,
+            "preview": False,
+        },
+    )
+    assert response.status_code == 201
+
+    stages = [
+        entry.split(";")[0]
+        for entry in response.headers["Server-Timing"].split(", ")
+    ]
+    assert stages[:2] == ["parse", "duplicate"]
+    assert {"rasterize", "save", "insert"} <= set(stages)
+
+    poly = client.get("/api/v1/polys?fields=exectime_stages").json()[0]
+    assert "rasterize" in json.loads(poly["exectime_stages"])
+
+    metrics = client.get("/metrics")
+    assert metrics.headers["content-type"].startswith("text/plain")
+    assert 'polyfill_stage_seconds_count{stage="rasterize"}' in metrics.text
+
+    client.delete(f"/api/v1/polys/{poly['id']}")
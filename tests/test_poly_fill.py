@@ -1,9 +1,10 @@
 """
 Poly service tests.
 """
+import pytest
 from fastapi.testclient import TestClient
 
-from app.services import fill_polyline
+from app.services import expand_to_canvas, fill_polyline
 from main import app
 
 client = TestClient(app)
@@ -123,3 +124,101 @@ def test_rectangle_flood():
     assert (0 in result[0][4][1:6]) == False
     assert (0 in result[0][5][1:6]) == False
     assert (0 in result[0][6][1:6]) == True
+
+
+def test_cropped_window():
+    """
+    Testing that every algorithm rasterizes only into the
+    polygon's bounding box and expands back to the full canvas.
+
+    shape = (5, 5), offset = (1, 1)
+    """
+    points = [[1, 1], [1, 2], [1, 5], [3, 5], [5, 5], [5, 3], [5, 1]]
+
+    for algorithm in ["fast", "rourke", "flood"]:
+        flood = (3, 3) if algorithm == "flood" else (None, None)
+        result = fill_polyline(points, algorithm, *flood, crop=True)
+
+        assert result.mask.shape == (5, 5)
+        assert result.offset == (1, 1)
+        assert result.canvas == (19200, 10800)
+        assert (0 in result.mask) == False
+
+        canvas = expand_to_canvas(result)
+        assert canvas.shape == (19200, 10800)
+        assert canvas.sum() == 25
+        assert (0 in canvas[1:6, 1:6]) == False
+
+
+def test_cropped_window_clipped():
+    """
+    Testing a polygon partially outside the canvas
+    is clipped to the canvas bounds.
+    """
+    points = [[-3, -3], [-3, 2], [2, 2], [2, -3]]
+    result = fill_polyline(points, "fast", crop=True)
+
+    assert result.offset == (0, 0)
+    assert result.mask.shape == (3, 3)
+    assert (0 in result.mask) == False
+
+
+def test_flood_without_seed():
+    """
+    Testing the flood fill finds the inside of a concave
+    polygon without a start position.
+
+    0 0 0 0 0 0 0 ...
+    0 1 1 1 1 1 0 ...
+    0 1 1 1 1 1 0 ...
+    0 1 1 0 0 0 0 ...
+    0 1 1 1 1 1 0 ...
+    0 1 1 1 1 1 0 ...
+    0 0 0 0 0 0 0 ...
+    .................
+    """
+    points = [[1, 1], [1, 5], [2, 5], [2, 2], [4, 2], [4, 5], [5, 5], [5, 1]]
+    result = fill_polyline(points, "flood", crop=True)
+
+    assert result.mask.tolist() == [
+        [1, 1, 1, 1, 1],
+        [1, 1, 1, 1, 1],
+        [1, 1, 0, 0, 0],
+        [1, 1, 1, 1, 1],
+        [1, 1, 1, 1, 1],
+    ]
+
+
+def test_flood_without_seed_off_canvas():
+    """
+    Testing the flood fill without a start position fills
+    a polygon reaching beyond the edges of the canvas.
+    """
+    points = [[-10, 5], [-10, 25], [15, 25], [15, 5]]
+    flood = expand_to_canvas(fill_polyline(points, "flood", canvas=(30, 30)))
+    rourke = expand_to_canvas(fill_polyline(points, "rourke", canvas=(30, 30)))
+
+    assert flood.sum() == rourke.sum() == 336
+    assert (flood == rourke).all()
+
+
+def test_flood_large_polygon():
+    """
+    Testing the flood fill does not hit the recursion limit
+    on a polygon far larger than the interpreter stack.
+    """
+    points = [[0, 0], [0, 2999], [1999, 2999], [1999, 0]]
+    result = fill_polyline(points, "flood", 10, 10, crop=True)
+
+    assert result.mask.shape == (2000, 3000)
+    assert (0 in result.mask) == False
+
+
+def test_flood_memory_bound():
+    """
+    Testing the flood fill stops once it exceeds its memory bound.
+    """
+    points = [[0, 0], [0, 50], [20, 50], [50, 25], [20, 0]]
+
+    with pytest.raises(ValueError, match="Flood fill exceeded the memory bound."):
+        fill_polyline(points, "flood", 10, 10, crop=True, max_spans=1)
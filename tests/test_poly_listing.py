@@ -0,0 +1,55 @@
+"""
+Poly listing tests.
+"""
+import json
+
+import pytest
+
+from app.models import Poly
+from app.services.poly_service import encode_polys, poly_columns, query_polys
+
+
+@pytest.fixture
+def db(session):
+    """
+    Database session with a few poly items.
+    """
+    with session() as scratch:
+        for index in range(7):
+            scratch.add(
+                Poly(
+                    name=f"poly{index}",
+                    npinput="[[1, 1], [1, 5], [5, 5]]",
+                    algorithm=["fast", "rourke"][index % 2],
+                    exectime=index / 10,
+                )
+            )
+        scratch.commit()
+        yield scratch
+
+
+def test_keyset_pages(db):
+    """
+    Testing the pages follow each other without gaps or repeats.
+    """
+    names = poly_columns("name")
+    first = query_polys(db, names, limit=4)
+    second = query_polys(db, names, after_id=first[-1][0], limit=4)
+
+    assert names == ["id", "name"]
+    assert [row[1] for row in first + second] == [f"poly{i}" for i in range(7)]
+
+
+def test_filters_and_projection(db):
+    """
+    Testing the filters and that the vertices are only loaded when asked for.
+    """
+    names = poly_columns()
+    rows = query_polys(db, names, algorithm="rourke", min_exectime=0.2)
+    items = json.loads(b"".join(encode_polys(names, rows)))
+
+    assert "npinput" not in names
+    assert [item["name"] for item in items] == ["poly3", "poly5"]
+
+    with pytest.raises(ValueError):
+        poly_columns("name,secret")
@@ -0,0 +1,52 @@
+"""
+Preview rendering tests.
+"""
+import subprocess
+import sys
+
+import numpy as np
+from PIL import Image
+
+from app.services.preview_service import pool_mask, render_preview
+
+
+def test_pool_mask_keeps_thin_lines():
+    """
+    Testing the max-pooling keeps every filled block, however thin.
+    """
+    mask = np.zeros((10, 7), dtype=np.uint8)
+    mask[4, :] = 1
+    mask[9, 6] = 1
+
+    pooled = pool_mask(mask, 4)
+
+    # blocks of 3x3 pixels, the last row and column are partial
+    assert pooled.shape == (4, 3)
+    assert pooled[1].all()
+    assert pooled[3, 2]
+    assert pooled.sum() == 4
+
+
+def test_render_preview(tmp_path):
+    """
+    Testing the preview fits the thumbnail size.
+    """
+    mask = np.zeros((1000, 300), dtype=np.uint8)
+    mask[100:200, 50:60] = 1
+
+    loc_path = render_preview(mask, tmp_path / "preview.png", 100)
+
+    with Image.open(loc_path) as image:
+        assert image.size == (30, 100)
+        assert np.asarray(image)[10:20, 5].all()
+
+    assert render_preview(np.zeros((0, 0)), tmp_path / "empty.png").is_file()
+
+
+def test_no_matplotlib_import():
+    """
+    Testing the app does not import matplotlib.
+    """
+    code = "import sys, main; sys.exit('matplotlib' in sys.modules)"
+
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
@@ -0,0 +1,218 @@
+"""
+Scanline filling tests.
+"""
+import numpy as np
+import pytest
+
+from app.services.band_service import fill_polyline_bands, get_band_executor
+from app.services.filling_service import (bresenham, bresenham_polygon,
+                                          fill_polygon_fast, fill_polyline,
+                                          fill_polyline_rourke,
+                                          fill_polyline_rourke_reference)
+from app.services.scanline_service import polygon_spans
+
+
+def test_rourke_matches_reference():
+    """
+    Testing the scanline rourke engine against the per-pixel
+    reference implementation on random integer polygons.
+    """
+    rng = np.random.default_rng(0)
+
+    for _ in range(100):
+        nr_vertices = rng.integers(3, 12)
+        rows = rng.integers(-3, 35, nr_vertices)
+        columns = rng.integers(-3, 35, nr_vertices)
+
+        result = fill_polyline_rourke(rows, columns, np.zeros((32, 32), np.uint8))
+        reference = fill_polyline_rourke_reference(
+            rows, columns, np.zeros((32, 32), np.uint8)
+        )
+        fast = fill_polygon_fast(np.zeros((32, 32), np.uint8), rows, columns)
+
+        assert (result == reference).all()
+        assert (result == fast).all()
+
+
+def test_spans_spike_vertex():
+    """
+    Testing a spike vertex is filled even when no span reaches it.
+
+    0 0 0 0 0
+    0 0 1 0 0
+    0 1 1 1 0
+    .........
+    """
+    span_rows, span_starts, span_stops = polygon_spans(
+        [1, 2, 2], [2, 3, 1], (5, 5)
+    )
+    nparr = np.zeros((5, 5), np.uint8)
+    for row, start, stop in zip(span_rows, span_starts, span_stops):
+        nparr[row, start:stop] = 1
+
+    assert nparr[1].tolist() == [0, 0, 1, 0, 0]
+    assert nparr[2].tolist() == [0, 1, 1, 1, 0]
+    assert nparr.sum() == 4
+
+
+def test_spans_off_canvas():
+    """
+    Testing a polygon outside the array has no spans.
+    """
+    span_rows, _, _ = polygon_spans([-5, -5, -1], [-5, -1, -1], (5, 5))
+
+    assert span_rows.shape == (0,)
+
+
+def test_bresenham_polygon_matches_generator():
+    """
+    Testing the batched outline rasterizer produces the same
+    pixels, in the same order, as the bresenham generator.
+    """
+    rng = np.random.default_rng(1)
+
+    for _ in range(100):
+        nr_vertices = rng.integers(1, 12)
+        rows = rng.integers(-20, 60, nr_vertices)
+        columns = rng.integers(-20, 60, nr_vertices)
+
+        expected = []
+        for i in range(nr_vertices):
+            j = (i + 1) % nr_vertices
+            expected.extend(
+                bresenham(
+                    int(rows[i]), int(columns[i]), int(rows[j]), int(columns[j])
+                )
+            )
+
+        row_values, column_values = bresenham_polygon(rows, columns)
+
+        assert list(zip(row_values.tolist(), column_values.tolist())) == expected
+
+
+def test_outline_only():
+    """
+    Testing the outline only mode draws the edges without filling.
+
+    0 0 0 0 0 0 0 ...
+    0 1 1 1 1 1 0 ...
+    0 1 0 0 0 1 0 ...
+    0 1 0 0 0 1 0 ...
+    0 1 0 0 0 1 0 ...
+    0 1 1 1 1 1 0 ...
+    0 0 0 0 0 0 0 ...
+    .................
+    """
+    points = [[1, 1], [1, 5], [5, 5], [5, 1]]
+    result = fill_polyline(points, "outline", crop=True)
+
+    assert result.mask.sum() == 16
+    assert result.mask[1:4, 1:4].sum() == 0
+
+
+def test_bands_match_serial():
+    """
+    Testing the band-parallel fill is bit-identical to the serial fill.
+    """
+    points = [[3, 3], [40, 7], [22, 90], [31, 44], [7, 60]]
+
+    for algorithm in ["rourke", "fast"]:
+        serial = fill_polyline(points, algorithm, crop=True)
+        parallel = fill_polyline(
+            points, algorithm, crop=True, workers=2, band_height=7
+        )
+
+        assert parallel.offset == serial.offset
+        assert (parallel.mask == serial.mask).all()
+
+
+def test_fast_bands_match_serial():
+    """
+    Testing fast fills with workers match the serial fill for integer and
+    fractional vertices, the latter being filled serially.
+    """
+    rng = np.random.default_rng(5)
+    polygons = [np.array([[43.2, 32.6], [18.0, 23.0], [10.9, 44.1]])]
+    for index in range(30):
+        points = rng.uniform(-10, 90, (rng.integers(3, 12), 2))
+        polygons.append(np.round(points) if index % 2 else points)
+
+    for points in polygons:
+        serial = fill_polyline(points, "fast", canvas=(40, 40))
+        parallel = fill_polyline(
+            points, "fast", canvas=(40, 40), workers=2, band_height=8
+        )
+
+        assert (parallel.mask == serial.mask).all()
+
+    with pytest.raises(ValueError):
+        fill_polyline_bands(
+            polygons[0][:, 0], polygons[0][:, 1], np.zeros((40, 40)), "fast", 2, 8
+        )
+
+
+def test_band_pool_shared():
+    """
+    Testing fills asking for different numbers of workers share one pool.
+    """
+    points = [[3, 3], [40, 7], [22, 90], [31, 44], [7, 60]]
+    serial = fill_polyline(points, "rourke", crop=True)
+
+    pools = []
+    for workers in [2, 3, 2]:
+        parallel = fill_polyline(
+            points, "rourke", crop=True, workers=workers, band_height=5
+        )
+        pools.append(get_band_executor())
+
+        assert (parallel.mask == serial.mask).all()
+    assert pools[0] is pools[1] is pools[2]
+
+
+def test_rings_match_reference():
+    """
+    Testing several rings under both fill rules against the per-pixel
+    reference implementation.
+    """
+    rng = np.random.default_rng(2)
+
+    for _ in range(50):
+        rings = rng.integers(1, 8, rng.integers(1, 4)).tolist()
+        rows = rng.integers(-3, 35, sum(rings))
+        columns = rng.integers(-3, 35, sum(rings))
+
+        for fill_rule in ["evenodd", "nonzero"]:
+            result = fill_polyline_rourke(
+                rows, columns, np.zeros((32, 32), np.uint8), rings, fill_rule
+            )
+            reference = fill_polyline_rourke_reference(
+                rows, columns, np.zeros((32, 32), np.uint8), rings, fill_rule
+            )
+
+            assert (result == reference).all()
+
+
+def test_hole_fill_rules():
+    """
+    Testing a hole is left empty by evenodd and by nonzero only when it
+    winds the other way.
+    """
+    outer = [[0, 0], [0, 20], [20, 20], [20, 0]]
+    hole = [[5, 5], [15, 5], [15, 15], [5, 15]]
+
+    evenodd = fill_polyline(outer + hole, "rourke", canvas=(21, 21), rings=[4, 4])
+    same_winding = fill_polyline(
+        outer + hole[::-1],
+        "rourke",
+        canvas=(21, 21),
+        rings=[4, 4],
+        fill_rule="nonzero",
+    )
+    opposite_winding = fill_polyline(
+        outer + hole, "rourke", canvas=(21, 21), rings=[4, 4], fill_rule="nonzero"
+    )
+
+    assert evenodd.mask.sum() == 21 * 21 - 9 * 9
+    assert evenodd.mask[10, 10] == 0
+    assert same_winding.mask.sum() == 21 * 21
+    assert opposite_winding.mask.sum() == 21 * 21 - 9 * 9
@@ -0,0 +1,144 @@
+"""
+Spatial index tests.
+"""
+import numpy as np
+import pytest
+
+from app.models import Poly
+from app.services import spatial_service
+from app.services.contains_service import EdgeIndex
+from app.services.spatial_service import (PackedRTree, boxes_intersect,
+                                          query_box)
+
+
+@pytest.mark.parametrize("count", [0, 1, 16, 17, 5000])
+def test_tree_matches_scan(count):
+    """
+    Testing the packed tree finds the same boxes as a full scan.
+    """
+    generator = np.random.default_rng(count)
+    low = generator.uniform(0, 1000, size=(count, 2))
+    high = low + generator.uniform(0, 50, size=(count, 2))
+    boxes = np.concatenate([low, high], axis=1)
+    ids = np.arange(count) + 1
+    tree = PackedRTree(ids, boxes)
+
+    for box in [(0, 0, 1000, 1000), (500, 500, 500, 500), (100, 200, 300, 250)]:
+        expected = ids[boxes_intersect(boxes, box)]
+        assert np.sort(tree.search(box)).tolist() == expected.tolist()
+
+
+def test_intersects_box():
+    """
+    Testing boxes inside, across, around and outside a triangle.
+    """
+    index = EdgeIndex(np.array([[0, 0], [10, 0], [0, 10]], dtype=np.float64))
+
+    assert index.intersects_box((2, 2, 3, 3))
+    assert index.intersects_box((-5, 4, 15, 6))
+    assert index.intersects_box((-5, -5, 20, 20))
+    assert not index.intersects_box((8, 8, 10, 10))
+
+
+def test_query_box():
+    """
+    Testing queries take either a point or a bbox.
+    """
+    assert query_box(row=3, column=4) == (3, 4, 3, 4)
+    assert query_box(bbox="1,2,3,4") == (1, 2, 3, 4)
+
+    for arguments in [{}, {"row": 3}, {"row": 3, "column": 4, "bbox": "1,2,3,4"}]:
+        with pytest.raises(ValueError):
+            query_box(**arguments)
+    with pytest.raises(ValueError):
+        query_box(bbox="3,2,1,4")
+
+
+def test_search_endpoint(client, session, monkeypatch):
+    """
+    Testing searches follow created and deleted poly items and repacking.
+    """
+    with session() as db:
+        # stored before the bounding box columns
+        db.add(
+            Poly(
+                name="legacy",
+                npinput="[[0, 0], [0, 10], [10, 10], [10, 0]]",
+                algorithm="rourke",
+            )
+        )
+        db.commit()
+
+    monkeypatch.setattr(spatial_service, "REPACK_CHANGES", 2)
+
+    url = "/api/v1/polys/search"
+    assert client.get(f"{url}?row=5&column=5").json() == [
+        {"id": 1, "name": "legacy", "bbox": [0, 0, 10, 10]}
+    ]
+
+    for name, npinput in [
+        ("triangle", "[[20, 20], [30, 20], [20, 30]]"),
+        ("square", "[[40, 40], [40, 50], [50, 50], [50, 40]]"),
+    ]:
+        response = client.post(
+            "/api/v1/polys",
+            json={
+                "name": name,
+                "npinput": npinput,
+                "algorithm": "rourke",
+                "imagefile": None,
+                "arrayfile": None,
+                "exectime": None,
+                "preview": False,
+            },
+        )
+        assert response.status_code == 201
+
+    corner = client.get(f"{url}?bbox=28,28,29,29").json()
+    assert [poly["name"] for poly in corner] == ["triangle"]
+    assert client.get(f"{url}?bbox=28,28,29,29&exact=true").json() == []
+
+    page = client.get(f"{url}?bbox=0,0,60,60&limit=2")
+    assert [poly["id"] for poly in page.json()] == [1, 2]
+    assert "after_id=2" in page.headers["Link"]
+
+    client.delete("/api/v1/polys/2")
+    client.delete("/api/v1/polys/3")
+    assert client.get(f"{url}?bbox=0,0,60,60").json()[0]["id"] == 1
+    assert len(client.get(f"{url}?bbox=0,0,60,60").json()) == 1
+    assert client.get(f"{url}?row=5").status_code == 400
+
+
+def test_search_other_processes(client, session):
+    """
+    Testing searches follow polys edited and deleted by other processes.
+    """
+    with session() as db:
+        for name, box in [("moved", (0, 0, 10, 10)), ("deleted", (20, 20, 30, 30))]:
+            db.add(
+                Poly(
+                    name=name,
+                    algorithm="rourke",
+                    **dict(zip(["xmin", "ymin", "xmax", "ymax"], box)),
+                )
+            )
+        # stored before the bounding box columns, without vertices
+        db.add(Poly(name="legacy", algorithm="union"))
+        db.commit()
+
+    url = "/api/v1/polys/search"
+    found = client.get(f"{url}?bbox=0,0,60,60").json()
+    assert [poly["name"] for poly in found] == ["moved", "deleted"]
+
+    with session() as db:
+        moved = db.query(Poly).filter(Poly.name == "moved").first()
+        moved.xmin, moved.xmax = 40, 50
+        db.query(Poly).filter(Poly.name == "deleted").delete()
+        db.commit()
+
+    assert client.get(f"{url}?row=5&column=5").json() == []
+    found = client.get(f"{url}?row=45&column=5").json()
+    assert [poly["name"] for poly in found] == ["moved"]
+    assert client.get(f"{url}?row=25&column=25").json() == []
+    with session() as db:
+        assert spatial_service.spatial_index.search(db, (20, 20, 30, 30)).size == 0
@@ -0,0 +1,242 @@
+"""
+Polygon statistics tests.
+"""
+import json
+
+import numpy as np
+import pytest
+
+from app.models import Poly
+from app.services.file_management import load_nparray_from_file
+from app.services.filling_service import expand_to_canvas, fill_polyline
+from app.services.stats_service import mask_stats, polygon_area, polygon_stats
+
+
+def square(first, last):
+    """
+    Vertices of a square ring, clockwise on the canvas.
+    """
+    return [[first, first], [first, last], [last, last], [last, first]]
+
+
+def row_extents(mask):
+    """
+    Extent of every filled row of a mask.
+    """
+    extents = []
+    for row in np.flatnonzero(mask.any(axis=1)):
+        columns = np.flatnonzero(mask[row])
+        extents.append([int(row), int(columns[0]), int(columns[-1]) + 1])
+
+    return extents
+
+
+@pytest.mark.parametrize(
+    "algorithm, vertices",
+    [("fast", np.round), ("rourke", np.round), ("rourke", np.asarray)],
+)
+def test_polygon_stats_match_fill(algorithm, vertices):
+    """
+    Testing pixels and row extents match the rourke fill, and the fast one
+    for integer vertices.
+    """
+    generator = np.random.default_rng(7)
+
+    for _ in range(100):
+        points = vertices(generator.uniform(-5, 45, (generator.integers(3, 10), 2)))
+        result = fill_polyline(points, algorithm, canvas=(40, 40))
+        mask = expand_to_canvas(result) != 0
+
+        stats = polygon_stats(points, canvas=(40, 40), extents=True, band_rows=7)
+
+        assert stats["pixels"] == mask.sum()
+        assert stats["extents"] == row_extents(mask)
+        if mask.any():
+            rows, columns = np.nonzero(mask)
+            bbox = [rows.min(), columns.min(), rows.max(), columns.max()]
+            assert stats["pixel_bbox"] == bbox
+
+
+def test_polygon_stats_float_vertices():
+    """
+    Testing pixels of float vertices follow the rourke fill, not the fast one.
+    """
+    points = np.array([[43.2, 32.6], [18.0, 23.0], [10.9, 44.1]])
+
+    stats = polygon_stats(points, canvas=(40, 40))
+    rourke = expand_to_canvas(fill_polyline(points, "rourke", canvas=(40, 40)))
+    fast = expand_to_canvas(fill_polyline(points, "fast", canvas=(40, 40)))
+
+    assert stats["pixels"] == (rourke != 0).sum() == 273
+    assert (fast != 0).sum() == 272
+
+
+@pytest.mark.parametrize(
+    "fill_rule, reverse, area",
+    [
+        ("evenodd", False, 1700),
+        ("evenodd", True, 1700),
+        ("nonzero", False, 1800),
+        ("nonzero", True, 1700),
+    ],
+)
+def test_polygon_area_rings(fill_rule, reverse, area):
+    """
+    Testing holes and disjoint rings under both fill rules.
+    """
+    hole = square(10, 20)[::-1] if reverse else square(10, 20)
+    rings = [square(0, 40), hole, [[50, 50], [50, 70], [60, 70], [60, 50]]]
+    points = np.array(sum(rings, []), dtype=np.float64)
+
+    stats = polygon_stats(points, [4, 4, 4], (100, 100), fill_rule)
+    result = fill_polyline(
+        points, "rourke", canvas=(100, 100), rings=[4, 4, 4], fill_rule=fill_rule
+    )
+
+    assert stats["area"] == area
+    assert stats["pixels"] == (expand_to_canvas(result) != 0).sum()
+    if area == 1700:
+        row = (1600 * 20 - 100 * 15 + 200 * 55) / 1700
+        column = (1600 * 20 - 100 * 15 + 200 * 60) / 1700
+        assert stats["centroid"] == pytest.approx([row, column])
+
+
+def test_polygon_area_degenerate():
+    """
+    Testing a polygon without area has no centroid.
+    """
+    assert polygon_area(np.array([[0, 0], [5, 5], [10, 10]], dtype=np.float64)) == (
+        0.0,
+        None,
+    )
+    with pytest.raises(ValueError):
+        polygon_area(np.array(square(0, 5), dtype=np.float64), fill_rule="winding")
+
+
+def test_mask_stats():
+    """
+    Testing the statistics of a mask in canvas coordinates.
+    """
+    mask = np.zeros((12, 9), dtype=np.uint8)
+    mask[2:5, 3:8] = 1
+    mask[9, 1] = 1
+
+    stats = mask_stats(mask, (100, 10), extents=True, band_rows=4)
+
+    rows, columns = np.nonzero(mask)
+    assert stats["pixels"] == stats["area"] == 16
+    assert stats["centroid"] == pytest.approx([rows.mean() + 100, columns.mean() + 10])
+    assert stats["pixel_bbox"] == [102, 11, 109, 17]
+    assert stats["extents"][-1] == [109, 11, 12]
+
+
+@pytest.mark.parametrize(
+    "algorithm, seed",
+    [("outline", {}), ("flood", {"flood_x": 20, "flood_y": 20}), ("fast", {})],
+)
+def test_stored_pixels_match_mask(client, algorithm, seed):
+    """
+    Testing the stored pixels are the ones of the mask of any algorithm.
+    """
+    vertices = [[5.5, 5.2], [5.1, 40.7], [40.3, 40.6], [40.8, 5.4]]
+    response = client.post(
+        "/api/v1/polys",
+        json={
+            "name": algorithm,
+            "npinput": json.dumps(vertices),
+            "algorithm": algorithm,
+            "imagefile": None,
+            "arrayfile": None,
+            "exectime": None,
+            "canvas_height": 60,
+            "canvas_width": 60,
+            "preview": False,
+            **seed,
+        },
+    )
+    body = response.json()
+    mask, _ = load_nparray_from_file(body["file_url"])
+    area, _ = polygon_area(np.array(vertices))
+
+    assert body["pixels"] == mask.sum()
+    assert body["area"] == pytest.approx(area)
+    poly_id = client.get("/api/v1/polys").json()[0]["id"]
+    stats = client.get(f"/api/v1/polys/{poly_id}/stats").json()
+    assert stats["pixels"] == mask.sum()
+    assert stats["area"] == pytest.approx(area)
+
+    client.delete(f"/api/v1/polys/{poly_id}")
+
+
+def test_stats_endpoints(client, session):
+    """
+    Testing stats of polygons, stored polys and listings sorted by area.
+    """
+    sizes = {"small": 10, "large": 40, "medium": 25}
+    for name, size in sizes.items():
+        response = client.post(
+            "/api/v1/polys",
+            json={
+                "name": name,
+                "npinput": json.dumps(square(5, 5 + size)),
+                "algorithm": "rourke",
+                "imagefile": None,
+                "arrayfile": None,
+                "exectime": None,
+                "canvas_height": 60,
+                "canvas_width": 60,
+                "preview": False,
+            },
+        )
+        assert response.status_code == 201
+        assert response.json()["area"] == size * size
+        assert response.json()["pixels"] == (size + 1) ** 2
+
+    stats = client.post(
+        "/api/v1/polys/stats?canvas_height=60&canvas_width=60&extents=true",
+        content=json.dumps(square(5, 45)),
+    ).json()
+    assert stats["area"] == 1600
+    assert stats["pixels"] == 41 * 41
+    assert stats["centroid"] == [25, 25]
+    assert stats["bbox"] == stats["pixel_bbox"] == [5, 5, 45, 45]
+    assert len(stats["extents"]) == 41
+    assert client.get("/api/v1/polys/2/stats").json() == {
+        key: value for key, value in stats.items() if key != "extents"
+    }
+
+    packed = np.array(square(5, 45), dtype="<i4").tobytes()
+    response = client.post("/api/v1/polys/stats?dtype=int32", content=packed)
+    assert response.json()["pixels"] == 41 * 41
+    assert client.post("/api/v1/polys/stats", content="[[1, 2]").status_code == 400
+    response = client.post("/api/v1/polys/stats?canvas_width=0", content="[[1, 1]]")
+    assert response.status_code == 400
+
+    # polys stored before their statistics are computed once asked for
+    with session() as db:
+        db.query(Poly).filter(Poly.id == 1).update({"area": None, "pixels": None})
+        db.commit()
+    assert client.get("/api/v1/polys/1/stats").json()["pixels"] == 121
+    assert client.get("/api/v1/polys/1").json()["area"] == 100
+    assert client.get("/api/v1/polys/9/stats").status_code == 404
+
+    response = client.get("/api/v1/polys?sort=area&limit=2&fields=name,area")
+    assert [poly["name"] for poly in response.json()] == ["small", "medium"]
+    response = client.get(response.links["next"]["url"])
+    assert [poly["name"] for poly in response.json()] == ["large"]
+    response = client.get("/api/v1/polys?sort=-area&min_area=200&fields=name")
+    assert [poly["name"] for poly in response.json()] == ["large", "medium"]
+    response = client.get("/api/v1/polys?max_area=700&fields=name")
+    assert [poly["name"] for poly in response.json()] == ["small", "medium"]
+    assert client.get("/api/v1/polys?sort=name").status_code == 400
+
+    union = client.post(
+        "/api/v1/polys/combine",
+        json={"operation": "union", "ids": [1, 3], "name": "union"},
+    ).json()
+    stats = client.get(f"/api/v1/polys/{union['id']}/stats").json()
+    assert union["pixels"] == stats["pixels"] == stats["area"] == 26 * 26
+    assert stats["pixel_bbox"] == [5, 5, 30, 30]
+
+    for poly in client.get("/api/v1/polys").json():
+        client.delete(f"/api/v1/polys/{poly['id']}")
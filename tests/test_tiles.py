@@ -0,0 +1,120 @@
+"""
+Tiled mask tests.
+"""
+import json
+
+import numpy as np
+import pytest
+
+from app.services.bitmask_service import BitMask
+from app.services.file_management import (load_nparray_from_file,
+                                          load_tile_from_file,
+                                          save_nparray_to_file)
+from app.services.tile_service import (decode_tile, encode_tile, mask_tile,
+                                       tile_levels, tile_pyramid)
+
+
+def random_mask(seed, shape):
+    """
+    Sparse random mask.
+    """
+    generator = np.random.default_rng(seed)
+
+    return (generator.random(shape) < 0.01).astype(np.uint8)
+
+
+@pytest.mark.parametrize("offset", [(0, 0), (5, 30), (40, 17)])
+def test_pyramid_matches_pooling(offset):
+    """
+    Testing every tile of the pyramid is the pooled window of the mask.
+    """
+    mask = random_mask(sum(offset), (70, 90))
+    tiles = {
+        (level, tx, ty): tile
+        for level, tx, ty, tile in tile_pyramid(BitMask.from_array(mask), offset, 16)
+    }
+    levels = tile_levels((offset[0] + 70, offset[1] + 90), 16)
+
+    for level in range(levels):
+        for tx in range(-(-(offset[1] + 90) // 16)):
+            for ty in range(-(-(offset[0] + 70) // 16)):
+                expected = mask_tile(mask, offset, level, tx, ty, 16)
+                tile = tiles.pop((level, tx, ty), np.zeros((16, 16), np.uint8))
+                assert (tile == expected).all()
+
+    assert not tiles
+
+
+def test_encoded_tiles():
+    """
+    Testing tiles survive encoding and decoding.
+    """
+    tile = random_mask(1, (32, 32))
+
+    assert (decode_tile(encode_tile(tile), 32) == tile).all()
+    with pytest.raises(ValueError):
+        next(tile_pyramid(tile, (0, 0), 12))
+
+
+def test_saved_tiles():
+    """
+    Testing tiled files load whole and one tile at a time.
+    """
+    mask = random_mask(2, (300, 600))
+    mask[:, 260:] = 0
+    path = save_nparray_to_file(mask, "tiles-test", "tiles", (10, 20), "rourke")
+
+    try:
+        loaded, header = load_nparray_from_file(path)
+        assert (loaded == mask).all()
+        assert header["offset"] == [10, 20]
+        assert header["levels"] == 3
+        assert "0/2/0" not in header["tiles"]
+        assert load_tile_from_file(path, 0, 2, 0) is None
+        tile = load_tile_from_file(path, 1, 0, 0)
+        assert (tile == mask_tile(mask, (10, 20), 1, 0, 0, 256)).all()
+        with pytest.raises(ValueError):
+            load_tile_from_file(path, 3, 0, 0)
+    finally:
+        path.unlink()
+
+
+def test_tile_endpoint(client):
+    """
+    Testing tiles of tiled, npy and packbits masks are served alike.
+    """
+    for array_format in ["tiles", "npy", "packbits"]:
+        response = client.post(
+            "/api/v1/polys",
+            json={
+                "name": array_format,
+                "npinput": json.dumps([[10, 10], [10, 500], [300, 250]]),
+                "algorithm": "rourke",
+                "array_format": array_format,
+                "imagefile": None,
+                "arrayfile": None,
+                "exectime": None,
+                "canvas_height": 600,
+                "canvas_width": 600,
+                "preview": False,
+            },
+        )
+        assert response.status_code == 201
+
+    bodies = []
+    for poly_id in [1, 2, 3]:
+        url = f"/api/v1/polys/{poly_id}/tiles"
+        response = client.get(f"{url}/0/1/0?output=binary")
+        assert response.status_code == 200
+        bodies.append(response.content)
+        assert client.get(f"{url}/0/2/2").status_code == 204
+        assert client.get(f"{url}/1/0/0").headers["content-type"] == "image/png"
+        assert client.get(f"{url}/5/0/0").status_code == 400
+
+    assert bodies[0] == bodies[1] == bodies[2]
+    assert len(bodies[0]) == 256 * 256
+    assert client.get("/api/v1/polys/9/tiles/0/0/0").status_code == 404
+
+    client.delete("/api/v1/polys/1")
+    client.delete("/api/v1/polys/2")
+    client.delete("/api/v1/polys/3")
@@ -0,0 +1,72 @@
+"""
+Polygon vertices tests.
+"""
+import json
+
+import numpy as np
+import pytest
+
+from app.services.vertex_service import (pack_vertices, parse_binary_vertices,
+                                         parse_ring_sizes, parse_rings,
+                                         parse_vertices, unpack_vertices,
+                                         vertices_bbox, vertices_json)
+
+
+def test_parse_vertices_matches_json():
+    """
+    Testing the JSON pairs are parsed like json.loads does.
+    """
+    npinput = "[[1, 1], [1.5, -2e1],\n [30, 4]]"
+
+    assert parse_vertices(npinput).tolist() == json.loads(npinput)
+
+
+@pytest.mark.parametrize(
+    "npinput",
+    ["[]", "[[1, 2], [3]]", "[[1, 2] [3, 4]]", "[[1 2, 3]]", "[[1, x]]", "[[1, 2]],"],
+)
+def test_parse_vertices_malformed(npinput):
+    """
+    Testing malformed or empty vertex arrays are rejected.
+    """
+    with pytest.raises(ValueError):
+        parse_vertices(npinput)
+
+
+def test_binary_vertices():
+    """
+    Testing the packed pairs round trip through storage.
+    """
+    points = np.array([[1, 1], [1, 50], [50, 50]])
+
+    parsed = parse_binary_vertices(points.astype("<i4").tobytes(), "int32")
+    packed, dtype = pack_vertices(parsed)
+
+    assert dtype == "int32"
+    assert len(packed) == 24
+    assert (unpack_vertices(packed, dtype) == points).all()
+    assert vertices_json(parsed, dtype) == "[[1,1],[1,50],[50,50]]"
+    assert vertices_bbox(parsed) == (1.0, 1.0, 50.0, 50.0)
+
+    with pytest.raises(ValueError):
+        parse_binary_vertices(b"\x00" * 12, "float64")
+    assert pack_vertices(np.array([[0.5, 1.0]]))[1] == "float64"
+
+
+def test_parse_rings():
+    """
+    Testing arrays of rings are parsed into one array and ring sizes.
+    """
+    points, rings = parse_rings(
+        "[[[0, 0], [0, 9], [9, 9]], [[2, 2], [2, 4], [4, 4], [4, 2]]]"
+    )
+
+    assert points.shape == (7, 2)
+    assert rings == [3, 4]
+    assert parse_rings("[[[1, 2], [3, 4]]]")[1] is None
+    assert vertices_json(points, "int32", rings).startswith("[[[0,0],[0,9],[9,9]],")
+
+    with pytest.raises(ValueError):
+        parse_rings("[[[1, 2]], [3, 4]]")
+    with pytest.raises(ValueError):
+        parse_ring_sizes("3,3", 7)